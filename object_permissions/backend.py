@@ -2,7 +2,8 @@ from django.conf import settings
 from django.db import models, IntegrityError
 from django.contrib.auth.models import User
 
-from object_permissions.registration import permission_map, user_has_perm
+from object_permissions.registration import permission_map, \
+    get_user_perms, get_user_perms_many, get_cache_generation
 
 class ObjectPermBackend(object):
     supports_object_permissions = True
@@ -43,7 +44,7 @@ class ObjectPermBackend(object):
         if obj is None:
             return False
 
-        return user_has_perm(user_obj, perm, obj, True)
+        return perm in self._get_cached_perms(user_obj, obj)
 
     def get_all_permissions(self, user_obj, obj=None):
         """
@@ -61,21 +62,7 @@ class ObjectPermBackend(object):
         if obj is None or not isinstance(obj, models.Model):
             return []
 
-        model = obj.__class__
-        permissions = permission_map[model]
-
-        q = permissions.objects.filter(
-            models.Q(group__user=user_obj) | models.Q(user=user_obj),
-            obj=obj)
-
-        # Extract all set permissions from each row in the query.
-        rv = set()
-        for row in q:
-            rv.update(field.name for field in row._meta.fields
-                if isinstance(field, models.IntegerField)
-                and getattr(row, field.name))
-
-        return list(rv)
+        return list(self._get_cached_perms(user_obj, obj))
 
     def get_group_permissions(self, user_obj, obj=None):
         """
@@ -91,16 +78,35 @@ class ObjectPermBackend(object):
         if obj is None or not isinstance(obj, models.Model):
             return []
 
-        model = obj.__class__
-        permissions = permission_map[model]
+        return get_user_perms_many(user_obj, [obj], 'only')[obj]
 
-        q = permissions.objects.filter(groups__user=user_obj, obj=obj)
-
-        # Extract all set permissions from each row in the query.
-        rv = set()
-        for row in q:
-            rv.update(field.name for field in row._meta.fields
-                if isinstance(field, models.BooleanField)
-                and getattr(row, field.name))
+    def _get_cached_perms(self, user_obj, obj):
+        """
+        Return the set of permissions the user has on the given object,
+        including permissions given through groups.
 
-        return list(rv)
+        Permissions are loaded once per object and cached on the user, the
+        same way ModelBackend caches global permissions in _perm_cache.  Since
+        the user object lives for a single request the cache does too.  The
+        cache is discarded whenever permissions or group memberships change.
+        """
+        if not (isinstance(obj, models.Model)
+                and obj.__class__ in permission_map):
+            return frozenset()
+
+        generation = get_cache_generation()
+        try:
+            cache_generation, cache = user_obj._object_perm_cache
+        except AttributeError:
+            cache_generation, cache = None, None
+
+        if cache_generation != generation:
+            cache = {}
+            user_obj._object_perm_cache = generation, cache
+
+        key = obj.__class__, obj.pk
+        try:
+            return cache[key]
+        except KeyError:
+            perms = cache[key] = frozenset(get_user_perms(user_obj, obj, True))
+            return perms
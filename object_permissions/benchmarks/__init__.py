@@ -0,0 +1,201 @@
+"""
+Benchmarks for permission checks.
+
+Seeds users, groups, memberships, objects and permissions using the TESTING
+models, then times the permission APIs and records how many queries each call
+makes.  Reports are plain dictionaries that can be written as JSON and
+compared between commits.
+
+This is normally run with the benchmark_perms management command, which
+creates a test database for the data:
+
+    $ ./manage.py benchmark_perms --users 1000 --objects 5000 -o report.json
+
+Both TESTING = True and the TESTING models are required.
+"""
+
+import platform
+import random
+from datetime import datetime
+from timeit import default_timer
+
+import django
+from django.contrib.auth.models import User, Group
+from django.db import connection
+
+from object_permissions.backend import ObjectPermBackend
+from object_permissions.registration import TESTING, bulk_grant, \
+    get_groups_any, get_user_perms, get_users_any, user_has_perm, \
+    user_has_any_perms, user_get_objects_any_perms
+
+if TESTING:
+    from object_permissions.registration import TestModel, TestModelChild
+
+
+PERMS = ['Perm1', 'Perm2', 'Perm3', 'Perm4']
+
+DEFAULTS = {
+    'users':100,
+    'groups':10,
+    'memberships':2,
+    'objects':200,
+    'children':2,
+    'user_perms':10,
+    'group_perms':20,
+    'iterations':100,
+    'seed':0,
+}
+"""
+Default volumes.  memberships is the number of groups per user, user_perms
+and group_perms are the number of objects each user or group has perms on.
+"""
+
+
+def seed(users, groups, memberships, objects, children, user_perms,
+         group_perms, seed=0, **kwargs):
+    """
+    Create benchmark data.  Each user and group gets a random subset of the
+    perms on randomly chosen objects and children.
+
+    @return dict of the created users, groups, objects and children
+    """
+    rng = random.Random(seed)
+    data = {
+        'users':[User.objects.create(username='bench%s' % i)
+                 for i in xrange(users)],
+        'groups':[Group.objects.create(name='bench%s' % i)
+                  for i in xrange(groups)],
+        'objects':[TestModel.objects.create(name='bench%s' % i)
+                   for i in xrange(objects)],
+    }
+    data['children'] = [TestModelChild.objects.create(parent=obj)
+                        for obj in data['objects'] for i in xrange(children)]
+
+    for user in data['users']:
+        if data['groups']:
+            user.groups.add(*rng.sample(data['groups'],
+                                        min(memberships, groups)))
+
+    for principals, count in ((data['users'], user_perms),
+                              (data['groups'], group_perms)):
+        for principal in principals:
+            perms = rng.sample(PERMS, rng.randint(1, len(PERMS)))
+            for instances in (data['objects'], data['children']):
+                if instances:
+                    targets = rng.sample(instances, min(count, len(instances)))
+                    bulk_grant([principal], perms, targets)
+    return data
+
+
+_backend = None
+
+
+def _backend_call(method, user, *args):
+    """
+    Call a backend method without the per request cache of the user.
+    """
+    global _backend
+    if _backend is None:
+        _backend = ObjectPermBackend()
+    user.__dict__.pop('_object_perm_cache', None)
+    return getattr(_backend, method)(user, *args)
+
+
+BENCHMARKS = (
+    ('user_has_perm', lambda user, obj, child:
+        user_has_perm(user, 'Perm1', obj)),
+    ('user_has_perm_no_groups', lambda user, obj, child:
+        user_has_perm(user, 'Perm1', obj, False)),
+    ('user_has_any_perms', lambda user, obj, child:
+        user_has_any_perms(user, obj, ['Perm1', 'Perm2'])),
+    ('user_has_any_perms_model', lambda user, obj, child:
+        user_has_any_perms(user, TestModel, ['Perm1', 'Perm2'])),
+    ('get_user_perms', lambda user, obj, child:
+        get_user_perms(user, obj)),
+    ('get_users_any', lambda user, obj, child:
+        list(get_users_any(obj, ['Perm1', 'Perm2']))),
+    ('get_groups_any', lambda user, obj, child:
+        list(get_groups_any(obj, ['Perm1', 'Perm2']))),
+    ('user_get_objects_any_perms', lambda user, obj, child:
+        list(user_get_objects_any_perms(user, TestModel, ['Perm1']))),
+    ('user_get_objects_any_perms_in', lambda user, obj, child:
+        list(user_get_objects_any_perms(user, TestModel, ['Perm1'],
+                                        strategy='in'))),
+    ('user_get_objects_any_perms_exists', lambda user, obj, child:
+        list(user_get_objects_any_perms(user, TestModel, ['Perm1'],
+                                        strategy='exists'))),
+    ('user_get_objects_any_perms_related', lambda user, obj, child:
+        list(user_get_objects_any_perms(user, TestModelChild, ['Perm1'],
+                                        parent=['Perm1']))),
+    ('backend_has_perm', lambda user, obj, child:
+        _backend_call('has_perm', user, 'Perm1', obj)),
+    ('backend_get_all_permissions', lambda user, obj, child:
+        _backend_call('get_all_permissions', user, obj)),
+    ('backend_get_group_permissions', lambda user, obj, child:
+        _backend_call('get_group_permissions', user, obj)),
+)
+"""
+Benchmarked calls, each is passed a random user, object and child object.
+"""
+
+
+def run(data, iterations, seed=0, names=None, **kwargs):
+    """
+    Time each benchmark.
+
+    @param data - benchmark data created by seed()
+    @param iterations - number of calls per benchmark
+    @param names - only run these benchmarks
+    @return dict mapping benchmark names to their timings and query counts
+    """
+    rng = random.Random(seed)
+    results = {}
+    debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        for name, function in BENCHMARKS:
+            if names and name not in names:
+                continue
+
+            times, queries = [], 0
+            for i in xrange(iterations):
+                args = (rng.choice(data['users']), rng.choice(data['objects']),
+                        rng.choice(data['children']))
+                query_count = len(connection.queries)
+                start = default_timer()
+                function(*args)
+                times.append(default_timer() - start)
+                queries += len(connection.queries) - query_count
+
+            times.sort()
+            results[name] = {
+                'iterations':iterations,
+                'queries':float(queries) / iterations,
+                'mean_ms':sum(times) / len(times) * 1000,
+                'median_ms':times[len(times) / 2] * 1000,
+                'min_ms':times[0] * 1000,
+                'max_ms':times[-1] * 1000,
+            }
+    finally:
+        connection.use_debug_cursor = debug_cursor
+        connection.queries = []
+    return results
+
+
+def report(config, results, label=None):
+    """
+    Build a report from benchmark results, suitable for writing as JSON.
+
+    @param config - volumes and options the benchmarks were run with
+    @param results - results returned by run()
+    @param label - optional label, e.g. a commit id
+    """
+    return {
+        'label':label,
+        'date':datetime.now().isoformat(),
+        'python':platform.python_version(),
+        'django':django.get_version(),
+        'database':connection.vendor,
+        'config':config,
+        'results':results,
+    }
@@ -0,0 +1,11 @@
+from django.conf import settings
+
+
+if getattr(settings, 'OBJECT_PERMISSIONS_LAZY_MODELS', False):
+    # syncdb, flush and south import this module before they look for tables
+    # to create, build the permission models of all registered models first.
+    from django.db.models import get_apps
+    from object_permissions.registration import build_perm_models
+
+    get_apps()
+    build_perm_models()
@@ -0,0 +1,74 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from object_permissions import benchmarks
+from object_permissions.registration import TESTING
+
+
+def _option(name, help):
+    return make_option('--%s' % name.replace('_', '-'), dest=name, type='int',
+                       default=benchmarks.DEFAULTS[name],
+                       help='%s (default %s)' % (help, benchmarks.DEFAULTS[name]))
+
+
+class Command(BaseCommand):
+    args = '[benchmark benchmark ...]'
+    help = 'Seed a test database with permissions and time the permission ' \
+           'APIs.  Runs all benchmarks unless names are given.  Requires ' \
+           'settings.TESTING.'
+
+    option_list = BaseCommand.option_list + (
+        _option('users', 'number of users'),
+        _option('groups', 'number of groups'),
+        _option('memberships', 'number of groups per user'),
+        _option('objects', 'number of TestModel objects'),
+        _option('children', 'number of TestModelChild objects per object'),
+        _option('user_perms', 'number of objects each user has perms on'),
+        _option('group_perms', 'number of objects each group has perms on'),
+        _option('iterations', 'number of calls per benchmark'),
+        _option('seed', 'random seed'),
+        make_option('-o', '--output', dest='output',
+            help='write the report as JSON to this file'),
+        make_option('--label', dest='label',
+            help='label stored in the report, e.g. a commit id'),
+        make_option('--noinput', action='store_false', dest='interactive',
+            default=True, help='do not prompt before replacing an existing '
+                               'test database'),
+    )
+
+    def handle(self, *args, **options):
+        if not TESTING:
+            raise CommandError('benchmarks require settings.TESTING = True')
+
+        names = [name for name, function in benchmarks.BENCHMARKS]
+        for name in args:
+            if name not in names:
+                raise CommandError('Unknown benchmark: %s' % name)
+
+        config = dict((name, options[name]) for name in benchmarks.DEFAULTS)
+        verbosity = int(options.get('verbosity', 1))
+        old_name = connection.creation.create_test_db(verbosity,
+            autoclobber=not options.get('interactive', True))
+        try:
+            data = benchmarks.seed(**config)
+            results = benchmarks.run(data, names=args, **config)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity)
+
+        report = benchmarks.report(config, results, options.get('label'))
+        if options.get('output'):
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+        if verbosity > 0:
+            self.stdout.write('%-40s %10s %10s %10s\n'
+                              % ('benchmark', 'queries', 'mean ms', 'max ms'))
+            for name in names:
+                if name in results:
+                    result = results[name]
+                    self.stdout.write('%-40s %10.1f %10.2f %10.2f\n'
+                        % (name, result['queries'], result['mean_ms'],
+                           result['max_ms']))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from object_permissions.registration import get_class
+from object_permissions.snapshot import dump_perms
+
+
+class Command(BaseCommand):
+    args = '<file> [model model ...]'
+    help = 'Write the permissions of registered models to a snapshot file. ' \
+           'Writes all models unless model class names are given.'
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Enter the name of the snapshot file')
+        try:
+            models = [get_class(name) for name in args[1:]] or None
+        except KeyError as e:
+            raise CommandError('Unknown model: %s' % e.args[0])
+
+        with open(args[0], 'wb') as out:
+            counts = dump_perms(out, models)
+
+        if int(options.get('verbosity', 1)) > 0:
+            for model in sorted(counts, key=lambda model: model.__name__):
+                self.stdout.write('Wrote %d rows of %s\n'
+                                  % (counts[model], model.__name__))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from object_permissions.registration import UnknownPermissionException
+from object_permissions.snapshot import SnapshotError, load_perms
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = 'Load permissions from a snapshot file written by dump_perms. ' \
+           'Replaces all permissions of the models in the snapshot.'
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Enter the name of the snapshot file')
+
+        try:
+            with open(args[0], 'rb') as stream:
+                counts = load_perms(stream)
+        except (IOError, SnapshotError) as e:
+            raise CommandError(str(e))
+        except UnknownPermissionException as e:
+            raise CommandError('Unknown permission in snapshot: %s' % e)
+
+        if int(options.get('verbosity', 1)) > 0:
+            for model in sorted(counts, key=lambda model: model.__name__):
+                self.stdout.write('Loaded %d rows of %s\n'
+                                  % (counts[model], model.__name__))
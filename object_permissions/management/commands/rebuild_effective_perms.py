@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from object_permissions.registration import effective_map, get_class, \
+    rebuild_effective_perms
+
+
+class Command(BaseCommand):
+    args = '[model model ...]'
+    help = 'Rebuild effective permissions from user and group permissions. ' \
+           'Rebuilds all models registered with effective permissions ' \
+           'unless model class names are given.'
+
+    def handle(self, *args, **options):
+        if args:
+            try:
+                models = [get_class(name) for name in args]
+            except KeyError as e:
+                raise CommandError('Unknown model: %s' % e.args[0])
+        else:
+            models = effective_map.keys()
+
+        for model in models:
+            if model not in effective_map:
+                raise CommandError('%s is not registered with effective '
+                                   'permissions' % model.__name__)
+            rebuild_effective_perms(model)
+            if int(options.get('verbosity', 1)) > 0:
+                self.stdout.write('Rebuilt effective permissions for %s\n'
+                                  % model.__name__)
@@ -0,0 +1,29 @@
+from django.core.management.base import NoArgsCommand
+
+from object_permissions.registration import get_registration_report
+
+
+class Command(NoArgsCommand):
+    help = 'Report how long registering models for permissions took, ' \
+           'slowest models first.'
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if verbosity < 1:
+            return
+
+        report = get_registration_report()
+        self.stdout.write('%d models registered, %d built, %d pending\n'
+                          % (report['registered'], report['built'],
+                             report['pending']))
+        self.stdout.write('register %.1f ms, build %.1f ms\n'
+                          % (report['register_seconds'] * 1000,
+                             report['build_seconds'] * 1000))
+
+        if verbosity > 1:
+            models = sorted(report['models'].items(), reverse=True,
+                            key=lambda item: sum(item[1].values()))
+            for name, times in models:
+                self.stdout.write('%-50s %8.2f ms %8.2f ms\n'
+                                  % (name, times['register'] * 1000,
+                                     times['build'] * 1000))
@@ -0,0 +1,203 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+from object_permissions.migrations import db_table_exists
+
+# permission tables and their permission columns.  Test tables only exist
+# when they were created in TESTING mode.
+TABLES = (
+    ('object_permissions.group_perms', ['admin']),
+    ('object_permissions.testmodel_perms', ['Perm1', 'Perm2', 'Perm3', 'Perm4']),
+    ('object_permissions.testmodelchild_perms', ['Perm1', 'Perm2', 'Perm3', 'Perm4']),
+    ('object_permissions.testmodelchildchild_perms', ['Perm1', 'Perm2', 'Perm3', 'Perm4']),
+    ('object_permissions.testmodelbitmask_perms', ['bitmask']),
+)
+
+class Migration(SchemaMigration):
+
+    def merge_duplicates(self, table, perms, principal):
+        """
+        Merge rows granting perms to the same user or group on the same
+        object, the unique constraints can't be created while they exist.
+        """
+        rows = {}
+        for row in table.objects.filter(**{'%s__isnull' % principal:False}) \
+                .order_by('id'):
+            key = (getattr(row, '%s_id' % principal), row.obj_id)
+            if key not in rows:
+                rows[key] = row
+                continue
+            first = rows[key]
+            for perm in perms:
+                setattr(first, perm, getattr(first, perm) | getattr(row, perm))
+            first.save()
+            row.delete()
+    
+    def forwards(self, orm):
+        
+        for name, perms in TABLES:
+            table = orm[name]
+            if not db_table_exists(table._meta.db_table):
+                continue
+            if not db.dry_run:
+                self.merge_duplicates(table, perms, 'user')
+                self.merge_duplicates(table, perms, 'group')
+
+            # Adding unique constraint, fields ['user', 'obj']
+            db.create_unique(table._meta.db_table, ['user_id', 'obj_id'])
+
+            # Adding unique constraint, fields ['group', 'obj']
+            db.create_unique(table._meta.db_table, ['group_id', 'obj_id'])
+
+        # Adding index on 'TestModel_Perms', fields ['obj', 'Perm1']
+        if db_table_exists('object_permissions_testmodel_perms'):
+            db.create_index('object_permissions_testmodel_perms', ['obj_id', 'Perm1'])
+    
+    
+    def backwards(self, orm):
+        
+        # Removing index on 'TestModel_Perms', fields ['obj', 'Perm1']
+        if db_table_exists('object_permissions_testmodel_perms'):
+            db.delete_index('object_permissions_testmodel_perms', ['obj_id', 'Perm1'])
+
+        for name, perms in TABLES:
+            table = orm[name]
+            if not db_table_exists(table._meta.db_table):
+                continue
+
+            # Removing unique constraint, fields ['group', 'obj']
+            db.delete_unique(table._meta.db_table, ['group_id', 'obj_id'])
+
+            # Removing unique constraint, fields ['user', 'obj']
+            db.delete_unique(table._meta.db_table, ['user_id', 'obj_id'])
+    
+    
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'blank': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'object_permissions.group_perms': {
+            'Meta': {'unique_together': "(('user', 'obj'), ('group', 'obj'))", 'object_name': 'Group_Perms'},
+            'admin': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'Group_gperms'", 'null': 'True', 'to': "orm['auth.Group']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'obj': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'operms'", 'to': "orm['auth.Group']"}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'Group_uperms'", 'null': 'True', 'to': "orm['auth.User']"})
+        },
+        'object_permissions.testmodel': {
+            'Meta': {'object_name': 'TestModel'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'})
+        },
+        'object_permissions.testmodel_effectiveperms': {
+            'Meta': {'unique_together': "(('user', 'obj'),)", 'object_name': 'TestModel_EffectivePerms'},
+            'Perm1': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm2': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm3': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm4': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'obj': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'eperms'", 'to': "orm['object_permissions.TestModel']"}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'TestModel_eperms'", 'to': "orm['auth.User']"})
+        },
+        'object_permissions.testmodel_perms': {
+            'Meta': {'unique_together': "(('user', 'obj'), ('group', 'obj'))", 'object_name': 'TestModel_Perms'},
+            'Perm1': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm2': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm3': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm4': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'TestModel_gperms'", 'null': 'True', 'to': "orm['auth.Group']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'obj': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'operms'", 'to': "orm['object_permissions.TestModel']"}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'TestModel_uperms'", 'null': 'True', 'to': "orm['auth.User']"})
+        },
+        'object_permissions.testmodelchild': {
+            'Meta': {'object_name': 'TestModelChild'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'parent': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['object_permissions.TestModel']", 'null': 'True'})
+        },
+        'object_permissions.testmodelchild_perms': {
+            'Meta': {'unique_together': "(('user', 'obj'), ('group', 'obj'))", 'object_name': 'TestModelChild_Perms'},
+            'Perm1': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm2': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm3': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm4': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'TestModelChild_gperms'", 'null': 'True', 'to': "orm['auth.Group']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'obj': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'operms'", 'to': "orm['object_permissions.TestModelChild']"}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'TestModelChild_uperms'", 'null': 'True', 'to': "orm['auth.User']"})
+        },
+        'object_permissions.testmodelchildchild': {
+            'Meta': {'object_name': 'TestModelChildChild'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'parent': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['object_permissions.TestModelChild']", 'null': 'True'})
+        },
+        'object_permissions.testmodelchildchild_perms': {
+            'Meta': {'unique_together': "(('user', 'obj'), ('group', 'obj'))", 'object_name': 'TestModelChildChild_Perms'},
+            'Perm1': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm2': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm3': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'Perm4': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'TestModelChildChild_gperms'", 'null': 'True', 'to': "orm['auth.Group']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'obj': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'operms'", 'to': "orm['object_permissions.TestModelChildChild']"}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'TestModelChildChild_uperms'", 'null': 'True', 'to': "orm['auth.User']"})
+        },
+        'object_permissions.testmodelbitmask': {
+            'Meta': {'object_name': 'TestModelBitmask'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'parent': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['object_permissions.TestModel']", 'null': 'True'})
+        },
+        'object_permissions.testmodelbitmask_effectiveperms': {
+            'Meta': {'unique_together': "(('user', 'obj'),)", 'object_name': 'TestModelBitmask_EffectivePerms'},
+            'bitmask': ('django.db.models.fields.BigIntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'obj': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'eperms'", 'to': "orm['object_permissions.TestModelBitmask']"}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'TestModelBitmask_eperms'", 'to': "orm['auth.User']"})
+        },
+        'object_permissions.testmodelbitmask_perms': {
+            'Meta': {'unique_together': "(('user', 'obj'), ('group', 'obj'))", 'object_name': 'TestModelBitmask_Perms'},
+            'bitmask': ('django.db.models.fields.BigIntegerField', [], {'default': '0'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'TestModelBitmask_gperms'", 'null': 'True', 'to': "orm['auth.Group']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'obj': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'operms'", 'to': "orm['object_permissions.TestModelBitmask']"}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'TestModelBitmask_uperms'", 'null': 'True', 'to': "orm['auth.User']"})
+        }
+    }
+    
+    complete_apps = ['object_permissions']
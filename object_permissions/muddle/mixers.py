@@ -4,7 +4,8 @@ from muddle.shots import register, TemplateMixer
 register('user-detail-tab', TemplateMixer('object_permissions/muddle/user_permissions.html'))
 register('group-detail-tab', TemplateMixer('object_permissions/muddle/group_permissions.html'))
 
-# group list
+# group list, the headers batch the admin counts of the rows when the list
+# template provides its groups as "groups", see load_group_admin_counts
 register('group-list-table-headers', TemplateMixer('object_permissions/muddle/group/group_headers.html'))
 register('group-list-table-cells', TemplateMixer('object_permissions/muddle/group/group_row.html'))
 
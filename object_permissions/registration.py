@@ -1,14 +1,22 @@
-from operator import or_
+from contextlib import contextmanager
+from functools import wraps
+from inspect import getargspec, isgeneratorfunction
+from operator import and_, or_
+from threading import local, Lock
+from timeit import default_timer
+from uuid import uuid4
 from warnings import warn
 
 from django.conf import settings
 from django.contrib.auth.models import User, Group
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import FieldError, ObjectDoesNotExist
+from django.db.models.fields import FieldDoesNotExist
 from django import db
-from django.db import models, transaction
-from django.db.models import Model, Q, Sum
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Model, Q, Sum
 
-from object_permissions.signals import granted, revoked
+from object_permissions.signals import granted, revoked, granted_batch, \
+    revoked_batch
 
 
 TESTING = settings.TESTING if hasattr(settings, 'TESTING') else False
@@ -54,17 +62,89 @@ __all__ = (
     'grant', 'grant_group',
     'revoke', 'revoke_group',
     'get_user_perms', 'get_group_perms',
+    'get_user_perms_many', 'prefetch_perms', 'get_user_group_ids',
+    'get_object_perms',
+    'PermissionLoader', 'PermissionCheck',
     'revoke_all', 'revoke_all_group',
     'set_user_perms', 'set_group_perms',
+    'bulk_grant', 'bulk_revoke', 'set_perms_matrix',
+    'deferred_signals',
     'get_users', 'get_users_all', 'get_users_any',
     'get_groups', 'get_groups_all', 'get_groups_any',
+    'count_users_any', 'count_users_all', 'count_users_many',
+    'count_groups_any', 'count_groups_all', 'count_groups_many',
+    'user_count_objects_any_perms', 'user_count_objects_all_perms',
+    'group_count_objects_any_perms', 'group_count_objects_all_perms',
     "user_has_any_perms", "group_has_any_perms",
     "user_has_all_perms", "group_has_all_perms",
     'get_model_perms',
     'filter_on_perms',
+    'bitmask_from_columns', 'columns_from_bitmask',
+    'rebuild_effective_perms',
+    'create_perm_indexes',
+    'get_perm_cache',
+    'build_perm_models', 'get_registration_report',
+    'user_iter_objects_any_perms', 'group_iter_objects_any_perms',
+    'Collector', 'StatsCollector', 'set_collector', 'get_collector',
 )
 
-permission_map = {}
+class _PermissionModelMap(dict):
+    """
+    Mapping of registered Models to permission Models that builds the
+    permission Models of lazily registered Models on first access.  Looking
+    up or testing for a Model builds its permission Models, iterating builds
+    all of them.
+    """
+
+    def __init__(self, effective=False):
+        self.effective = effective
+
+    def _build(self, model):
+        if model in _pending:
+            if not self.effective or params_for_model[model].get('effective'):
+                _build_pending(model)
+
+    def __contains__(self, model):
+        if dict.__contains__(self, model):
+            return True
+        self._build(model)
+        return dict.__contains__(self, model)
+
+    def __getitem__(self, model):
+        try:
+            return dict.__getitem__(self, model)
+        except KeyError:
+            self._build(model)
+            return dict.__getitem__(self, model)
+
+    def get(self, model, default=None):
+        return self[model] if model in self else default
+
+    def __iter__(self):
+        build_perm_models()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        build_perm_models()
+        return dict.__len__(self)
+
+    def _built(method):
+        def wrapper(self, *args, **kwargs):
+            build_perm_models()
+            return method(self, *args, **kwargs)
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+    keys = _built(dict.keys)
+    values = _built(dict.values)
+    items = _built(dict.items)
+    iterkeys = _built(dict.iterkeys)
+    itervalues = _built(dict.itervalues)
+    iteritems = _built(dict.iteritems)
+    del _built
+
+
+permission_map = _PermissionModelMap()
 """
 A mapping of Models to Models. The key is a registered Model, and the value is
 the Model that stores the permissions on that Model.
@@ -85,6 +165,27 @@ params_for_model = {}
 A mapping of Models to their param dictionaries.
 """
 
+effective_map = _PermissionModelMap(effective=True)
+"""
+A mapping of Models to Models, for Models registered with params['effective'].
+The value is the Model that stores the effective permissions of each User on
+that Model: their own permissions combined with those of their Groups.
+"""
+
+lookup_names = {}
+"""
+A mapping of registered Models to the lookup paths from User and Group to
+their permission tables, e.g. {'uperms':'TestModel_uperms__', ...}.  Built
+with the permission Models so checks do not format them on every call.
+"""
+
+inherit_map = {}
+"""
+A mapping of registered Models to the ancestors they inherit permissions from
+through params['inherit_from'].  The value is a list of (lookup path, Model)
+tuples, starting with the parent.  Filled on first use, see _inherited().
+"""
+
 forbidden = set([
     "full_clean",
     "clean_fields",
@@ -99,7 +200,94 @@ forbidden = set([
 Names reserved by Django for Model instances.
 """
 
+BITMASK_FIELD = 'bitmask'
+"""
+Name of the column that stores permissions for models registered with bitmask
+storage.
+"""
+
+MAX_BITS = 63
+"""
+Number of permissions that fit in a bitmask column.
+"""
+
+_ALL_BITS = (1 << MAX_BITS) - 1
+
+_clause_cache = {}
+"""
+Q clauses built by _perm_clause(), keyed by its arguments.
+"""
+
+_check_cache = {}
+"""
+SQL of permission checks built by _check_sql(), keyed by its arguments.
+"""
+
+CACHE_SIZE = 1000
+"""
+Maximum number of entries in _clause_cache and _check_cache.  Further
+clauses and SQL are built on every call instead of being cached.
+"""
+
+_LIMIT_VENDORS = ('sqlite', 'postgresql', 'mysql')
+"""
+Databases whose permission checks run the SQL built by _check_sql(), it uses
+LIMIT which not all databases support.  Checks on other databases are run
+through the ORM.
+"""
+
+_upsert_tables = {}
+"""
+Whether permission tables can be written with upserts, keyed by (model,
+field).  See _upsert_supported()
+"""
+
+QUERY_STRATEGIES = ('join', 'in', 'exists')
+"""
+Ways the *_get_objects_*_perms functions can query the permission tables, see
+_get_objects()
+"""
+
+BULK_BATCH_SIZE = 500
+"""
+Number of objects handled per query by bulk_grant() and bulk_revoke().  This
+keeps the number of query parameters below the limits of all backends.
+"""
+
+_cache_generation = 0
+"""
+Counter that is incremented every time permissions are changed.  Cached
+permissions are only valid for the generation they were loaded in.
+"""
+
+_membership_generation = 0
+"""
+Counter that is incremented every time Users are added to or removed from
+Groups.  Group ids cached on User instances are only valid for the generation
+they were loaded in, see get_user_group_ids().
+"""
+
 _DELAYED = []
+
+_pending = {}
+"""
+Lazily registered Models whose permission Models have not been built yet,
+mapped to their app labels.
+"""
+
+_build_lock = Lock()
+"""
+Lock held while building pending permission Models, so that threads looking
+up the same Model at once build it only once.
+"""
+
+registration_times = {}
+"""
+A mapping of registered Models to the seconds spent registering them and
+building their permission Models, see get_registration_report().
+"""
+
+
 def register(params, model, app_label=None):
     """
     Register permissions for a Model.
@@ -108,6 +296,47 @@ def register(params, model, app_label=None):
     "order", "pay"]. This function will insert a row into the permission table
     if one does not already exist.
 
+    Permissions are stored in one column per permission.  Registering with
+    params['storage'] = 'bitmask' instead stores all permissions in a single
+    integer column, one bit per permission.  Bits may be pinned with a 'bit'
+    param on each permission, e.g. {'eat':{'bit':0}}.  Unpinned permissions are
+    assigned the lowest free bits in alphabetical order.  Pin bits if you plan
+    to add permissions later, otherwise existing bits may shift.  The final
+    assignment is stored in params_for_model[model]['bits'].
+
+    Permission tables are unique on (user, obj) and (group, obj).  Additional
+    composite indexes may be listed in params['indexes'] as tuples of field
+    names of the permission table, e.g. [('obj', 'eat')].  Indexes are created
+    by syncdb.  When using south, create them in a migration with
+    create_perm_indexes(Model).
+
+    Registering with params['effective'] = True also maintains a table of the
+    permissions each User has, directly or through Groups.  Group-aware
+    lookups of any of the perms then read a single row per User and object
+    instead of joining through group membership.  Lookups of all of the perms
+    still read the permission table, a row combining the perms of the User
+    and their Groups would satisfy them with perms that no single grant has.
+    The table is updated as permissions and group memberships change and can
+    be rebuilt with the rebuild_effective_perms management command.
+
+    params['inherit_from'] names a ForeignKey to another registered Model,
+    e.g. 'parent'.  Users and Groups then also have the permissions they were
+    granted on the parent, and on its ancestors if the parent inherits too.
+    Only permissions registered for both Models are inherited.  Permission
+    checks, get_*_perms() and the *_get_objects_*_perms() functions include
+    inherited permissions.  Since the chain of ancestor Models is fixed, each
+    check needs a fixed number of queries however deep the chain is.
+
+    With settings.OBJECT_PERMISSIONS_LAZY_MODELS = True, registration only
+    records the params.  The permission Models are built when they are first
+    accessed through permission_map or effective_map, which the permission
+    functions do, or when build_perm_models() is called.  syncdb, flush and
+    south build all of them before creating tables, and deleting Users, Groups
+    or registered objects deletes their permissions also if their permission
+    Models are built during the delete.  Code that follows the relations to
+    permission tables itself, e.g. filter(operms__user=user), must access
+    permission_map first.
+
     For backwards compatibility, this function can also take a single
     permission instead of a list. This feature should be considered
     deprecated; please fix your code if you depend on this.
@@ -142,12 +371,15 @@ def register(params, model, app_label=None):
             repack[perm] = {}
         params['perms'] = repack
 
+    start = default_timer()
     try:
         return _register(params, model, app_label)
     except db.utils.DatabaseError:
         # there was an error, likely due to a missing table.  Delay this
         # registration.
         _DELAYED.append((params, model, app_label))
+    finally:
+        _add_registration_time(model, 'register', default_timer() - start)
 
 
 @transaction.commit_manually
@@ -164,25 +396,16 @@ def _register(params, model, app_label):
             warn("Tried to double-register %s for permissions!" % model)
             return
 
-        name = "%s_Perms" % model.__name__
-        fields = {
-            "__module__": "",
-            # XXX user xor group null?
-            "user": models.ForeignKey(User, null=True,
-                related_name="%s_uperms" % model.__name__),
-            "group": models.ForeignKey(Group, null=True,
-                related_name="%s_gperms" % model.__name__),
-            "obj": models.ForeignKey(model,
-                related_name="operms"),
-        }
-
-        for perm in params['perms']:
-            fields[perm] = models.IntegerField(default=0)
+        if params.get('storage') == 'bitmask':
+            params['bits'] = _assign_bits(params['perms'])
 
-        fields["Meta"] = type('Meta', (object,), dict(app_label=app_label))
+        if getattr(settings, 'OBJECT_PERMISSIONS_LAZY_MODELS', False):
+            _pending[model] = app_label
+            _connect_lazy_signals()
+            perm_model = None
+        else:
+            perm_model = _build_perm_models(model, params, app_label)
 
-        perm_model = type(name, (models.Model,), fields)
-        permission_map[model] = perm_model
         permissions_for_model[model] = params['perms']
         params_for_model[model] = params
         class_names[model.__name__] = model
@@ -194,6 +417,361 @@ def _register(params, model, app_label):
         transaction.commit()
 
 
+def _build_perm_models(model, params, app_label):
+    """
+    Create the permission Model, and the effective permission Model, of a
+    registered Model.
+    """
+    start = default_timer()
+    name = "%s_Perms" % model.__name__
+    fields = {
+        "__module__": "",
+        # XXX user xor group null?
+        "user": models.ForeignKey(User, null=True,
+            related_name="%s_uperms" % model.__name__),
+        "group": models.ForeignKey(Group, null=True,
+            related_name="%s_gperms" % model.__name__),
+        "obj": models.ForeignKey(model,
+            related_name="operms"),
+    }
+
+    _add_perm_fields(fields, params)
+
+    fields["Meta"] = type('Meta', (object,), dict(app_label=app_label,
+        unique_together=(('user', 'obj'), ('group', 'obj'))))
+
+    perm_model = type(name, (models.Model,), fields)
+    field_names = [field.name for field in perm_model._meta.fields]
+    for index in params.get('indexes', ()):
+        for field in index:
+            if field not in field_names:
+                raise RegistrationException(
+                    "Unknown field %s in index of %s" % (field, name))
+    permission_map[model] = perm_model
+    lookup_names[model] = {
+        'uperms':'%s_uperms__' % model.__name__,
+        'gperms':'%s_gperms__' % model.__name__,
+        'eperms':'%s_eperms__' % model.__name__,
+        'groups_gperms':'groups__%s_gperms__' % model.__name__,
+    }
+
+    if params.get('effective'):
+        # table of permissions users have directly or through groups
+        fields = {
+            "__module__": "",
+            "user": models.ForeignKey(User,
+                related_name="%s_eperms" % model.__name__),
+            "obj": models.ForeignKey(model,
+                related_name="eperms"),
+        }
+        _add_perm_fields(fields, params)
+        fields["Meta"] = type('Meta', (object,), dict(app_label=app_label,
+            unique_together=(('user', 'obj'),)))
+        effective_map[model] = type("%s_EffectivePerms" % model.__name__,
+                                    (models.Model,), fields)
+
+    _add_registration_time(model, 'build', default_timer() - start)
+    return perm_model
+
+
+def _build_pending(model):
+    """
+    Build the permission Models of a lazily registered Model.
+
+    @return True if they were built, False if another thread built them
+    """
+    with _build_lock:
+        # checked again with the lock held, another thread may have built it
+        if model not in _pending:
+            return False
+        # the Model stays pending until it is built, so that other threads
+        # wait for it instead of finding neither
+        _build_perm_models(model, params_for_model[model], _pending[model])
+        del _pending[model]
+
+        # Options caches related objects and lookup names without ever
+        # invalidating them, drop them so the new relations are found
+        for opts in (model._meta, User._meta, Group._meta):
+            for name in ('_related_objects_cache', '_name_map'):
+                opts.__dict__.pop(name, None)
+    return True
+
+
+def build_perm_models():
+    """
+    Build the permission Models of all lazily registered Models.
+
+    @return list of the Models whose permission Models were built
+    """
+    built = []
+    for model in list(_pending):
+        if _build_pending(model):
+            built.append(model)
+    return built
+
+
+_built_while_deleting = set()
+
+
+def _connect_lazy_signals():
+    models.signals.pre_delete.connect(_lazy_pre_delete,
+                                      dispatch_uid='object_permissions_lazy')
+    models.signals.post_delete.connect(_lazy_post_delete,
+                                       dispatch_uid='object_permissions_lazy')
+
+
+def _lazy_pre_delete(sender, instance, **kwargs):
+    """
+    Deletes collect related rows before sending pre_delete.  Permission
+    Models built by now were missed, build them and delete their rows of the
+    instances being deleted.
+    """
+    if _pending:
+        _built_while_deleting.update(build_perm_models())
+    if not _built_while_deleting:
+        return
+
+    # delete without sending signals, a nested delete would send post_delete
+    qn = db.connection.ops.quote_name
+    cursor = db.connection.cursor()
+    for model in list(_built_while_deleting):
+        for perm_map in (permission_map, effective_map):
+            if model not in perm_map:
+                continue
+            perm_model = perm_map[model]
+            for field in perm_model._meta.fields:
+                if field.rel and field.rel.to is sender:
+                    cursor.execute('DELETE FROM %s WHERE %s = %%s'
+                                   % (qn(perm_model._meta.db_table),
+                                      qn(field.column)), [instance.pk])
+
+
+def _lazy_post_delete(sender, instance, **kwargs):
+    """
+    pre_delete is sent for all instances before the first post_delete, the
+    next deletion collects rows of all built permission Models.
+    """
+    _built_while_deleting.clear()
+
+
+def _add_registration_time(model, name, seconds):
+    times = registration_times.setdefault(model, {'register':0.0, 'build':0.0})
+    times[name] += seconds
+
+
+def get_registration_report():
+    """
+    Report how long registering Models took.  The register time includes
+    building permission Models unless they are built lazily, the build time
+    is the time spent creating the permission Models.
+
+    @return dict with the number of registered, built and pending Models,
+    the total register and build seconds, and per Model times
+    """
+    return {
+        'registered':len(params_for_model),
+        'built':len(params_for_model) - len(_pending),
+        'pending':len(_pending),
+        'register_seconds':sum(t['register'] for t
+                               in registration_times.values()),
+        'build_seconds':sum(t['build'] for t in registration_times.values()),
+        'models':dict(('%s.%s' % (model._meta.app_label, model.__name__), times)
+                      for model, times in registration_times.items()),
+    }
+
+
+def _add_perm_fields(fields, params):
+    """
+    Add the fields that store permissions to the fields of a permission model.
+    """
+    if params.get('storage') == 'bitmask':
+        fields[BITMASK_FIELD] = models.BigIntegerField(default=0)
+        for perm, bit in params['bits'].items():
+            fields[perm] = _bit_property(1 << bit)
+    else:
+        for perm in params['perms']:
+            fields[perm] = models.IntegerField(default=0)
+
+
+def _assign_bits(perms):
+    """
+    Assign a bit to each permission of a model registered with bitmask storage.
+    Bits set with the 'bit' param are kept, the remaining permissions are
+    assigned the lowest free bits in alphabetical order.
+    """
+    if BITMASK_FIELD in perms:
+        raise RegistrationException("Permission %s is a reserved name!"
+                                    % BITMASK_FIELD)
+
+    bits = {}
+    for perm, params in perms.items():
+        if 'bit' in params:
+            bit = params['bit']
+            if not 0 <= bit < MAX_BITS or bit in bits.values():
+                raise RegistrationException("Invalid bit %s for permission %s"
+                                            % (bit, perm))
+            bits[perm] = bit
+
+    used = set(bits.values())
+    free = [bit for bit in xrange(MAX_BITS) if bit not in used]
+    unassigned = sorted(perm for perm in perms if perm not in bits)
+    if len(unassigned) > len(free):
+        raise RegistrationException(
+            "Bitmask storage supports at most %s permissions" % MAX_BITS)
+    bits.update(zip(unassigned, free))
+    return bits
+
+
+def _bit_property(mask):
+    """
+    Create a property exposing a single bit of the bitmask column.  This lets
+    rows of bitmask models be read and written the same way as column-per-perm
+    rows, e.g. getattr(row, perm)
+    """
+    def getter(self):
+        return bool(getattr(self, BITMASK_FIELD) & mask)
+
+    def setter(self, enabled):
+        value = getattr(self, BITMASK_FIELD)
+        setattr(self, BITMASK_FIELD, value | mask if enabled else value & ~mask)
+
+    return property(getter, setter)
+
+
+def bitmask_from_columns(model, cursor=None):
+    """
+    Copy permissions from the column-per-perm layout into the bitmask column.
+
+    This is the data step for converting a model to bitmask storage.  Register
+    the model with params['storage'] = 'bitmask', then in a migration:
+
+        1) add the bitmask column:
+           db.add_column(table, 'bitmask', models.BigIntegerField(default=0))
+        2) call bitmask_from_columns(Model)
+        3) drop the old perm columns with db.delete_column()
+
+    The old columns must still exist and be named after the perms.  Migrating
+    back is the same in reverse using columns_from_bitmask().  Effective
+    permissions, if enabled, are rebuilt from the converted rows.
+
+    @param model - registered model whose permissions are converted
+    @param cursor - optional cursor, defaults to the default connection
+    """
+    table, bits, cursor, qn = _bitmask_migration_args(model, cursor)
+    for perm, bit in bits.items():
+        cursor.execute('UPDATE %s SET %s = %s | %%s WHERE %s <> 0'
+            % (table, qn(BITMASK_FIELD), qn(BITMASK_FIELD), qn(perm)),
+            [1 << bit])
+    transaction.commit_unless_managed()
+    if model in effective_map:
+        rebuild_effective_perms(model)
+
+
+def columns_from_bitmask(model, cursor=None):
+    """
+    Copy permissions from the bitmask column back into the column-per-perm
+    layout.  The perm columns must already exist, see bitmask_from_columns()
+
+    @param model - registered model whose permissions are converted
+    @param cursor - optional cursor, defaults to the default connection
+    """
+    table, bits, cursor, qn = _bitmask_migration_args(model, cursor)
+    for perm, bit in bits.items():
+        cursor.execute('UPDATE %s SET %s = 1 WHERE %s & %%s <> 0'
+            % (table, qn(perm), qn(BITMASK_FIELD)), [1 << bit])
+    transaction.commit_unless_managed()
+
+
+def _bitmask_migration_args(model, cursor):
+    """
+    Helper for bitmask_from_columns() and columns_from_bitmask()
+    """
+    if params_for_model[model].get('storage') != 'bitmask':
+        raise RegistrationException("%s is not registered with bitmask storage"
+                                    % model)
+
+    if cursor is None:
+        cursor = db.connection.cursor()
+    qn = db.connection.ops.quote_name
+    table = qn(permission_map[model]._meta.db_table)
+    return table, params_for_model[model]['bits'], cursor, qn
+
+
+def perm_index_sql(model):
+    """
+    Return the CREATE INDEX statements for the indexes listed in
+    params['indexes'] of a registered model.
+
+    @param model - registered model
+    """
+    from django.db.backends.util import truncate_name
+
+    permissions = permission_map[model]
+    table = permissions._meta.db_table
+    qn = db.connection.ops.quote_name
+    statements = []
+    for index in params_for_model[model].get('indexes', ()):
+        columns = [permissions._meta.get_field(field).column for field in index]
+        name = truncate_name('%s_%s' % (table, '_'.join(columns)),
+                             db.connection.ops.max_name_length())
+        statements.append('CREATE INDEX %s ON %s (%s)' % (qn(name), qn(table),
+            ', '.join(qn(column) for column in columns)))
+    return statements
+
+
+def create_perm_indexes(model, cursor=None):
+    """
+    Create the indexes listed in params['indexes'] of a registered model.
+    This is called by syncdb when the permission table is created.  Call it
+    from a migration when the table is managed by south.
+
+    @param model - registered model
+    @param cursor - optional cursor, defaults to the default connection
+    """
+    if cursor is None:
+        cursor = db.connection.cursor()
+    for sql in perm_index_sql(model):
+        cursor.execute(sql)
+    transaction.commit_unless_managed()
+
+
+def _create_indexes(sender, created_models, **kwargs):
+    """
+    Create extra indexes of permission tables created by syncdb.  This signal
+    is sent once per app, only handle the permission tables of that app.
+
+    flush also sends this signal, for all models, so indexes that already
+    exist are skipped.  Apps migrated with south are skipped as well, their
+    migrations create the indexes.
+    """
+    if 'south' in settings.INSTALLED_APPS:
+        try:
+            __import__('%s.migrations' % sender.__name__.rsplit('.', 1)[0])
+            return
+        except ImportError:
+            pass
+
+    app_models = models.get_models(sender)
+    cursor = db.connection.cursor()
+    for model, permissions in permission_map.items():
+        if permissions not in created_models or permissions not in app_models:
+            continue
+
+        for sql in perm_index_sql(model):
+            sid = transaction.savepoint()
+            try:
+                cursor.execute(sql)
+            except db.DatabaseError:
+                # index already exists
+                transaction.savepoint_rollback(sid)
+            else:
+                transaction.savepoint_commit(sid)
+    transaction.commit_unless_managed()
+
+
+models.signals.post_syncdb.connect(_create_indexes)
+
+
 def _register_delayed(**kwargs):
     """
     Register all permissions that were delayed waiting for database tables to
@@ -244,145 +822,818 @@ if TESTING:
             'Perm4': {}
         },
         'url':'test_model-detail',
-        'url-params':['name']
+        'url-params':['name'],
+        'indexes':[('obj', 'Perm1')]
     }
     register(TEST_MODEL_PARAMS, TestModel, 'object_permissions')
     register(['Perm1', 'Perm2','Perm3','Perm4'], TestModelChild, 'object_permissions')
     register(['Perm1', 'Perm2','Perm3','Perm4'], TestModelChildChild, 'object_permissions')
 
+    class TestModelEffective(models.Model):
+        name = models.CharField(max_length=32)
+
+    TEST_MODEL_EFFECTIVE_PARAMS = {
+        'perms':['Perm1', 'Perm2', 'Perm3', 'Perm4'],
+        'effective':True
+    }
+    register(TEST_MODEL_EFFECTIVE_PARAMS, TestModelEffective,
+             'object_permissions')
+
+    class TestModelBitmask(models.Model):
+        name = models.CharField(max_length=32)
+        parent = models.ForeignKey(TestModel, null=True)
+
+    TEST_MODEL_BITMASK_PARAMS = {
+        'perms' : {
+            'Perm1': {},
+            'Perm2': {},
+            # perm with a pinned bit
+            'Perm3': {'bit':0},
+            'Perm4': {}
+        },
+        'storage':'bitmask',
+        'effective':True
+    }
+    register(TEST_MODEL_BITMASK_PARAMS, TestModelBitmask, 'object_permissions')
+
+    class TestModelInheritChild(models.Model):
+        parent = models.ForeignKey(TestModel, null=True)
+    class TestModelInheritChildChild(models.Model):
+        parent = models.ForeignKey(TestModelInheritChild, null=True)
+
+    TEST_MODEL_INHERIT_PARAMS = {
+        'perms':['Perm1', 'Perm2', 'Perm3', 'Perm5'],
+        'inherit_from':'parent'
+    }
+    register(TEST_MODEL_INHERIT_PARAMS, TestModelInheritChild,
+             'object_permissions')
+    register(dict(TEST_MODEL_INHERIT_PARAMS), TestModelInheritChildChild,
+             'object_permissions')
+
 
 def get_class(class_name):
     return class_names[class_name]
 
 
-def grant(user, perm, obj):
+def get_cache_generation():
     """
-    Grant a permission to a User.
+    Return the current permission cache generation.  Any permissions cached
+    under a different generation are stale and must be reloaded.
     """
+    return _cache_generation
 
-    model = obj.__class__
 
-    if perm not in get_model_perms(model):
-        raise UnknownPermissionException(perm)
+def invalidate_cache(**kwargs):
+    """
+    Invalidate all cached permissions.  This is called whenever permissions
+    are changed.  It also receives m2m_changed for group membership, since
+    that changes which group permissions apply to a user.
+    """
+    global _cache_generation
+    _cache_generation += 1
 
-    permissions = permission_map[model]
 
-    try:
-        user_perms = permissions.objects.get(user=user, obj=obj)
-    except permissions.DoesNotExist:
-        user_perms = permissions(user=user, obj=obj)
+models.signals.m2m_changed.connect(invalidate_cache,
+                                   sender=User.groups.through)
 
-    # XXX could raise FieldDoesNotExist
-    if not getattr(user_perms, perm):
-        setattr(user_perms, perm, True)
-        user_perms.save()
 
-        granted.send(sender=user, perm=perm, object=obj)
+"""
+Shared permission cache.
+
+The permissions of a User on an object can be stored in one of the caches
+configured in settings.CACHES, so they are shared between processes.  This is
+disabled unless settings.OBJECT_PERMISSIONS_CACHE names a cache.
+
+    OBJECT_PERMISSIONS_CACHE = 'default'
+    OBJECT_PERMISSIONS_CACHE_TIMEOUT = 300      # seconds, default 300
+    OBJECT_PERMISSIONS_CACHE_MAX_ENTRIES = 1000 # locmem, file and db caches,
+                                                # defaults to the cache setting
+
+Each entry stores the versions of the User, the model and the object it was
+loaded under.  Versions are replaced when permissions on the object change,
+when the groups of the User change, or when all permissions of the model are
+rebuilt, which makes older entries stale.  Entries and
+versions are read with a single get_many() call.
+"""
 
+_perm_cache = None, None
 
-def grant_group(group, perm, obj):
+
+def get_perm_cache():
     """
-    Grant a permission to a Group.
+    Return the cache used for sharing permissions between processes, or None
+    if it is disabled.
     """
+    global _perm_cache
+    alias = getattr(settings, 'OBJECT_PERMISSIONS_CACHE', None)
+    if not alias:
+        return None
 
-    model = obj.__class__
-    if perm not in get_model_perms(model):
-        raise UnknownPermissionException(perm)
-    
-    permissions = permission_map[model]
+    config = (alias,
+              getattr(settings, 'OBJECT_PERMISSIONS_CACHE_TIMEOUT', 300),
+              getattr(settings, 'OBJECT_PERMISSIONS_CACHE_MAX_ENTRIES', None))
+    if _perm_cache[0] != config:
+        from django.core.cache import get_cache
+        kwargs = {'TIMEOUT':config[1]}
+        if config[2] is not None:
+            kwargs['max_entries'] = config[2]
+        _perm_cache = config, get_cache(alias, **kwargs)
+    return _perm_cache[1]
 
-    try:
-        group_perms = permissions.objects.get(group=group, obj=obj)
-    except permissions.DoesNotExist:
-        group_perms = permissions(group=group, obj=obj)
 
-    # XXX could raise FieldDoesNotExist
-    if not getattr(group_perms, perm):
-        setattr(group_perms, perm, True)
-        group_perms.save()
+def _user_version_key(user_id):
+    return 'object_permissions:user:%s' % user_id
 
-        granted.send(sender=group, perm=perm, object=obj)
 
+def _model_version_key(model):
+    return 'object_permissions:model:%s.%s' % (model._meta.app_label,
+                                               model.__name__)
 
-def set_user_perms(user, perms, obj):
-    """
-    Set User permissions to exactly the specified permissions.
-    """    
-    if perms:
-        model = obj.__class__
-        permissions = permission_map[model]
-        
-        all_perms = dict((p, False) for p in get_model_perms(model))
-        for perm in perms:
-            all_perms[perm] = True
-        
-        try:
-            user_perms = permissions.objects.get(user=user, obj=obj)
-        except permissions.DoesNotExist:
-            user_perms = permissions(user=user, obj=obj)
-        
-        for perm, enabled in all_perms.iteritems():
-            if enabled and not getattr(user_perms, perm):
-                granted.send(sender=user, perm=perm, object=obj)
-            elif not enabled and getattr(user_perms, perm):
-                revoked.send(sender=user, perm=perm, object=obj)
-            setattr(user_perms, perm, enabled)
-        
-        user_perms.save()
-    
-    else:
-        # removing all perms.
-        revoke_all(user, obj)
 
-    return perms
+def _object_version_key(model, obj_id):
+    return 'object_permissions:obj:%s.%s:%s' % (model._meta.app_label,
+                                                model.__name__, obj_id)
 
 
-def set_group_perms(group, perms, obj):
+def _perms_key(user_id, model, obj_id, groups):
+    return 'object_permissions:perms:%s:%s.%s:%s:%d' % (user_id,
+        model._meta.app_label, model.__name__, obj_id, bool(groups))
+
+
+def _new_version():
+    return uuid4().hex
+
+
+def _bump_versions(keys):
     """
-    Set group permissions to exactly the specified permissions.
+    Replace versions, making cache entries stored under them stale.
     """
-    if perms:
-        model = obj.__class__
-        permissions = permission_map[model]
-        all_perms = dict((p, False) for p in get_model_perms(model))
-        for perm in perms:
-            all_perms[perm] = True
-    
-        try:
-            group_perms = permissions.objects.get(group=group, obj=obj)
-        except permissions.DoesNotExist:
-            group_perms = permissions(group=group, obj=obj)
-    
-        for perm, enabled in all_perms.iteritems():
-            if enabled and not getattr(group_perms, perm):
-                granted.send(sender=group, perm=perm, object=obj)
-            elif not enabled and getattr(group_perms, perm):
-                revoked.send(sender=group, perm=perm, object=obj)
-    
-            setattr(group_perms, perm, enabled)
-    
-        group_perms.save()
+    cache = get_perm_cache()
+    if cache is not None and keys:
+        cache.set_many(dict((key, _new_version()) for key in keys))
 
-    else:
-        # removing all perms.
-        revoke_all_group(group, obj)
 
+def _get_shared_perms(user, obj, groups):
+    """
+    Return the perms of a User on an object, from the shared cache if
+    possible.  Perms that are loaded from the database are stored in it.
+    """
+    cache = get_perm_cache()
+    model = obj.__class__
+    key = _perms_key(user.pk, model, obj.pk, groups)
+    version_keys = [_user_version_key(user.pk), _model_version_key(model),
+                    _object_version_key(model, obj.pk)]
+
+    found = cache.get_many([key] + version_keys)
+    versions = [found.get(version_key) for version_key in version_keys]
+    entry = found.get(key)
+    if entry is not None and None not in versions and entry[0] == versions:
+        return entry[1]
+
+    # versions are read before the database, a change made while loading
+    # replaces them and the entry is stale once stored.  A version that
+    # expired is replaced by a new one, so entries stored under it can't
+    # become valid again.
+    for i, version_key in enumerate(version_keys):
+        if versions[i] is None:
+            cache.add(version_key, _new_version())
+            versions[i] = cache.get(version_key)
+
+    perms = frozenset(_load_user_perms(user, obj, groups))
+    cache.set(key, (versions, perms))
     return perms
 
 
-def revoke(user, perm, obj):
-    """
-    Revoke a permission from a User.
+def _groups_key(user_id):
+    return 'object_permissions:groups:%s' % user_id
+
+
+def get_user_group_ids(user):
     """
+    Return the ids of the Groups of a User.  Group aware checks match
+    permission rows of these Groups instead of joining group memberships for
+    every query.
 
-    model = obj.__class__
-    permissions = permission_map[model]
+    The ids are cached on the User instance until group memberships change,
+    and in the shared permission cache under the version of the User if it is
+    enabled.  Memberships changed without sending m2m_changed, e.g. with raw
+    SQL, are not noticed.
 
+    @return frozenset of Group ids
+    """
+    if user.pk is None:
+        return frozenset()
     try:
-        user_perms = permissions.objects.get(user=user, obj=obj)
+        generation, ids = user._object_perm_group_ids
+        if generation == _membership_generation:
+            return ids
+    except AttributeError:
+        pass
 
-        if getattr(user_perms, perm):
-            revoked.send(sender=user, perm=perm, object=obj)
+    generation = _membership_generation
+    cache = get_perm_cache()
+    if cache is None:
+        ids = _load_group_ids(user)
+    else:
+        key, version_key = _groups_key(user.pk), _user_version_key(user.pk)
+        found = cache.get_many([key, version_key])
+        version, entry = found.get(version_key), found.get(key)
+        if entry is not None and version is not None and entry[0] == version:
+            ids = entry[1]
+        else:
+            if version is None:
+                cache.add(version_key, _new_version())
+                version = cache.get(version_key)
+            ids = _load_group_ids(user)
+            cache.set(key, (version, ids))
+    user._object_perm_group_ids = generation, ids
+    return ids
+
+
+def _load_group_ids(user):
+    return frozenset(User.groups.through.objects.filter(user=user) \
+                     .values_list('group', flat=True))
+
+
+def _group_ids_changed(**kwargs):
+    """
+    Make Group ids cached on User instances stale.
+    """
+    global _membership_generation
+    _membership_generation += 1
+
+
+models.signals.m2m_changed.connect(_group_ids_changed,
+                                   sender=User.groups.through)
+models.signals.post_delete.connect(_group_ids_changed, sender=Group)
+
+
+def _perms_changed(model, objects, users=(), groups=()):
+    """
+    Called after permissions on objects were changed for Users or Groups.
+    Invalidates cached permissions and updates effective permissions.
+    """
+    invalidate_cache()
+    if get_perm_cache() is not None:
+        keys = [_object_version_key(model, obj.pk) for obj in objects]
+        # entries of descendants include perms inherited from these objects
+        keys.extend(_model_version_key(descendant)
+                    for descendant in _inheriting_models(model))
+        _bump_versions(keys)
+    if model in effective_map:
+        users = [user.pk for user in users]
+        if groups:
+            users.extend(User.objects.filter(groups__in=groups) \
+                         .values_list('pk', flat=True).distinct())
+        _refresh_effective(model, users, objects)
+
+
+def _perm_fields(model):
+    """
+    Return the names of the fields that store permissions for a model.
+    """
+    if params_for_model[model].get('storage') == 'bitmask':
+        return [BITMASK_FIELD]
+    return list(get_model_perms(model))
+
+
+def _effective_rows(model, users=None, objects=None):
+    """
+    Compute effective permissions from the permission table of a model.
+
+    @param users - only compute for these User ids, or None for all users
+    @param objects - only compute for these objects, or None for all objects
+    @return dict mapping (user id, object id) to the list of values of the
+    permission fields
+    """
+    permissions = permission_map[model]
+    fields = _perm_fields(model)
+
+    if users is None:
+        direct = permissions.objects.filter(user__isnull=False)
+        through_groups = permissions.objects.filter(group__user__isnull=False)
+    else:
+        # group__user must be filtered in a single call, a second filter()
+        # would join group membership again
+        direct = permissions.objects.filter(user__in=users)
+        through_groups = permissions.objects.filter(group__user__in=users)
+    if objects is not None:
+        direct = direct.filter(obj__in=objects)
+        through_groups = through_groups.filter(obj__in=objects)
+
+    rows = {}
+    for query, user_field in ((direct, 'user'),
+                              (through_groups, 'group__user')):
+        for values in query.values_list(user_field, 'obj', *fields):
+            key = values[:2]
+            values = [int(value) for value in values[2:]]
+            if key in rows:
+                # both column and bitmask values combine with a bitwise OR
+                values = [a | b for a, b in zip(rows[key], values)]
+            rows[key] = values
+    return rows
+
+
+def _save_effective(model, rows):
+    """
+    Insert rows computed by _effective_rows() into the effective table
+    """
+    effective = effective_map[model]
+    fields = _perm_fields(model)
+    new_rows = [effective(user_id=user, obj_id=obj, **dict(zip(fields, values)))
+                for (user, obj), values in rows.items() if any(values)]
+
+    if hasattr(effective.objects, 'bulk_create'):
+        effective.objects.bulk_create(new_rows)
+    else:
+        # bulk_create() requires django 1.4
+        for row in new_rows:
+            row.save()
+
+
+def _refresh_effective(model, users, objects=None):
+    """
+    Recompute effective permissions of Users on objects of a model.
+
+    @param users - list of User ids
+    @param objects - list of objects, or None for all objects
+    """
+    effective = effective_map[model]
+    for i in xrange(0, len(users), BULK_BATCH_SIZE):
+        user_chunk = users[i:i + BULK_BATCH_SIZE]
+        if objects is None:
+            effective.objects.filter(user__in=user_chunk).delete()
+            _save_effective(model, _effective_rows(model, user_chunk))
+            continue
+
+        for j in xrange(0, len(objects), BULK_BATCH_SIZE):
+            chunk = objects[j:j + BULK_BATCH_SIZE]
+            effective.objects.filter(user__in=user_chunk, obj__in=chunk) \
+                .delete()
+            _save_effective(model, _effective_rows(model, user_chunk, chunk))
+
+
+def rebuild_effective_perms(model):
+    """
+    Rebuild the effective permissions table of a model from scratch.
+
+    @param model - model registered with params['effective']
+    """
+    if model not in effective_map:
+        raise RegistrationException(
+            "%s is not registered with effective permissions" % model)
+
+    effective_map[model].objects.all().delete()
+    objects = list(permission_map[model].objects \
+                   .values_list('obj', flat=True).distinct())
+    for i in xrange(0, len(objects), BULK_BATCH_SIZE):
+        chunk = objects[i:i + BULK_BATCH_SIZE]
+        _save_effective(model, _effective_rows(model, objects=chunk))
+    invalidate_cache()
+    _bump_versions([_model_version_key(model)])
+
+
+def _membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Update effective permissions and shared cache versions when Users are
+    added to or removed from Groups.
+    """
+    if not effective_map and get_perm_cache() is None:
+        return
+
+    if action == 'pre_clear':
+        if reverse:
+            # Group.user_set.clear(), remember the users that were removed
+            instance._cleared_users = list(instance.user_set \
+                                           .values_list('pk', flat=True))
+        return
+    elif action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        users = [instance.pk]
+    elif action == 'post_clear':
+        users = instance._cleared_users
+    else:
+        users = list(pk_set)
+
+    _users_changed(users)
+
+
+def _users_changed(users):
+    """
+    Called after the Groups of Users changed.
+
+    @param users - list of User ids
+    """
+    for model in effective_map:
+        _refresh_effective(model, users)
+    _bump_versions([_user_version_key(user) for user in users])
+
+
+def _group_pre_delete(sender, instance, **kwargs):
+    """
+    Remember the members of a Group that is being deleted.
+    """
+    if effective_map or get_perm_cache() is not None:
+        instance._deleted_users = list(instance.user_set \
+                                       .values_list('pk', flat=True))
+
+
+def _group_post_delete(sender, instance, **kwargs):
+    """
+    Update permissions of the members of a deleted Group.
+    """
+    if hasattr(instance, '_deleted_users'):
+        _users_changed(instance._deleted_users)
+
+
+models.signals.m2m_changed.connect(_membership_changed,
+                                   sender=User.groups.through)
+models.signals.pre_delete.connect(_group_pre_delete, sender=Group)
+models.signals.post_delete.connect(_group_post_delete, sender=Group)
+
+
+_signal_state = local()
+
+
+@contextmanager
+def deferred_signals(batch=True, executor=None):
+    """
+    Buffer granted and revoked signals sent within the block and dispatch
+    them when it exits without an error.  Signals are discarded if the block
+    raises.  Wrap a transaction to dispatch signals only after it committed:
+
+    >>> with deferred_signals():
+    ...     with transaction.commit_on_success():
+    ...         user.grant('Perm1', obj)
+
+    Nested blocks dispatch with the outermost block.
+
+    @param batch - collapse the buffered signals into one granted_batch and
+    one revoked_batch per model.  If False the buffered signals are sent
+    as they were, including batches sent by bulk functions.
+    @param executor - object with a submit(function, *args) method, e.g. a
+    ThreadPoolExecutor, the signals are sent by calling
+    executor.submit(send).  Default is to send them when the block exits.
+    """
+    buffers = getattr(_signal_state, 'buffers', None)
+    if buffers is None:
+        buffers = _signal_state.buffers = []
+    buffer = []
+    buffers.append(buffer)
+    try:
+        yield
+    finally:
+        buffers.pop()
+    # only reached if the block did not raise
+    if buffers:
+        buffers[-1].extend(buffer)
+    elif buffer:
+        sends = _collapse_signals(buffer) if batch else buffer
+        if executor is None:
+            _send_all(sends)
+        else:
+            executor.submit(_send_all, sends)
+
+
+def _collapse_signals(buffer):
+    """
+    Collapse buffered signals into batch signals, one per model for each of
+    granted and revoked, in the order models were first changed.
+    """
+    batches = {}
+    order = []
+    for signal, sender, kwargs in buffer:
+        if signal in (granted, granted_batch):
+            signal = granted_batch
+        else:
+            signal = revoked_batch
+        changes = kwargs.get('changes')
+        if changes is None:
+            obj = kwargs['object']
+            sender, changes = obj.__class__, [(sender, kwargs['perm'], obj)]
+        key = (signal, sender)
+        if key not in batches:
+            batches[key] = []
+            order.append(key)
+        batches[key].extend(changes)
+    return [(signal, model, {'changes':batches[(signal, model)]})
+            for signal, model in order]
+
+
+def _send_all(sends):
+    for signal, sender, kwargs in sends:
+        signal.send(sender=sender, **kwargs)
+
+
+def _send(signal, sender, perm, obj):
+    """
+    Send granted or revoked, or buffer it within deferred_signals()
+    """
+    buffers = getattr(_signal_state, 'buffers', None)
+    if buffers:
+        buffers[-1].append((signal, sender, {'perm':perm, 'object':obj}))
+    else:
+        signal.send(sender=sender, perm=perm, object=obj)
+
+
+def _send_batch(signal, model, changes):
+    """
+    Send granted_batch or revoked_batch, or buffer it within
+    deferred_signals()
+    """
+    buffers = getattr(_signal_state, 'buffers', None)
+    if buffers:
+        buffers[-1].append((signal, model, {'changes':changes}))
+    else:
+        signal.send(sender=model, changes=changes)
+
+
+def _upsert_database():
+    """
+    Return whether the default database supports INSERT ... ON CONFLICT
+    """
+    connection = db.connection
+    if connection.vendor == 'sqlite':
+        from django.db.backends.sqlite3.base import Database
+        return Database.sqlite_version_info >= (3, 24, 0)
+    if connection.vendor == 'postgresql':
+        return connection.ops.postgres_version[0:2] >= (9, 5)
+    return False
+
+
+def _has_unique_constraint(table, fields):
+    """
+    Return whether the database has a unique constraint on exactly the given
+    fields of a table.  Only sqlite and postgresql are inspected.
+
+    @param table - Model of the table
+    @param fields - names of the fields
+    """
+    connection = db.connection
+    name = table._meta.db_table
+    columns = set(table._meta.get_field(field).column for field in fields)
+    cursor = connection.cursor()
+    indexes = {}
+    if connection.vendor == 'sqlite':
+        # PRAGMA statements would commit the open transaction, the pragma
+        # table functions (sqlite >= 3.16) are read with a plain SELECT.
+        # Partial indexes can't be used by ON CONFLICT.
+        cursor.execute("""
+            SELECT il.name, ii.name
+            FROM pragma_index_list(%s) AS il, pragma_index_info(il.name) AS ii
+            WHERE il."unique" AND NOT il.partial""", [name])
+        for index, column in cursor.fetchall():
+            indexes.setdefault(index, set()).add(column)
+    elif connection.vendor == 'postgresql':
+        cursor.execute("""
+            SELECT i.indexrelid, a.attname
+            FROM pg_catalog.pg_index i
+            JOIN pg_catalog.pg_class c ON c.oid = i.indrelid
+            JOIN pg_catalog.pg_attribute a
+                ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE c.relname = %s AND pg_catalog.pg_table_is_visible(c.oid)
+                AND i.indisunique AND i.indpred IS NULL
+                AND i.indexprs IS NULL""", [name])
+        for index, column in cursor.fetchall():
+            indexes.setdefault(index, set()).add(column)
+    return columns in indexes.values()
+
+
+def _upsert_supported(model, field):
+    """
+    Return whether perms of the User or Group stored in field can be written
+    to the permission table of model with INSERT ... ON CONFLICT.  This needs
+    database support and a unique constraint on (field, obj).  Tables of apps
+    that have not added the constraints yet are written with
+    _update_or_create() instead.  The result is cached per table and field.
+    """
+    key = (model, field)
+    try:
+        return _upsert_tables[key]
+    except KeyError:
+        pass
+    supported = _upsert_database() \
+        and _has_unique_constraint(permission_map[model], [field, 'obj'])
+    _upsert_tables[key] = supported
+    return supported
+
+
+def _upsert(model, field, principal, obj, values, update, where=None):
+    """
+    Insert a permission row, or update the existing row of the principal on
+    obj, with a single INSERT ... ON CONFLICT statement.  This relies on the
+    unique constraints of the permission table, see _upsert_supported().
+
+    @param field - "user" or "group"
+    @param values - dict mapping perm fields to their values in a new row
+    @param update - list of (perm field, sql) pairs to set on an existing row.
+    "%(table)s" in the sql is replaced with the quoted table name.
+    @param where - sql condition an existing row must match to be updated
+    @return True if a row was inserted or updated
+    """
+    permissions = permission_map[model]
+    qn = db.connection.ops.quote_name
+    table = qn(permissions._meta.db_table)
+    column = lambda name: qn(permissions._meta.get_field(name).column)
+
+    key = [column(field), column('obj')]
+    columns = key + [column(name) for name in values]
+    sql = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) DO UPDATE SET %s' \
+        % (table, ', '.join(columns), ', '.join(['%s'] * len(columns)),
+           ', '.join(key),
+           ', '.join('%s = %s' % (column(name), value % {'table':table})
+                     for name, value in update))
+    if where:
+        sql += ' WHERE %s' % (where % {'table':table})
+
+    cursor = db.connection.cursor()
+    cursor.execute(sql, [principal.pk, obj.pk] + values.values())
+    transaction.commit_unless_managed()
+    return cursor.rowcount > 0
+
+
+def _update_or_create(model, field, principal, obj, values, update, q=None):
+    """
+    Update the permission row of the principal on obj, or create it if there
+    is none.  Used where upserts are not supported, see _upsert_supported().
+    If another process creates the row first the unique constraint rejects
+    the insert and the update is retried.
+
+    @param values - dict mapping perm fields to their values in a new row
+    @param update - kwargs for QuerySet.update() on an existing row
+    @param q - clause an existing row must match to be updated
+    @return True if a row was inserted or updated
+    """
+    permissions = permission_map[model]
+    query = permissions.objects.filter(**{field:principal, 'obj':obj})
+    if q is not None:
+        query = query.filter(q)
+    if query.update(**update):
+        return True
+
+    sid = transaction.savepoint()
+    try:
+        permissions.objects.create(**dict(values, obj=obj, **{field:principal}))
+    except IntegrityError:
+        # the row exists, it already had the perms or was just created
+        transaction.savepoint_rollback(sid)
+        return bool(query.update(**update))
+    transaction.savepoint_commit(sid)
+    return True
+
+
+def _grant_perm(model, field, principal, obj, perm):
+    """
+    Grant a perm to the User or Group stored in field, in a single statement
+    where the database supports it.
+
+    @return True if the perm was not granted before
+    """
+    params = params_for_model[model]
+    qn = db.connection.ops.quote_name
+    if params.get('storage') == 'bitmask':
+        mask = 1 << params['bits'][perm]
+        values = {BITMASK_FIELD:mask}
+        if _upsert_supported(model, field):
+            column = qn(BITMASK_FIELD)
+            return _upsert(model, field, principal, obj, values,
+                [(BITMASK_FIELD, '%%(table)s.%s | %d' % (column, mask))],
+                '%%(table)s.%s & %d = 0' % (column, mask))
+        return _update_or_create(model, field, principal, obj, values,
+            {BITMASK_FIELD:F(BITMASK_FIELD) | mask}, ~_perm_clause(model, [perm]))
+
+    values = dict((name, int(name == perm)) for name in get_model_perms(model))
+    if _upsert_supported(model, field):
+        return _upsert(model, field, principal, obj, values, [(perm, '1')],
+                       '%%(table)s.%s = 0' % qn(perm))
+    return _update_or_create(model, field, principal, obj, values, {perm:1},
+                             Q(**{perm:0}))
+
+
+def _set_perms(model, field, principal, obj, perms):
+    """
+    Set the perms of the User or Group stored in field to exactly perms, in a
+    single statement where the database supports it.
+
+    @return the perms the principal had before
+    """
+    params = params_for_model[model]
+    model_perms = get_model_perms(model)
+    for perm in perms:
+        if perm not in model_perms:
+            raise UnknownPermissionException(perm)
+
+    permissions = permission_map[model]
+    old = set(_get_perms(model, permissions.objects \
+                         .filter(**{field:principal, 'obj':obj})))
+
+    if params.get('storage') == 'bitmask':
+        values = {BITMASK_FIELD:reduce(or_, [1 << params['bits'][perm]
+                                             for perm in perms], 0)}
+    else:
+        values = dict((perm, int(perm in perms)) for perm in model_perms)
+
+    if _upsert_supported(model, field):
+        qn = db.connection.ops.quote_name
+        _upsert(model, field, principal, obj, values,
+                [(name, 'excluded.%s' % qn(name)) for name in values])
+    else:
+        _update_or_create(model, field, principal, obj, values, values)
+    return old
+
+
+def grant(user, perm, obj):
+    """
+    Grant a permission to a User.
+    """
+
+    model = obj.__class__
+
+    if perm not in get_model_perms(model):
+        raise UnknownPermissionException(perm)
+
+    if _grant_perm(model, 'user', user, obj, perm):
+        _perms_changed(model, [obj], users=[user])
+
+        _send(granted, user, perm, obj)
+
+
+def grant_group(group, perm, obj):
+    """
+    Grant a permission to a Group.
+    """
+
+    model = obj.__class__
+    if perm not in get_model_perms(model):
+        raise UnknownPermissionException(perm)
+
+    if _grant_perm(model, 'group', group, obj, perm):
+        _perms_changed(model, [obj], groups=[group])
+
+        _send(granted, group, perm, obj)
+
+
+def set_user_perms(user, perms, obj):
+    """
+    Set User permissions to exactly the specified permissions.
+    """    
+    if perms:
+        model = obj.__class__
+        old = _set_perms(model, 'user', user, obj, perms)
+        
+        for perm in get_model_perms(model):
+            if perm in perms and perm not in old:
+                _send(granted, user, perm, obj)
+            elif perm not in perms and perm in old:
+                _send(revoked, user, perm, obj)
+        
+        _perms_changed(model, [obj], users=[user])
+    
+    else:
+        # removing all perms.
+        revoke_all(user, obj)
+
+    return perms
+
+
+def set_group_perms(group, perms, obj):
+    """
+    Set group permissions to exactly the specified permissions.
+    """
+    if perms:
+        model = obj.__class__
+        old = _set_perms(model, 'group', group, obj, perms)
+    
+        for perm in get_model_perms(model):
+            if perm in perms and perm not in old:
+                _send(granted, group, perm, obj)
+            elif perm not in perms and perm in old:
+                _send(revoked, group, perm, obj)
+    
+        _perms_changed(model, [obj], groups=[group])
+
+    else:
+        # removing all perms.
+        revoke_all_group(group, obj)
+
+    return perms
+
+
+def revoke(user, perm, obj):
+    """
+    Revoke a permission from a User.
+    """
+
+    model = obj.__class__
+    permissions = permission_map[model]
+
+    try:
+        user_perms = permissions.objects.get(user=user, obj=obj)
+
+        if getattr(user_perms, perm):
+            _send(revoked, user, perm, obj)
 
             setattr(user_perms, perm, False)
 
@@ -393,6 +1644,7 @@ def revoke(user, perm, obj):
                 user_perms.save()
             else:
                 user_perms.delete()
+            _perms_changed(model, [obj], users=[user])
 
     except ObjectDoesNotExist:
         # User didnt have permission to begin with; do nothing.
@@ -411,7 +1663,7 @@ def revoke_group(group, perm, obj):
         group_perms = permissions.objects.get(group=group, obj=obj)
 
         if getattr(group_perms, perm):
-            revoked.send(sender=group, perm=perm, object=obj)
+            _send(revoked, group, perm, obj)
 
             setattr(group_perms, perm, False)
 
@@ -422,6 +1674,7 @@ def revoke_group(group, perm, obj):
                 group_perms.save()
             else:
                 group_perms.delete()
+            _perms_changed(model, [obj], groups=[group])
 
     except ObjectDoesNotExist:
         # Group didnt have permission to begin with; do nothing.
@@ -441,9 +1694,10 @@ def revoke_all(user, obj):
 
         for perm in get_model_perms(model):
             if getattr(user_perms, perm):
-                revoked.send(sender=user, perm=perm, object=obj)
+                _send(revoked, user, perm, obj)
 
         user_perms.delete()
+        _perms_changed(model, [obj], users=[user])
     except ObjectDoesNotExist:
         pass
 
@@ -461,54 +1715,389 @@ def revoke_all_group(group, obj):
 
         for perm in get_model_perms(model):
             if getattr(group_perms, perm):
-                revoked.send(sender=group, perm=perm, object=obj)
+                _send(revoked, group, perm, obj)
 
         group_perms.delete()
+        _perms_changed(model, [obj], groups=[group])
     except ObjectDoesNotExist:
         pass
 
 
+def bulk_grant(principals, perms, objects, batch_signal=False):
+    """
+    Grant permissions to many Users and Groups on many objects.
+
+    Existing permission rows are read with one query per model and batch of
+    objects.  Missing rows are inserted in bulk and existing rows are updated
+    with a single UPDATE.
+
+    @param principals - list of Users and Groups
+    @param perms - list of perms to grant
+    @param objects - list of objects, they may be instances of several models
+    @param batch_signal - send granted_batch once per model instead of
+    sending granted for every change
+    @return list of (grantee, perm, object) for every perm that was granted
+    """
+    return _bulk_set(principals, perms, objects, True, batch_signal)
+
+
+def bulk_revoke(principals, perms, objects, batch_signal=False):
+    """
+    Revoke permissions from many Users and Groups on many objects.  Rows left
+    without any permissions are deleted.
+
+    @param principals - list of Users and Groups
+    @param perms - list of perms to revoke
+    @param objects - list of objects, they may be instances of several models
+    @param batch_signal - send revoked_batch once per model instead of
+    sending revoked for every change
+    @return list of (grantee, perm, object) for every perm that was revoked
+    """
+    return _bulk_set(principals, perms, objects, False, batch_signal)
+
+
+def _bulk_set(principals, perms, objects, enabled, batch_signal):
+    """
+    Shared implementation of bulk_grant() and bulk_revoke()
+    """
+    users = [p for p in principals if isinstance(p, User)]
+    groups = [p for p in principals if isinstance(p, Group)]
+    if not (perms and (users or groups)):
+        return []
+
+    by_model = {}
+    for obj in objects:
+        by_model.setdefault(obj.__class__, []).append(obj)
+
+    all_changes = []
+    for model, model_objects in by_model.items():
+        model_perms = get_model_perms(model)
+        for perm in perms:
+            if perm not in model_perms:
+                raise UnknownPermissionException(perm)
+
+        changes = []
+        for i in xrange(0, len(model_objects), BULK_BATCH_SIZE):
+            chunk = model_objects[i:i + BULK_BATCH_SIZE]
+            changes.extend(_bulk_set_chunk(model, users, groups, perms, chunk,
+                                           enabled))
+
+        if changes:
+            _perms_changed(model, model_objects, users, groups)
+            all_changes.extend(changes)
+            if batch_signal:
+                signal = granted_batch if enabled else revoked_batch
+                _send_batch(signal, model, changes)
+            else:
+                signal = granted if enabled else revoked
+                for principal, perm, obj in changes:
+                    _send(signal, principal, perm, obj)
+
+    return all_changes
+
+
+def _bulk_set_chunk(model, users, groups, perms, objects, enabled):
+    """
+    Grant or revoke perms for a batch of objects of a single model
+
+    @return list of (grantee, perm, object) for every perm that changed
+    """
+    permissions = permission_map[model]
+    principal_clause = Q(user__in=users) | Q(group__in=groups)
+    rows = permissions.objects.filter(principal_clause, obj__in=objects)
+    existing = {}
+    for row in rows:
+        existing[(row.user_id, row.group_id, row.obj_id)] = row
+
+    changes = []
+    new_rows = []
+    update = False
+    for principal in users + groups:
+        if isinstance(principal, User):
+            key, kwargs = (principal.pk, None), {'user':principal}
+        else:
+            key, kwargs = (None, principal.pk), {'group':principal}
+
+        for obj in objects:
+            row = existing.get(key + (obj.pk,))
+            if row is None:
+                if not enabled:
+                    continue
+                row = permissions(obj=obj, **kwargs)
+                new_rows.append(row)
+            for perm in perms:
+                if bool(getattr(row, perm)) != enabled:
+                    setattr(row, perm, enabled)
+                    changes.append((principal, perm, obj))
+                    update |= row.pk is not None
+
+    if update:
+        # setting the perms on every matching row is idempotent, so all rows
+        # can be updated with one statement.
+        rows = permissions.objects.filter(principal_clause, obj__in=objects)
+        if params_for_model[model].get('storage') == 'bitmask':
+            mask = reduce(or_, (1 << params_for_model[model]['bits'][perm]
+                                for perm in perms))
+            field = F(BITMASK_FIELD)
+            value = field | mask if enabled else field & (_ALL_BITS ^ mask)
+            rows.update(**{BITMASK_FIELD:value})
+            empty = {BITMASK_FIELD:0}
+        else:
+            rows.update(**dict((perm, int(enabled)) for perm in perms))
+            empty = dict((perm, 0) for perm in get_model_perms(model))
+
+        if not enabled:
+            rows.filter(**empty).delete()
+
+    if new_rows:
+        if hasattr(permissions.objects, 'bulk_create'):
+            permissions.objects.bulk_create(new_rows)
+        else:
+            # bulk_create() requires django 1.4
+            for row in new_rows:
+                row.save()
+
+    return changes
+
+
+def set_perms_matrix(matrix, batch_signal=False):
+    """
+    Set the permissions of many Users and Groups on many objects to exactly
+    the given perms, e.g. to save a whole sharing grid at once.
+
+    Existing permission rows are read with one query per model and batch of
+    objects and compared with the desired perms.  Only rows that change are
+    written: missing rows are inserted in bulk, rows left without perms are
+    deleted with a single DELETE and changed rows are updated with one UPDATE
+    for each distinct set of perms.
+
+    @param matrix - dict mapping (User or Group, object) to the list of perms
+    it should have, an empty list revokes all perms.  Objects may be
+    instances of several models.
+    @param batch_signal - send granted_batch and revoked_batch once per model
+    instead of sending granted and revoked for every change
+    @return tuple of lists of (grantee, perm, object) for every perm that was
+    granted and every perm that was revoked
+    """
+    by_model = {}
+    for (principal, obj), perms in matrix.items():
+        by_model.setdefault(obj.__class__, {})[(principal, obj)] = perms
+
+    all_granted, all_revoked = [], []
+    for model, model_matrix in by_model.items():
+        model_perms = get_model_perms(model)
+        for perms in model_matrix.values():
+            for perm in perms:
+                if perm not in model_perms:
+                    raise UnknownPermissionException(perm)
+
+        by_object = {}
+        for key, perms in model_matrix.items():
+            by_object.setdefault(key[1].pk, {})[key] = perms
+        object_ids = by_object.keys()
+
+        granted_changes, revoked_changes = [], []
+        for i in xrange(0, len(object_ids), BULK_BATCH_SIZE):
+            chunk = {}
+            for pk in object_ids[i:i + BULK_BATCH_SIZE]:
+                chunk.update(by_object[pk])
+            changes = _set_matrix_chunk(model, chunk)
+            granted_changes.extend(changes[0])
+            revoked_changes.extend(changes[1])
+
+        if granted_changes or revoked_changes:
+            changed = granted_changes + revoked_changes
+            objects = dict((obj.pk, obj) for p, perm, obj in changed).values()
+            users = dict((p.pk, p) for p, perm, obj in changed
+                         if isinstance(p, User)).values()
+            groups = dict((p.pk, p) for p, perm, obj in changed
+                          if isinstance(p, Group)).values()
+            _perms_changed(model, objects, users, groups)
+            all_granted.extend(granted_changes)
+            all_revoked.extend(revoked_changes)
+            for changes, signal, batch in (
+                    (granted_changes, granted, granted_batch),
+                    (revoked_changes, revoked, revoked_batch)):
+                if not changes:
+                    continue
+                if batch_signal:
+                    _send_batch(batch, model, changes)
+                else:
+                    for principal, perm, obj in changes:
+                        _send(signal, principal, perm, obj)
+
+    return all_granted, all_revoked
+
+
+def _set_matrix_chunk(model, matrix):
+    """
+    Set perms for a batch of (principal, object) pairs of a single model
+
+    @return tuple of lists of (grantee, perm, object) for every perm that was
+    granted and every perm that was revoked
+    """
+    permissions = permission_map[model]
+    params = params_for_model[model]
+    model_perms = get_model_perms(model)
+    users = set(p.pk for p, obj in matrix if isinstance(p, User))
+    groups = set(p.pk for p, obj in matrix if isinstance(p, Group))
+    objects = set(obj.pk for p, obj in matrix)
+
+    fields = _perm_fields(model)
+    existing = {}
+    rows = permissions.objects.filter(Q(user__in=users) | Q(group__in=groups),
+                                      obj__in=objects) \
+        .values_list('pk', 'user', 'group', 'obj', *fields)
+    for values in rows:
+        existing[values[1:4]] = (values[0],
+                                 set(_row_perms(model, fields, values[4:])))
+
+    granted_changes, revoked_changes = [], []
+    new_rows, deleted, updated = [], [], {}
+    for (principal, obj), perms in matrix.items():
+        if isinstance(principal, User):
+            key, kwargs = (principal.pk, None, obj.pk), {'user':principal}
+        else:
+            key, kwargs = (None, principal.pk, obj.pk), {'group':principal}
+        pk, old = existing.get(key, (None, set()))
+        perms = set(perms)
+        if perms == old:
+            continue
+
+        for perm in model_perms:
+            if perm in perms and perm not in old:
+                granted_changes.append((principal, perm, obj))
+            elif perm in old and perm not in perms:
+                revoked_changes.append((principal, perm, obj))
+
+        if params.get('storage') == 'bitmask':
+            values = ((BITMASK_FIELD, reduce(or_, [1 << params['bits'][perm]
+                                                   for perm in perms], 0)),)
+        else:
+            values = tuple((perm, int(perm in perms)) for perm in model_perms)
+
+        if pk is None:
+            new_rows.append(permissions(obj=obj, **dict(values, **kwargs)))
+        elif perms:
+            updated.setdefault(values, []).append(pk)
+        else:
+            deleted.append(pk)
+
+    if deleted:
+        permissions.objects.filter(pk__in=deleted).delete()
+    for values, pks in updated.items():
+        permissions.objects.filter(pk__in=pks).update(**dict(values))
+    if new_rows:
+        if hasattr(permissions.objects, 'bulk_create'):
+            permissions.objects.bulk_create(new_rows)
+        else:
+            # bulk_create() requires django 1.4
+            for row in new_rows:
+                row.save()
+
+    return granted_changes, revoked_changes
+
+
 def get_user_perms(user, obj, groups=True):
     """
     Return the permissions that the User has on the given object.
     """
+    perms = _get_prefetched_perms(user, obj, groups)
+    if perms is not None:
+        return list(perms)
+
+    if user.pk is not None and get_perm_cache() is not None:
+        return list(_get_shared_perms(user, obj, groups))
+    return _load_user_perms(user, obj, groups)
+
+
+def _load_user_perms(user, obj, groups):
+    """
+    Load the permissions that the User has on the given object from the
+    database.
+    """
     klass = obj.__class__
-    permissions = permission_map[klass]
-    try:
-        fields = get_model_perms(klass)
-        kwargs = {}
-        for field in fields:
-            kwargs[field] = Sum(field)
-        if groups:
-            q = permissions.objects.filter(Q(user=user) | Q(group__user=user))
-        else:
-            q = permissions.objects.filter(user=user)
-        q = q.filter(obj=obj).aggregate(**kwargs)
-        return [field for field, value in q.items() if value]
+    perms = _get_perms(klass, _user_perms_query(user, klass, groups) \
+                       .filter(obj=obj))
+    if _inherited(klass):
+        inherited = _inherited_perms(klass, [obj],
+            lambda ancestor: _user_perms_query(user, ancestor, groups))
+        perms = list(set(perms).union(inherited.get(obj.pk, ())))
+    return perms
 
-    except permissions.DoesNotExist:
-        return []
+
+def _user_perms_query(user, model, groups=True):
+    """
+    Return a queryset of the permission rows that apply to a User.
+
+    @param groups - True to include rows of the User's Groups, 'only' for
+    just the rows of the User's Groups
+    """
+    permissions = permission_map[model]
+    if groups == 'only':
+        return permissions.objects.filter(group__in=get_user_group_ids(user))
+    if groups and model in effective_map:
+        return effective_map[model].objects.filter(user=user)
+    return permissions.objects.filter(_user_clause(user, groups))
+
+
+def _user_clause(user, groups=True):
+    """
+    Return a Q clause matching the permission rows of a User, and optionally
+    of the User's Groups.  Rows of Groups are matched by the cached ids of the
+    Groups instead of joining group memberships, see get_user_group_ids()
+    """
+    group_ids = get_user_group_ids(user) if groups else None
+    if group_ids:
+        return Q(user=user) | Q(group__in=group_ids)
+    return Q(user=user)
+
+
+def get_user_perms_many(user, objects, groups=True):
+    """
+    Return the permissions that the User has on each of many objects.
+
+    Permissions are loaded with a single values_list() query per model and
+    batch of objects, instead of one query per object.
+
+    @param user - User whose permissions are returned
+    @param objects - list or queryset of objects, possibly of several models
+    @param groups - include permissions the User has through Groups, or
+    'only' for just the permissions of the User's Groups
+    @return dict mapping each object to a list of perms.  Objects of models
+    that are not registered have no perms.
+    """
+    by_model = {}
+    for obj in objects:
+        by_model.setdefault(obj.__class__, []).append(obj)
+
+    perms = {}
+    for model, model_objects in by_model.items():
+        if model not in permission_map:
+            for obj in model_objects:
+                perms[obj] = []
+            continue
+
+        fields = _perm_fields(model)
+        query = _user_perms_query(user, model, groups)
+        for i in xrange(0, len(model_objects), BULK_BATCH_SIZE):
+            chunk = model_objects[i:i + BULK_BATCH_SIZE]
+            found = _inherited_perms(model, chunk,
+                lambda ancestor: _user_perms_query(user, ancestor, groups))
+            for row in query.filter(obj__in=chunk) \
+                    .values_list('obj', *fields):
+                found.setdefault(row[0], set()) \
+                    .update(_row_perms(model, fields, row[1:]))
+            for obj in chunk:
+                perms[obj] = list(found.get(obj.pk, ()))
+    return perms
 
 
 def get_user_perms_any(user, klass, groups=True):
     """
     return permission types that the user has on a given Model
     """
-    permissions = permission_map[klass]
-    try:
-        fields = get_model_perms(klass)
-        kwargs = {}
-        for field in fields:
-            kwargs[field] = Sum(field)
-        if groups:
-            q = permissions.objects.filter(Q(user=user) | Q(group__user=user))
-        else:
-            q = permissions.objects.filter(user=user)
-        q = q.aggregate(**kwargs)
-        return [field for field, value in q.items() if value]
-
-    except permissions.DoesNotExist:
-        return []
+    return _get_perms(klass, _user_perms_query(user, klass, groups))
 
 
 def get_group_perms(group, obj, groups=True):
@@ -517,18 +2106,18 @@ def get_group_perms(group, obj, groups=True):
 
     @param groups - does nothing, compatibility with user version
     """
+    perms = _get_prefetched_perms(group, obj, 'group')
+    if perms is not None:
+        return list(perms)
+
     klass = obj.__class__
     permissions = permission_map[klass]
-    try:
-        fields = get_model_perms(klass)
-        kwargs = {}
-        for field in fields:
-            kwargs[field] = Sum(field)
-        q = permissions.objects.filter(group=group, obj=obj).aggregate(**kwargs)
-        return [field for field, value in q.items() if value]
-
-    except permissions.DoesNotExist:
-        return []
+    perms = _get_perms(klass, permissions.objects.filter(group=group, obj=obj))
+    if _inherited(klass):
+        inherited = _inherited_perms(klass, [obj], lambda ancestor: \
+            permission_map[ancestor].objects.filter(group=group))
+        perms = list(set(perms).union(inherited.get(obj.pk, ())))
+    return perms
 
 
 def get_group_perms_any(group, klass):
@@ -536,16 +2125,263 @@ def get_group_perms_any(group, klass):
     return permission types that the user has on a given Model
     """
     permissions = permission_map[klass]
+    return _get_perms(klass, permissions.objects.filter(group=group))
+
+
+def prefetch_perms(user, objects, groups=True):
+    """
+    Load the User's permissions on many objects at once.
+
+    Permission rows for all objects are fetched with a single query per model
+    and batch of objects.  The permissions are attached to each instance and
+    used by get_user_perms(), user_has_perm() and the permissions template
+    filter instead of querying the database for every object.  Prefetched
+    permissions are discarded when permissions change.
+
+    @param user - User whose permissions are loaded
+    @param objects - list or queryset of objects, a queryset is evaluated so
+    its instances carry the permissions
+    @param groups - also load permissions the User has through Groups
+    @return objects
+    """
+    by_model = {}
+    for obj in objects:
+        by_model.setdefault(obj.__class__, []).append(obj)
+
+    generation = get_cache_generation()
+    for model, model_objects in by_model.items():
+        permissions = permission_map[model]
+        fields = _perm_fields(model)
+
+        for i in xrange(0, len(model_objects), BULK_BATCH_SIZE):
+            chunk = model_objects[i:i + BULK_BATCH_SIZE]
+            q = permissions.objects.filter(_user_clause(user, groups))
+            rows = q.filter(obj__in=chunk) \
+                .values_list('obj', 'user', *fields)
+
+            # collect perms granted directly and through groups separately so
+            # that both kinds of lookups can be answered.
+            user_perms, all_perms = {}, {}
+            for row in rows:
+                perms = _row_perms(model, fields, row[2:])
+                all_perms.setdefault(row[0], set()).update(perms)
+                if row[1] == user.pk:
+                    user_perms.setdefault(row[0], set()).update(perms)
+
+            if _inherited(model):
+                for pk, perms in _inherited_perms(model, chunk, lambda \
+                        ancestor: _user_perms_query(user, ancestor, False)) \
+                        .items():
+                    user_perms.setdefault(pk, set()).update(perms)
+                if groups:
+                    for pk, perms in _inherited_perms(model, chunk, lambda \
+                            ancestor: _user_perms_query(user, ancestor)) \
+                            .items():
+                        all_perms.setdefault(pk, set()).update(perms)
+
+            for obj in chunk:
+                cache = _prefetched_perms_cache(obj, generation)
+                cache[(user.pk, False)] = frozenset(user_perms.get(obj.pk, ()))
+                if groups:
+                    cache[(user.pk, True)] = \
+                        frozenset(all_perms.get(obj.pk, ()))
+
+    return objects
+
+
+def get_object_perms(obj):
+    """
+    Load the perms of every User and Group that has permissions on an object
+    with a single query.  Only perms granted on the object itself are
+    included, the same Users and Groups get_users(obj, False) and
+    get_groups(obj) return.
+
+    Unless the object inherits permissions, the perms are also attached to
+    it like prefetch_perms() does, so that get_user_perms(user, obj, False),
+    get_group_perms() and the permissions template filter use them.
+
+    @return dict mapping Users and Groups to their lists of perms
+    """
+    model = obj.__class__
+    permissions = permission_map[model]
+    fields = _perm_fields(model)
+    rows = permissions.objects.filter(obj=obj) \
+        .select_related('user', 'group').order_by('pk')
+
+    perms = {}
+    for row in rows:
+        principal = row.user if row.user_id is not None else row.group
+        perms[principal] = _row_perms(model, fields,
+                                      [getattr(row, field) for field in fields])
+
+    if not _inherited(model):
+        cache = _prefetched_perms_cache(obj, get_cache_generation())
+        for principal, principal_perms in perms.items():
+            if isinstance(principal, Group):
+                key = (principal.pk, 'group')
+            else:
+                key = (principal.pk, False)
+            cache[key] = frozenset(principal_perms)
+    return perms
+
+
+class PermissionCheck(object):
+    """
+    The deferred result of PermissionLoader.has_perm() or get_perms().
+    Evaluating it, as a bool or with get(), dispatches all checks queued on
+    the loader that have not been answered yet.
+    """
+
+    def __init__(self, loader, key, perm=None):
+        self.loader = loader
+        self.key = key
+        self.perm = perm
+
+    def get(self):
+        """
+        @return True if the User has the perm, or the list of perms if the
+        check was made by get_perms()
+        """
+        perms = self.loader._get(self.key)
+        return list(perms) if self.perm is None else self.perm in perms
+
+    def __nonzero__(self):
+        return bool(self.get())
+
+    def __repr__(self):
+        return '<PermissionCheck %r>' % (self.key + (self.perm,),)
+
+
+class PermissionLoader(object):
+    """
+    Batches permission checks, e.g. of the nodes resolved by a GraphQL query.
+    Checks are queued and return a PermissionCheck.  The first check that is
+    evaluated loads the perms of all queued objects with get_user_perms_many(),
+    one query per model and batch of objects, instead of one query per check.
+
+        loader = PermissionLoader()
+        checks = [loader.has_perm(user, 'view', obj) for obj in objects]
+        visible = [obj for obj, check in zip(objects, checks) if check]
+
+    Answers are kept for the lifetime of the loader, typically one request,
+    and discarded when permissions change.
+    """
+
+    def __init__(self):
+        self._objects = {}
+        self._queue = set()
+        self._perms = {}
+        self._generation = get_cache_generation()
+
+    def has_perm(self, user, perm, obj, groups=True):
+        """
+        Queue a check of whether the User has a perm on an object.  See
+        user_has_perm()
+
+        @return PermissionCheck, True if the User has the perm
+        """
+        return PermissionCheck(self, self._load(user, obj, groups), perm)
+
+    def get_perms(self, user, obj, groups=True):
+        """
+        Queue loading the perms the User has on an object.  See
+        get_user_perms()
+
+        @return PermissionCheck, get() returns the list of perms
+        """
+        return PermissionCheck(self, self._load(user, obj, groups))
+
+    def dispatch(self):
+        """
+        Load the perms of all queued objects.
+        """
+        by_user = {}
+        for key in self._queue:
+            user, obj = self._objects[key]
+            by_user.setdefault(key[:2], (user, []))[1].append(obj)
+        self._queue = set()
+
+        for (pk, groups), (user, objects) in by_user.items():
+            for obj, perms in get_user_perms_many(user, objects,
+                                                  groups).items():
+                self._perms[(pk, groups, obj.__class__, obj.pk)] = perms
+
+    def _load(self, user, obj, groups):
+        """
+        Queue an object unless its perms are loaded already.
+
+        @return the key of the perms of the object
+        """
+        key = (user.pk, groups, obj.__class__, obj.pk)
+        if key not in self._objects:
+            self._objects[key] = user, obj
+            self._queue.add(key)
+        return key
+
+    def _get(self, key):
+        """
+        Return the perms of a queued object, dispatching the queue if they
+        are not loaded or are stale.
+        """
+        if self._generation != get_cache_generation():
+            # permissions changed, reload everything loaded so far at once
+            self._queue.update(self._perms)
+            self._perms.clear()
+            self._generation = get_cache_generation()
+        if key not in self._perms:
+            self._queue.add(key)
+            self.dispatch()
+        return self._perms[key]
+
+
+def _row_perms(model, fields, values):
+    """
+    Return the perms set in a row of values loaded from a permission table.
+
+    @param fields - names of the fields the values were loaded from
+    """
+    params = params_for_model[model]
+    if params.get('storage') == 'bitmask':
+        mask = values[0]
+        return [perm for perm, bit in params['bits'].items()
+                if mask & 1 << bit]
+    return [field for field, value in zip(fields, values) if value]
+
+
+def _prefetched_perms_cache(obj, generation):
+    """
+    Return the dictionary of prefetched perms stored on an object, discarding
+    it if permissions have changed since it was loaded.
+    """
     try:
-        fields = get_model_perms(klass)
-        kwargs = {}
-        for field in fields:
-            kwargs[field] = Sum(field)
-        q = permissions.objects.filter(group=group).aggregate(**kwargs)
-        return [field for field, value in q.items() if value]
+        cache_generation, cache = obj._prefetched_perms
+    except AttributeError:
+        cache_generation, cache = None, None
 
-    except permissions.DoesNotExist:
-        return []
+    if cache_generation != generation:
+        cache = {}
+        obj._prefetched_perms = generation, cache
+    return cache
+
+
+def _get_prefetched_perms(user, obj, groups):
+    """
+    Return perms loaded with prefetch_perms() or get_object_perms(), or None
+    if they were not prefetched for this User or are stale.
+
+    @param groups - whether perms through Groups are included, or 'group' to
+    look up the perms of a Group
+    """
+    try:
+        generation, cache = obj._prefetched_perms
+    except AttributeError:
+        return None
+
+    if generation != get_cache_generation():
+        return None
+    if groups != 'group':
+        groups = bool(groups)
+    return cache.get((user.pk, groups))
 
 
 def get_model_perms(model):
@@ -569,6 +2405,381 @@ def get_model_perms(model):
     return permissions_for_model[model]
 
 
+def _get_perms(model, q):
+    """
+    Return the list of perms set on any of the permission rows matched by q.
+
+    @param model - registered model the permission rows belong to
+    @param q - queryset of permission rows
+    """
+    params = params_for_model[model]
+    if params.get('storage') == 'bitmask':
+        # OR the masks of all rows together, there are at most a few rows: one
+        # for the user and one for each of their groups.
+        mask = reduce(or_, q.values_list(BITMASK_FIELD, flat=True), 0)
+        return _row_perms(model, [BITMASK_FIELD], [mask])
+
+    kwargs = {}
+    for perm in params['perms']:
+        kwargs[perm] = Sum(perm)
+    return [perm for perm, value in q.aggregate(**kwargs).items() if value]
+
+
+def _perm_clause(model, perms, prefix='', all=False):
+    """
+    Build a Q clause matching permission rows that have any, or all, of the
+    given perms.  Clauses are built once for each set of arguments, up to
+    CACHE_SIZE clauses.  Q objects are copied when combined so the cached
+    clauses are never modified.
+
+    @param model - registered model the perms belong to
+    @param perms - list of perms to match
+    @param prefix - lookup path to the permission table, e.g. "operms__"
+    @param all - match rows having all of the perms instead of any of them
+    """
+    key = (model, tuple(perms), prefix, all)
+    try:
+        return _clause_cache[key]
+    except KeyError:
+        pass
+
+    clause = _build_perm_clause(model, perms, prefix, all)
+    # only registered perms are cached, unknown perms are arbitrary input
+    if len(_clause_cache) < CACHE_SIZE \
+            and set(perms).issubset(get_model_perms(model)):
+        _clause_cache[key] = clause
+    return clause
+
+
+def _build_perm_clause(model, perms, prefix, all):
+    """
+    Build the Q clause returned by _perm_clause()
+    """
+    params = params_for_model[model]
+    if params.get('storage') != 'bitmask':
+        if all:
+            return Q(**dict((prefix + perm, True) for perm in perms))
+        return reduce(or_, (Q(**{prefix + perm: True}) for perm in perms))
+
+    masks = []
+    for perm in perms:
+        try:
+            masks.append(1 << params['bits'][perm])
+        except KeyError:
+            raise UnknownPermissionException(perm)
+
+    field = prefix + BITMASK_FIELD
+    if all:
+        # every bit is set:  bitmask = bitmask | mask
+        return Q(**{field: F(field) | reduce(or_, masks, 0)})
+    if not prefix:
+        # any bit is set:  NOT bitmask = bitmask & ~mask
+        return ~Q(**{field: F(field) & (_ALL_BITS ^ reduce(or_, masks))})
+
+    # Negating a clause that spans a relation would match objects that have
+    # no rows lacking the bits.  Test each bit on its own instead.
+    return reduce(or_, (Q(**{field: F(field) | mask}) for mask in masks))
+
+
+def _check_sql(model, perms, principal, instance, all=False, group_count=0,
+               count=False):
+    """
+    Build the SQL of a permission check:  whether a row of the permission
+    table matches the principal, and the object, with any or all of the perms.
+    The ORM rebuilds and copies the whole query of every check, for bitmask
+    storage the F() expressions copy the Model too, so the SQL is built once
+    for each shape of check and only the parameters change.  Checks use LIMIT,
+    see _LIMIT_VENDORS, counts are supported by all databases.
+
+    @param principal - 'user', 'effective' for the effective permissions of
+    a user, 'groups' for the user and their groups, or 'group'
+    @param instance - True to match a single object
+    @param group_count - number of Group ids matched by 'groups'
+    @param count - count the matching objects instead of checking for a row
+    @return tuple of the SQL and the parameters of the perms.  The SQL takes
+    the primary key of the principal, the Group ids, the primary key of the
+    object if instance, then the perm parameters.
+    """
+    key = (model, tuple(perms or ()), principal, instance, all, group_count,
+           count)
+    try:
+        return _check_cache[key]
+    except KeyError:
+        pass
+
+    qn = db.connection.ops.quote_name
+    if principal == 'effective':
+        permissions = effective_map[model]
+    else:
+        permissions = permission_map[model]
+    column = lambda name: qn(permissions._meta.get_field(name).column)
+
+    if principal == 'group':
+        where = ['%s = %%s' % column('group')]
+    elif principal == 'groups' and group_count:
+        where = ['(%s = %%s OR %s IN (%s))' % (column('user'), column('group'),
+                                               ', '.join(['%s'] * group_count))]
+    else:
+        where = ['%s = %%s' % column('user')]
+    if instance:
+        where.append('%s = %%s' % column('obj'))
+
+    perm_sql, perm_params = _perm_sql(model, perms, all)
+    if perm_sql:
+        where.append(perm_sql)
+
+    where = ' AND '.join(where)
+    table = qn(permissions._meta.db_table)
+    if not count:
+        sql = 'SELECT 1 FROM %s WHERE %s LIMIT 1' % (table, where)
+    elif group_count:
+        # objects may have rows of the user and of several groups
+        sql = 'SELECT COUNT(DISTINCT %s) FROM %s WHERE %s' \
+            % (column('obj'), table, where)
+    else:
+        sql = 'SELECT COUNT(*) FROM %s WHERE %s' % (table, where)
+    # _perm_sql() rejected unknown perms, keys only hold registered perms
+    if len(_check_cache) < CACHE_SIZE:
+        _check_cache[key] = sql, perm_params
+    return sql, perm_params
+
+
+def _perm_sql(model, perms, all=False, table=None):
+    """
+    Build the SQL condition matching permission rows that have any, or all,
+    of the given perms.
+
+    @param perms - list of perms to match, or None to match any row
+    @param table - quoted table name to qualify the perm columns with
+    @return tuple of the SQL, or None if there is no condition, and its
+    parameters
+    """
+    if not perms:
+        return None, []
+
+    qn = db.connection.ops.quote_name
+    column = lambda name: '%s.%s' % (table, qn(name)) if table else qn(name)
+    params = params_for_model[model]
+    if params.get('storage') == 'bitmask':
+        mask = 0
+        for perm in perms:
+            try:
+                mask |= 1 << params['bits'][perm]
+            except KeyError:
+                raise UnknownPermissionException(perm)
+        if all:
+            return '(%s & %%s) = %%s' % column(BITMASK_FIELD), [mask, mask]
+        return '(%s & %%s) <> 0' % column(BITMASK_FIELD), [mask]
+
+    for perm in perms:
+        if perm not in params['perms']:
+            raise FieldError("Cannot resolve keyword %r into field." % perm)
+    # perm columns are integers, postgresql does not compare them to booleans
+    return '(%s)' % (' AND ' if all else ' OR ').join(
+        '%s = %%s' % column(perm) for perm in perms), [1] * len(perms)
+
+
+def _check(model, principal, obj, perms, all=False, groups=True):
+    """
+    Run a permission check built by _check_sql()
+
+    @param principal - User or Group
+    @param obj - instance to check, or None to check any instance
+    @param groups - include perms a User has through Groups
+    @return True if a permission row matches
+    """
+    if db.connection.vendor not in _LIMIT_VENDORS:
+        return _check_orm(model, principal, obj, perms, all, groups)
+
+    if isinstance(principal, Group):
+        kind, params = 'group', [principal.pk]
+    elif groups and model in effective_map and not all:
+        kind, params = 'effective', [principal.pk]
+    elif groups:
+        kind = 'groups'
+        params = [principal.pk] + sorted(get_user_group_ids(principal))
+    else:
+        kind, params = 'user', [principal.pk]
+
+    sql, perm_params = _check_sql(model, perms, kind, obj is not None, all,
+                                  len(params) - 1)
+    if obj is not None:
+        params.append(obj.pk)
+    cursor = db.connection.cursor()
+    cursor.execute(sql, params + perm_params)
+    return cursor.fetchone() is not None
+
+
+def _check_orm(model, principal, obj, perms, all=False, groups=True):
+    """
+    Run a permission check through the ORM, for databases the SQL of
+    _check_sql() does not support.  The arguments are those of _check()
+    """
+    if isinstance(principal, Group):
+        permissions, q = permission_map[model], Q(group=principal)
+    elif groups and model in effective_map and not all:
+        permissions, q = effective_map[model], Q(user=principal)
+    elif groups:
+        permissions = permission_map[model]
+        q = Q(user=principal) | Q(group__user=principal)
+    else:
+        permissions, q = permission_map[model], Q(user=principal)
+
+    query = permissions.objects.filter(q)
+    if perms:
+        query = query.filter(_perm_clause(model, perms, all=all))
+    if obj is not None:
+        query = query.filter(obj=obj)
+    return query.exists()
+
+
+def _build_related(model, related):
+    """
+    Build the permission Models of lazily registered Models that related
+    lookups of the *_get_objects_*_perms functions follow.
+    """
+    for path in related:
+        permission_map[_get_related_model(model, path)]
+
+
+def _get_related_model(model, path):
+    """
+    Follow a lookup path, e.g. "parent__parent", from a model and return the
+    model at the end of it.
+    """
+    for name in path.split('__'):
+        field = model._meta.get_field_by_name(name)[0]
+        if hasattr(field, 'rel') and field.rel:
+            model = field.rel.to
+        else:
+            # reverse relation
+            model = field.model
+    return model
+
+
+def _inherited(model):
+    """
+    Return the ancestors a registered Model inherits permissions from, as a
+    list of (lookup path, Model) tuples starting with the parent.
+    """
+    try:
+        return inherit_map[model]
+    except KeyError:
+        pass
+
+    levels, path, current = [], [], model
+    while params_for_model[current].get('inherit_from'):
+        name = params_for_model[current]['inherit_from']
+        try:
+            field = current._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise RegistrationException("%s has no field %s to inherit from"
+                                        % (current.__name__, name))
+        if not isinstance(field, models.ForeignKey):
+            raise RegistrationException("%s.%s is not a ForeignKey"
+                                        % (current.__name__, name))
+        current = field.rel.to
+        path.append(name)
+        if current is model or current in [m for p, m in levels]:
+            raise RegistrationException("Inheritance of %s forms a cycle"
+                                        % model.__name__)
+        if current not in permission_map:
+            raise RegistrationException("%s inherits from unregistered model %s"
+                                        % (model.__name__, current.__name__))
+        levels.append(('__'.join(path), current))
+
+    inherit_map[model] = levels
+    return levels
+
+
+def _inheriting_models(model):
+    """
+    Return the registered Models that inherit permissions from a Model.
+    """
+    return [m for m in params_for_model
+            if model in [ancestor for path, ancestor in _inherited(m)]]
+
+
+def _inherited_perms(model, objects, rows):
+    """
+    Return the perms objects inherit from their ancestors, with one query for
+    the ancestors and one for each ancestor Model.
+
+    @param model - registered Model of the objects
+    @param objects - list of objects
+    @param rows - function returning a queryset of the permission rows of the
+    User or Group for an ancestor Model
+    @return dict mapping object pks to sets of perms
+    """
+    levels = _inherited(model)
+    if not levels:
+        return {}
+
+    model_perms = get_model_perms(model)
+    ancestors = list(model.objects.filter(pk__in=[obj.pk for obj in objects]) \
+                     .values_list('pk', *[path for path, m in levels]))
+    inherited = {}
+    for index, (path, ancestor) in enumerate(levels):
+        objects_by_ancestor = {}
+        for row in ancestors:
+            if row[index + 1] is not None:
+                objects_by_ancestor.setdefault(row[index + 1], []) \
+                    .append(row[0])
+        if not objects_by_ancestor:
+            continue
+
+        fields = _perm_fields(ancestor)
+        for row in rows(ancestor).filter(obj__in=objects_by_ancestor.keys()) \
+                .values_list('obj', *fields):
+            perms = [perm for perm in _row_perms(ancestor, fields, row[1:])
+                     if perm in model_perms]
+            for pk in objects_by_ancestor[row[0]]:
+                inherited.setdefault(pk, set()).update(perms)
+    return inherited
+
+
+def _inherited_clauses(model, perms, user=None, group=None, groups=True,
+                       exclude=()):
+    """
+    Build Q clauses matching objects whose ancestors grant any of the perms,
+    one per ancestor.  The clauses are passed to _get_objects() like related
+    clauses.
+
+    @param perms - list of perms of the model, or None to match any perm
+    @param user - User who must have the perms, or
+    @param group - Group who must have the perms
+    @param groups - include perms the User has through Groups
+    @param exclude - lookup paths that already have a related clause
+    """
+    clauses = []
+    for path, ancestor in _inherited(model):
+        if path in exclude:
+            continue
+        ancestor_perms = None
+        if perms is not None:
+            ancestor_perms = [perm for perm in perms
+                              if perm in get_model_perms(ancestor)]
+            if not ancestor_perms:
+                continue
+
+        if group is not None:
+            prefix = '%s__operms__' % path
+            clause = Q(**{prefix + 'group':group})
+        elif groups and ancestor in effective_map:
+            prefix = '%s__eperms__' % path
+            clause = Q(**{prefix + 'user':user})
+        else:
+            prefix = '%s__operms__' % path
+            clause = Q(**{prefix + 'user':user})
+            if groups:
+                clause |= Q(**{prefix + 'group__user':user})
+
+        if ancestor_perms:
+            clause &= _perm_clause(ancestor, ancestor_perms, prefix)
+        clauses.append(clause)
+    return clauses
+
+
 def user_has_perm(user, perm, obj, groups=True):
     """
     Check if a User has a permission on a given object.
@@ -591,18 +2802,18 @@ def user_has_perm(user, perm, obj, groups=True):
         # not a valid permission
         return False
 
-    permissions = permission_map[model]
+    prefetched = _get_prefetched_perms(user, obj, groups)
+    if prefetched is not None:
+        return perm in prefetched
 
-    d = {
-        perm: True
-    }
+    if user.pk is not None and get_perm_cache() is not None:
+        return perm in _get_shared_perms(user, obj, groups)
 
-    if groups:
-        return permissions.objects.filter(obj=obj, **d) \
-            .filter(Q(user=user) | Q(group__user=user)) \
-            .exists()
-    else:
-        return permissions.objects.filter(user=user, obj=obj, **d).exists()
+    if _inherited(model):
+        return user_get_objects_any_perms(user, model, [perm], groups) \
+            .filter(pk=obj.pk).exists()
+
+    return _check(model, user, obj, [perm], groups=groups)
 
 
 def group_has_perm(group, perm, obj):
@@ -616,20 +2827,18 @@ def group_has_perm(group, perm, obj):
     """
 
     model = obj.__class__
-    try:
-        permissions = permission_map[model]
-    except KeyError:
+    if model not in permission_map:
         return False
 
     if perm not in get_model_perms(model):
         # not a valid permission
         return False
 
-    d = {
-            perm: True,
-    }
+    if _inherited(model):
+        return group_get_objects_any_perms(group, model, [perm]) \
+            .filter(pk=obj.pk).exists()
 
-    return permissions.objects.filter(group=group, obj=obj, **d).exists()
+    return _check(model, group, obj, [perm])
 
 
 def user_has_any_perms(user, obj, perms=None, groups=True):
@@ -638,26 +2847,16 @@ def user_has_any_perms(user, obj, perms=None, groups=True):
     """
     instance = isinstance(obj, (Model,))
     model = obj.__class__ if instance else obj
-    try:
-        permissions = permission_map[model]
-    except KeyError:
+    if model not in permission_map:
         return False
 
-    # create perm clause, or implicit any
-    if perms:
-        # create Q clauses out of perms and OR them all together
-        q = reduce(or_, (Q(**{perm:True}) for perm in perms))
-        base = permissions.objects.filter(q)
-    else:
-        base = permissions.objects
-
-    if groups:
-        base = base.filter(Q(user=user) | Q(group__user=user))
-    else:
-        base = base.filter(user=user)
+    if instance and _inherited(model):
+        return user_get_objects_any_perms(user, model, perms, groups) \
+            .filter(pk=obj.pk).exists()
 
-    # select model or instance level query
-    return base.filter(obj=obj).exists() if instance else base.exists()
+    # select model or instance level query, no perms is an implicit any
+    return _check(model, user, obj if instance else None, perms,
+                  groups=groups)
 
 
 def group_has_any_perms(group, obj, perms=None):
@@ -666,21 +2865,15 @@ def group_has_any_perms(group, obj, perms=None):
     """
     instance = isinstance(obj, (Model,))
     model = obj.__class__ if instance else obj
-    try:
-        permissions = permission_map[model]
-    except KeyError:
+    if model not in permission_map:
         return False
 
-    # create perm clause, or implicit any
-    if perms:
-        # create Q clauses out of perms and OR them all together
-        q = reduce(or_, (Q(**{perm:True}) for perm in perms))
-        base = permissions.objects.filter(q, group=group)
-    else:
-        base = permissions.objects.filter(group=group)
-    
-    # select model or instance level query
-    return base.filter(obj=obj).exists() if instance else base.exists()
+    if instance and _inherited(model):
+        return group_get_objects_any_perms(group, model, perms) \
+            .filter(pk=obj.pk).exists()
+
+    # select model or instance level query, no perms is an implicit any
+    return _check(model, group, obj if instance else None, perms)
 
 
 def user_has_all_perms(user, obj, perms, groups=True):
@@ -688,26 +2881,17 @@ def user_has_all_perms(user, obj, perms, groups=True):
     Check whether the User has *all* permission on the given object.
     """
     instance = isinstance(obj, (Model,))
-    model = obj.__class__ if instance else obj
-    try:
-        permissions = permission_map[model]
-    except KeyError:
+    model = obj.__class__ if instance else obj
+    if model not in permission_map:
         return False
 
-    # create base query requiring all permissions
-    perm_clauses = {}
-    for perm in perms:
-        perm_clauses[perm] = True
-    base = permissions.objects.filter(**perm_clauses)
+    if instance and _inherited(model):
+        return user_get_objects_all_perms(user, model, perms, groups) \
+            .filter(pk=obj.pk).exists()
 
-    # select users or users+groups
-    if groups:
-        base = base.filter(Q(user=user) | Q(group__user=user))
-    else:
-        base = base.filter(user=user)
-        
-    # select model or instance level query
-    return base.filter(obj=obj).exists() if instance else base.exists()
+    # select model or instance level query requiring all permissions
+    return _check(model, user, obj if instance else None, perms, True,
+                  groups)
 
 
 def group_has_all_perms(group, obj, perms):
@@ -725,19 +2909,15 @@ def group_has_all_perms(group, obj, perms):
     
     instance = isinstance(obj, (Model,))
     model = obj.__class__ if instance else obj
-    try:
-        permissions = permission_map[model]
-    except KeyError:
+    if model not in permission_map:
         return False
 
-    # create base query requiring all permissions
-    perm_clauses = {}
-    for perm in perms:
-        perm_clauses[perm] = True
-    base = permissions.objects.filter(group=group, **perm_clauses)
+    if instance and _inherited(model):
+        return group_get_objects_all_perms(group, model, perms) \
+            .filter(pk=obj.pk).exists()
 
-    # select model or instance level query
-    return base.filter(obj=obj).exists() if instance else base.exists()
+    # select model or instance level query requiring all permissions
+    return _check(model, group, obj if instance else None, perms, True)
     
 
 def get_users_any(obj, perms=None, groups=True):
@@ -750,16 +2930,25 @@ def get_users_any(obj, perms=None, groups=True):
     """
     model = obj.__class__
     permissions = permission_map[model]
-
-    perm_table = "%s_uperms__%%s" % model.__name__
-    obj_table = "%s_uperms__obj" % model.__name__
+    names = lookup_names[model]
+
+    if groups and model in effective_map:
+        # effective permissions have one row per user, no distinct required
+        perm_table = names['eperms']
+        q = Q(**{perm_table + 'obj': obj})
+        if perms:
+            q &= _perm_clause(model, perms, perm_table)
+        return User.objects.filter(q)
+
+    perm_table = names['uperms']
+    obj_table = perm_table + 'obj'
     d = {
             obj_table: obj,
     }
 
     if perms:
         # create Q clauses out of perms and OR them all together
-        q = reduce(or_, (Q(**{perm_table % perm:True}) for perm in perms))
+        q = _perm_clause(model, perms, perm_table)
         
         if groups:
             # handle groups by checking perms for any group users are in.
@@ -769,10 +2958,9 @@ def get_users_any(obj, perms=None, groups=True):
             # together like so:
             #     (obj AND perms) OR (group_obj AND group perms)
             
-            group_perm_table = "groups__%s_gperms__%%s" % model.__name__
-            group_obj_table = "groups__%s_gperms__obj" % model.__name__
-            gperms = reduce(or_, (Q(**{group_perm_table % perm:True}) \
-                                  for perm in perms))
+            group_perm_table = names['groups_gperms']
+            group_obj_table = group_perm_table + 'obj'
+            gperms = _perm_clause(model, perms, group_perm_table)
             group_clause = Q(**{group_obj_table:obj}) & gperms
             return User.objects.filter((Q(**d) & q) | group_clause).distinct()
             
@@ -782,7 +2970,7 @@ def get_users_any(obj, perms=None, groups=True):
         # handle groups with *any* perm by adding a clause that checks for the
         # object via the groups table.  this give inherent group membership
         # check.
-        group_obj_table = "groups__%s_gperms__obj" % model.__name__
+        group_obj_table = names['groups_gperms'] + 'obj'
         group_clause = Q(**{group_obj_table:obj})
         return User.objects.filter(Q(**d) | group_clause).distinct()
     
@@ -799,17 +2987,13 @@ def get_users_all(obj, perms, groups=True):
     """
     model = obj.__class__
     permissions = permission_map[model]
+    names = lookup_names[model]
 
-    perm_table = "%s_uperms__%%s" % model.__name__
-    obj_table = "%s_uperms__obj" % model.__name__
-    d = {
-            obj_table: obj,
-    }
+    perm_table = names['uperms']
+    obj_table = perm_table + 'obj'
 
-    # add all perm clauses to the main clause dictionary.  This will cause them
-    # all to be AND'd together.
-    for perm in perms:
-        d[perm_table % perm] = True
+    # user clause requires the object and all of the perms
+    q = Q(**{obj_table: obj}) & _perm_clause(model, perms, perm_table, True)
     
     if groups:
         # handle groups by checking perms for any group users are in.
@@ -819,14 +3003,13 @@ def get_users_all(obj, perms, groups=True):
         # together like so:
         #     (obj AND perms) OR (group_obj AND group perms)
         
-        group_perm_table = "groups__%s_gperms__%%s" % model.__name__
-        group_obj_table = "groups__%s_gperms__obj" % model.__name__
-        group_clause = {group_obj_table: obj}
-        for perm in perms:
-            group_clause[group_perm_table % perm] = True
-        return User.objects.filter(Q(**d) | Q(**group_clause)).distinct()
+        group_perm_table = names['groups_gperms']
+        group_obj_table = group_perm_table + 'obj'
+        group_clause = Q(**{group_obj_table: obj}) \
+            & _perm_clause(model, perms, group_perm_table, True)
+        return User.objects.filter(q | group_clause).distinct()
 
-    return User.objects.filter(**d).distinct()
+    return User.objects.filter(q).distinct()
 
 
 def get_users(obj, groups=True):
@@ -848,15 +3031,15 @@ def get_groups_any(obj, perms=None):
     model = obj.__class__
     permissions = permission_map[model]
 
-    perm_table = "%s_gperms__%%s" % model.__name__
-    obj_table = "%s_gperms__obj" % model.__name__
+    perm_table = lookup_names[model]['gperms']
+    obj_table = perm_table + 'obj'
     d = {
             obj_table: obj,
     }
 
     if perms:
         # create Q clauses out of perms and OR them all together
-        q = reduce(or_, (Q(**{perm_table % perm:True}) for perm in perms))
+        q = _perm_clause(model, perms, perm_table)
         return Group.objects.filter(q, **d).distinct()
     
     return Group.objects.filter(**d).distinct()
@@ -873,18 +3056,12 @@ def get_groups_all(obj, perms):
     model = obj.__class__
     permissions = permission_map[model]
 
-    perm_table = "%s_gperms__%%s" % model.__name__
-    obj_table = "%s_gperms__obj" % model.__name__
-    d = {
-            obj_table: obj,
-    }
+    perm_table = lookup_names[model]['gperms']
+    obj_table = perm_table + 'obj'
 
-    # add all perm clauses to the main clause dictionary.  This will cause them
-    # all to be AND'd together.
-    for perm in perms:
-        d[perm_table % perm] = True
-    
-    return Group.objects.filter(**d).distinct()
+    # require the object and all of the perms
+    q = _perm_clause(model, perms, perm_table, True)
+    return Group.objects.filter(q, **{obj_table: obj}).distinct()
 
 
 def get_groups(obj):
@@ -895,6 +3072,250 @@ def get_groups(obj):
     return get_groups_any(obj)
 
 
+def count_users_any(obj, perms=None, groups=True):
+    """
+    Count the Users that have any of the permissions on the given object,
+    without loading or joining the Users.
+
+    @param perms - perms to check, or None if match *any* perms
+    @param groups - include users with permissions via groups
+    """
+    return count_users_many([obj], perms, groups=groups)[obj]
+
+
+def count_users_all(obj, perms, groups=True):
+    """
+    Count the Users that have all of the permissions on the given object.
+
+    @param perms - perms to check
+    @param groups - include users with permissions via groups
+    """
+    return count_users_many([obj], perms, True, groups)[obj]
+
+
+def count_groups_any(obj, perms=None):
+    """
+    Count the Groups that have any of the permissions on the given object.
+
+    @param perms - perms to check, or None if match *any* perms
+    """
+    return count_groups_many([obj], perms)[obj]
+
+
+def count_groups_all(obj, perms):
+    """
+    Count the Groups that have all of the permissions on the given object.
+
+    @param perms - perms to check
+    """
+    return count_groups_many([obj], perms, True)[obj]
+
+
+def count_users_many(objects, perms=None, all=False, groups=True):
+    """
+    Count the Users that have permissions on each of many objects, with one
+    grouped query per model and batch of objects.  Users are counted the same
+    way get_users_any() and get_users_all() select them.
+
+    @param objects - list of objects, they may be instances of several models
+    @param perms - perms to check, or None if match *any* perms
+    @param all - count users having all of the perms instead of any of them
+    @param groups - include users with permissions via groups
+    @return dict mapping each object to its number of Users
+    """
+    return _count_many(objects, perms, all, groups and 'users' or 'user')
+
+
+def count_groups_many(objects, perms=None, all=False):
+    """
+    Count the Groups that have permissions on each of many objects, with one
+    grouped query per model and batch of objects.
+
+    @param objects - list of objects, they may be instances of several models
+    @param perms - perms to check, or None if match *any* perms
+    @param all - count groups having all of the perms instead of any of them
+    @return dict mapping each object to its number of Groups
+    """
+    return _count_many(objects, perms, all, 'group')
+
+
+def _count_many(objects, perms, all, principal):
+    """
+    Shared implementation of count_users_many() and count_groups_many()
+
+    @param principal - 'user', 'users' for users and the members of groups,
+    or 'group'
+    """
+    by_model = {}
+    for obj in objects:
+        by_model.setdefault(obj.__class__, []).append(obj)
+
+    counts = {}
+    for model, model_objects in by_model.items():
+        if principal == 'users' and model in effective_map and not all:
+            # effective permissions have one row per user
+            kind, size = 'effective', BULK_BATCH_SIZE
+        elif principal == 'users':
+            # the object ids are used by both parts of a UNION
+            kind, size = principal, BULK_BATCH_SIZE / 2
+        else:
+            kind, size = principal, BULK_BATCH_SIZE
+
+        model_counts = {}
+        cursor = db.connection.cursor()
+        for i in xrange(0, len(model_objects), size):
+            ids = [obj.pk for obj in model_objects[i:i + size]]
+            sql, params = _count_sql(model, perms, all, kind, len(ids))
+            if kind == 'users':
+                params = ids + params + ids + params
+            else:
+                params = ids + params
+            cursor.execute(sql, params)
+            model_counts.update(cursor.fetchall())
+        for obj in model_objects:
+            counts[obj] = model_counts.get(obj.pk, 0)
+    return counts
+
+
+def _count_sql(model, perms, all, principal, count):
+    """
+    Build the SQL counting the principals with permissions on objects,
+    grouped by object.  The SQL takes the ids of the objects followed by the
+    perm parameters, twice for 'users'.
+
+    @param principal - 'user', 'effective', 'users' or 'group'
+    @param count - number of object ids
+    @return tuple of the SQL and the parameters of the perms
+    """
+    qn = db.connection.ops.quote_name
+    if principal == 'effective':
+        permissions = effective_map[model]
+    else:
+        permissions = permission_map[model]
+    table = qn(permissions._meta.db_table)
+    column = lambda name: '%s.%s' % (table,
+        qn(permissions._meta.get_field(name).column))
+    perm_sql, perm_params = _perm_sql(model, perms, all, table)
+
+    def select(select, join='', principal=None):
+        where = ['%s IN (%s)' % (column('obj'), ', '.join(['%s'] * count))]
+        if principal:
+            where.append('%s IS NOT NULL' % column(principal))
+        if perm_sql:
+            where.append(perm_sql)
+        return 'SELECT %s FROM %s%s WHERE %s' % (select, table, join,
+                                                ' AND '.join(where))
+
+    obj = column('obj')
+    if principal == 'effective':
+        sql = select('%s, COUNT(*)' % obj) + ' GROUP BY %s' % obj
+    elif principal in ('user', 'group'):
+        # each principal has one row per object
+        sql = select('%s, COUNT(*)' % obj, principal=principal) \
+            + ' GROUP BY %s' % obj
+    else:
+        # users with perms of their own and members of groups with perms,
+        # UNION removes users counted twice
+        through = User.groups.through
+        members = qn(through._meta.db_table)
+        join = ' INNER JOIN %s ON %s.%s = %s' % (members, members,
+            qn(through._meta.get_field('group').column), column('group'))
+        sql = 'SELECT obj_id, COUNT(*) FROM (%s UNION %s) counted ' \
+              'GROUP BY obj_id' % (
+            select('%s AS obj_id, %s AS user_id' % (obj, column('user')),
+                   principal='user'),
+            select('%s AS obj_id, %s.%s AS user_id' % (obj, members,
+                       qn(through._meta.get_field('user').column)), join))
+    return sql, perm_params
+
+
+def user_count_objects_any_perms(user, model, perms=None, groups=True):
+    """
+    Count the objects for which the User has any of the requested
+    permissions, with a single COUNT on the permission table.
+
+    @param user: user who must have permissions
+    @param model: model of the objects
+    @param perms: list of perms to match
+    @param groups: include perms the user has from membership in Groups
+    """
+    if _inherited(model):
+        # perms inherited from ancestors are not stored with the objects
+        return user_get_objects_any_perms(user, model, perms, groups).count()
+    if perms:
+        model_perms = get_model_perms(model)
+        perms = [perm for perm in perms if perm in model_perms]
+        if not perms:
+            return 0
+    return _count_objects(model, user, perms, False, groups)
+
+
+def user_count_objects_all_perms(user, model, perms, groups=True):
+    """
+    Count the objects for which the User has all of the requested
+    permissions, with a single COUNT on the permission table.
+
+    @param user: user who must have permissions
+    @param model: model of the objects
+    @param perms: list of perms to match
+    @param groups: include perms the user has from membership in Groups
+    """
+    if _inherited(model):
+        return user_get_objects_all_perms(user, model, perms, groups).count()
+    return _count_objects(model, user, perms, True, groups)
+
+
+def group_count_objects_any_perms(group, model, perms=None):
+    """
+    Count the objects for which the Group has any of the requested
+    permissions, with a single COUNT on the permission table.
+
+    @param group: group who must have permissions
+    @param model: model of the objects
+    @param perms: list of perms to match
+    """
+    if _inherited(model):
+        return group_get_objects_any_perms(group, model, perms).count()
+    return _count_objects(model, group, perms, False)
+
+
+def group_count_objects_all_perms(group, model, perms):
+    """
+    Count the objects for which the Group has all of the requested
+    permissions, with a single COUNT on the permission table.
+
+    @param group: group who must have permissions
+    @param model: model of the objects
+    @param perms: list of perms to match
+    """
+    if _inherited(model):
+        return group_get_objects_all_perms(group, model, perms).count()
+    return _count_objects(model, group, perms, True)
+
+
+def _count_objects(model, principal, perms, all, groups=True):
+    """
+    Count the objects a User or Group has permissions on.  Rows of a single
+    User or Group are unique per object, only rows of a User and their
+    Groups must be counted distinct.
+    """
+    if isinstance(principal, Group):
+        kind, params = 'group', [principal.pk]
+    elif groups and model in effective_map and not all:
+        kind, params = 'effective', [principal.pk]
+    elif groups:
+        kind = 'groups'
+        params = [principal.pk] + sorted(get_user_group_ids(principal))
+    else:
+        kind, params = 'user', [principal.pk]
+
+    sql, perm_params = _check_sql(model, perms, kind, False, all,
+                                  len(params) - 1, True)
+    cursor = db.connection.cursor()
+    cursor.execute(sql, params + perm_params)
+    return cursor.fetchone()[0]
+
+
 def perms_on_any(user, model, perms, groups=True):
     """
     Determine whether the user has any of the listed permissions on any instances of
@@ -919,7 +3340,125 @@ def filter_on_perms(user, model, perms, groups=True):
     return user_get_objects_any_perms(user, model, perms, groups)
 
 
-def user_get_objects_any_perms(user, model, perms=None, groups=True, **related):
+def _get_objects(model, table, fields, principal, perms, all, related,
+                 strategy):
+    """
+    Build the queryset returned by the *_get_objects_*_perms functions.
+
+    Strategies:
+        join - filter through the permission table and make the results
+               distinct.  This is the default.
+        in - match pk IN (SELECT obj_id ...), one subquery per field.
+        exists - match correlated EXISTS (SELECT ...) subqueries, one per
+                 field.
+    Both subquery strategies return each object once without DISTINCT, so the
+    queryset can be ordered by any field.
+
+    @param table - name of the relation to the permission table, "operms" or
+    "eperms"
+    @param fields - fields of the permission table to match with principal,
+    matching any of them is enough, e.g. ['user', 'group__user']
+    @param principal - User or Group who must have permissions
+    @param perms - list of perms to match, or None to match any perm
+    @param all - rows must have all of the perms instead of any of them
+    @param related - list of clauses on related models.  They are combined
+    with the base clause using OR, or AND when all is set
+    @param strategy - one of QUERY_STRATEGIES
+    """
+    if strategy not in QUERY_STRATEGIES:
+        raise ValueError("Unknown query strategy: %s" % strategy)
+
+    # the relation to the permission table exists once the permission model
+    # is built
+    permission_map[model]
+
+    def clauses(prefix):
+        clauses = []
+        for field in fields:
+            if field == 'group__user' and not prefix:
+                # Subqueries match the Group ids of the user instead of joining
+                # memberships.  Joining auth_group would capture the
+                # correlation of Group objects in EXISTS subqueries.
+                ids = get_user_group_ids(principal)
+                if not ids:
+                    continue
+                q = Q(group__in=sorted(ids))
+            else:
+                q = Q(**{prefix + field: principal})
+            if perms is not None:
+                q &= _perm_clause(model, perms, prefix, all)
+            clauses.append(q)
+        return clauses
+
+    def combine(q, clause):
+        return q & clause if all else q | clause
+
+    if strategy == 'join':
+        q = reduce(or_, clauses(table + '__'))
+        for clause in related:
+            q = combine(q, clause)
+        return model.objects.filter(q).distinct()
+
+    if table == 'eperms':
+        permissions = effective_map[model]
+    else:
+        permissions = permission_map[model]
+
+    if strategy == 'in':
+        # separate subqueries act as a UNION of the objects of each field
+        q = reduce(or_, [Q(pk__in=permissions.objects.filter(clause) \
+                                      .values('obj'))
+                         for clause in clauses('')])
+        for clause in related:
+            q = combine(q, Q(pk__in=model.objects.filter(clause).values('pk')))
+        return model.objects.filter(q)
+
+    # exists, the orm can't express correlated subqueries so they are added
+    # as extra where clauses
+    qn = db.connection.ops.quote_name
+    outer = '%s.%s' % (qn(model._meta.db_table), qn(model._meta.pk.column))
+    correlation = '%s.%s = %s' % (qn(permissions._meta.db_table),
+        qn(permissions._meta.get_field('obj').column), outer)
+
+    where, params = [], []
+    for clause in clauses(''):
+        sql, sql_params = _subquery_sql(permissions.objects.filter(clause) \
+                                        .extra(where=[correlation]))
+        where.append('EXISTS (%s)' % sql)
+        params.extend(sql_params)
+    where = ' OR '.join(where)
+
+    for clause in related:
+        sql, sql_params = _subquery_sql(model.objects.filter(clause))
+        where = '(%s) %s %s IN (%s)' % (where, 'AND' if all else 'OR', outer,
+                                        sql)
+        params.extend(sql_params)
+    return model.objects.extra(where=['(%s)' % where], params=params)
+
+
+def _get_objects_inherited_all(model, perms, related, get_any):
+    """
+    Build the queryset of the *_get_objects_all_perms functions for a Model
+    that inherits permissions: objects matching the related clauses where
+    each perm is granted on the object or on one of its ancestors.
+
+    @param get_any - function returning a queryset of the objects a single
+    perm is granted on, including inherited perms
+    """
+    q = [Q(pk__in=get_any(perm).values('pk')) for perm in perms]
+    return model.objects.filter(reduce(and_, q + related))
+
+
+def _subquery_sql(query):
+    """
+    Return the sql and params of a queryset selecting only primary keys
+    """
+    query = query.values('pk').query
+    return query.get_compiler(connection=db.connection).as_sql()
+
+
+def user_get_objects_any_perms(user, model, perms=None, groups=True,
+                               strategy='join', **related):
     """
     Make a filtered QuerySet of objects for which the User has any of the
     requested permissions, optionally including permissions inherited from
@@ -929,55 +3468,62 @@ def user_get_objects_any_perms(user, model, perms=None, groups=True, **related):
     @param model: model on which to filter
     @param perms: list of perms to match
     @param groups: include perms the user has from membership in Groups
+    @param strategy: how the permission table is queried, 'join', 'in' or
+    'exists'.  See _get_objects()
     @param related: kwargs for related models.  Each kwarg name should be a
     valid query argument, you may follow as many tables as you like and perms
     are optional  E.g. foo__bar=['xoo'], foo=None
     @return a queryset of matching objects
     """
     
-    q = Q(operms__user=user)
+    if groups and model in effective_map:
+        # effective permissions already include groups
+        table, fields = 'eperms', ['user']
+    else:
+        table, fields = 'operms', ['user']
 
-    # optionally add groups
-    if groups:
-        q |= Q(operms__group__user=user)
+        # optionally add groups
+        if groups:
+            fields.append('group__user')
     
     # optionally add specific perms
     if perms:
-        # OR all user permission clauses together
         model_perms = get_model_perms(model)
-        perm_clause = reduce(or_, (Q(**{"operms__%s" % perm: True}) \
-                                   for perm in perms if perm in model_perms))
-        q &= perm_clause
+        perms = [perm for perm in perms if perm in model_perms]
+    else:
+        perms = None
+
+    if _pending:
+        _build_related(model, related)
 
     # related fields are built as sub-clauses for each related field.  To follow
     # the relation we must add a clause that follows the relationship path to
     # the operms table for that model, and optionally include perms.
-    if related:
+    clauses = []
+    for field in related:
+        # build user clause that follows relationship through operms to user
+        clause = Q(**{'%s__operms__user'%field:user})
+        related_perms = related[field]
         
-        for field in related:
-            # build user clause that follows relationship through operms to user
-            clause = Q(**{'%s__operms__user'%field:user})
-            perms = related[field]
-            
-            # optionally include groups
-            if groups:
-                clause |= Q(**{'%s__operms__group__user'%field:user})
-            
-            # optionally include specific perms.
-            if perms:
-                perm_field = '%s__operms__%%s' % field
-                perm_clause = reduce(or_, (Q(**{perm_field % perm: True}) \
-                                                for perm in perms))
-                clause &= perm_clause
-            
-            #add finished query
-            q |= clause
+        # optionally include groups
+        if groups:
+            clause |= Q(**{'%s__operms__group__user'%field:user})
+        
+        # optionally include specific perms.
+        if related_perms:
+            clause &= _perm_clause(_get_related_model(model, field),
+                                   related_perms, '%s__operms__' % field)
+        
+        clauses.append(clause)
 
-    # return objects query filtered by the intricate Q statement
-    return model.objects.filter(q).distinct()
+    clauses.extend(_inherited_clauses(model, perms, user=user, groups=groups,
+                                      exclude=related))
+    return _get_objects(model, table, fields, user, perms, False, clauses,
+                        strategy)
 
 
-def group_get_objects_any_perms(group, model, perms=None, **related):
+def group_get_objects_any_perms(group, model, perms=None, strategy='join',
+                                **related):
     """
     Make a filtered QuerySet of objects for which the Group has any of the 
     requested permissions.
@@ -985,43 +3531,44 @@ def group_get_objects_any_perms(group, model, perms=None, **related):
     @param group: group who must have permissions
     @param model: model on which to filter
     @param perms: list of perms to match
-    @param groups: include perms the user has from membership in Groups
+    @param strategy: how the permission table is queried, 'join', 'in' or
+    'exists'.  See _get_objects()
     @return a queryset of matching objects
     """
 
-    # base clause matches group
-    q = Q(operms__group=group)
-
     # optionally add permissions
     if perms:
-        # permissions specified, OR all user permission clauses together
         model_perms = get_model_perms(model)
-        perm_clause = reduce(or_, (Q(**{"operms__%s" % perm: True}) \
-                                   for perm in perms if perm in model_perms))
-        q &= perm_clause
+        perms = [perm for perm in perms if perm in model_perms]
+    else:
+        perms = None
     
+    if _pending:
+        _build_related(model, related)
+
     # related fields are built as sub-clauses for each related field.  To follow
     # the relation we must add a clause that follows the relationship path to
     # the operms table for that model, and optionally include perms.
-    if related:
-        for field, perms in related.items():
-            # build group clause that follows relationship
-            clause = Q(**{'%s__operms__group'%field:group})
-            
-            # optionally include specific perms.
-            if perms:
-                perm_field = '%s__operms__%%s' % field
-                perm_clause = reduce(or_, (Q(**{perm_field % perm: True}) \
-                                                for perm in perms))
-                clause &= perm_clause
-            
-            #add finished query
-            q |= clause
-    
-    return model.objects.filter(q).distinct()
+    clauses = []
+    for field, related_perms in related.items():
+        # build group clause that follows relationship
+        clause = Q(**{'%s__operms__group'%field:group})
+        
+        # optionally include specific perms.
+        if related_perms:
+            clause &= _perm_clause(_get_related_model(model, field),
+                                   related_perms, '%s__operms__' % field)
+        
+        clauses.append(clause)
+
+    clauses.extend(_inherited_clauses(model, perms, group=group,
+                                      exclude=related))
+    return _get_objects(model, 'operms', ['group'], group, perms, False,
+                        clauses, strategy)
 
 
-def user_get_objects_all_perms(user, model, perms, groups=True, **related):
+def user_get_objects_all_perms(user, model, perms, groups=True,
+                               strategy='join', **related):
     """
     Make a filtered QuerySet of objects for which the User has all requested
     permissions, optionally including permissions inherited from Groups.
@@ -1030,51 +3577,49 @@ def user_get_objects_all_perms(user, model, perms, groups=True, **related):
     @param model: model on which to filter
     @param perms: list of perms to match
     @param groups: include perms the user has from membership in Groups
+    @param strategy: how the permission table is queried, 'join', 'in' or
+    'exists'.  See _get_objects()
     @return a queryset of matching objects
     """
     
-    # create kwargs including all perms that must be matched
-    perm_clause = {}
-    for perm in perms:
-        perm_clause['operms__%s' % perm] = True
-    
     if groups:
-        # must match either a user or group clause + one of the perm clauses
-        user_clause = Q(operms__group__user=user) | Q(operms__user=user)
-        q = user_clause & Q(**perm_clause)
-    
+        # must match either a user or group clause + all of the perm clauses
+        table, fields = 'operms', ['user', 'group__user']
     else:
-        # must match user clause + all of the perm clauses
-        q = Q(operms__user=user, **perm_clause)
+        table, fields = 'operms', ['user']
+
+    if _pending:
+        _build_related(model, related)
 
     # related fields are built as sub-clauses for each related field.  To follow
     # the relation we must add a clause that follows the relationship path to
     # the operms table for that model, and optionally include perms.
-    if related:
+    clauses = []
+    for field in related:
+        # build user clause that follows relationship through operms to user
+        clause = Q(**{'%s__operms__user'%field:user})
         
-        for field in related:
-            # build user clause that follows relationship through operms to user
-            clause = Q(**{'%s__operms__user'%field:user})
-            perms = related[field]
-            
-            # optionally include groups
-            if groups:
-                clause |= Q(**{'%s__operms__group__user'%field:user})
-            
-            # create kwargs including all perms that must be matched
-            perm_clause = {}
-            for perm in perms:
-                perm_clause['operms__%s' % perm] = True
-            clause &= Q(**perm_clause)
-            
-            #add finished query
-            q &= clause
+        # optionally include groups
+        if groups:
+            clause |= Q(**{'%s__operms__group__user'%field:user})
+        
+        # create clause including all perms that must be matched
+        clause &= _perm_clause(_get_related_model(model, field),
+                               related[field], '%s__operms__' % field, True)
+        
+        clauses.append(clause)
 
-    # return objects query filtered by the intricate Q statement
-    return model.objects.filter(q).distinct()
+    if _inherited(model):
+        # each perm may be granted on the object or any of its ancestors
+        return _get_objects_inherited_all(model, perms, clauses,
+            lambda perm: user_get_objects_any_perms(user, model, [perm],
+                                                    groups, strategy))
+    return _get_objects(model, table, fields, user, perms, True, clauses,
+                        strategy)
 
 
-def group_get_objects_all_perms(group, model, perms, **related):
+def group_get_objects_all_perms(group, model, perms, strategy='join',
+                                **related):
     """
     Make a filtered QuerySet of objects for which the User has all requested
     permissions, optionally including permissions inherited from Groups.
@@ -1082,34 +3627,32 @@ def group_get_objects_all_perms(group, model, perms, **related):
     @param group: group who must have permissions
     @param model: model on which to filter
     @param perms: list of perms to match
-    @param groups: include perms the user has from membership in Groups
+    @param strategy: how the permission table is queried, 'join', 'in' or
+    'exists'.  See _get_objects()
     @return a queryset of matching objects
     """
 
-    # base clause matches group
-    q = Q(operms__group=group)
+    if _pending:
+        _build_related(model, related)
 
-    # create kwargs including all perms that must be matched
-    perm_clause = {}
-    for perm in perms:
-        perm_clause['operms__%s' % perm] = True
-    q &= Q(**perm_clause)
-    
     # related fields are built as sub-clauses for each related field.  To follow
     # the relation we must add a clause that follows the relationship path to
     # the operms table for that model, and optionally include perms.
-    if related:
-        for field, perms in related.items():
-            # build group clause that follows relationship
-            q &= Q(**{'%s__operms__group'%field:group})
-            
-            # create kwargs including all perms that must be matched
-            perm_clause = {}
-            for perm in perms:
-                perm_clause['operms__%s' % perm] = True
-            q &= Q(**perm_clause)
-    
-    return model.objects.filter(q).distinct()
+    clauses = []
+    for field, related_perms in related.items():
+        # build group clause that follows relationship, including all perms
+        # that must be matched
+        clauses.append(Q(**{'%s__operms__group'%field:group}) \
+                       & _perm_clause(_get_related_model(model, field),
+                                      related_perms, '%s__operms__' % field,
+                                      True))
+
+    if _inherited(model):
+        return _get_objects_inherited_all(model, perms, clauses,
+            lambda perm: group_get_objects_any_perms(group, model, [perm],
+                                                     strategy))
+    return _get_objects(model, 'operms', ['group'], group, perms, True,
+                        clauses, strategy)
 
 
 def user_get_all_objects_any_perms(user, groups=True):
@@ -1131,6 +3674,102 @@ def user_get_all_objects_any_perms(user, groups=True):
     return perms
 
 
+def _keyset_pages(query, field, size, after=None, distinct=False):
+    """
+    Generate the values of a field of a queryset in ascending pages.  Each
+    page continues after the last value of the previous one (keyset
+    pagination), so later pages are as cheap as the first.
+
+    @param after - start after this value
+    @param distinct - remove duplicate values
+    """
+    values = query.order_by(field).values_list(field, flat=True)
+    if distinct:
+        values = values.distinct()
+    while True:
+        if after is not None:
+            page = list(values.filter(**{'%s__gt' % field:after})[:size])
+        else:
+            page = list(values[:size])
+        if page:
+            yield page
+        if len(page) < size:
+            return
+        after = page[-1]
+
+
+def _obj_field(model):
+    """
+    Return the field of the permission tables used for keyset pagination.
+    Ordering by the foreign key follows the default ordering of the model, so
+    models with one are ordered by the primary key through a join.
+    """
+    return 'obj__pk' if model._meta.ordering else 'obj'
+
+
+def _iter_models(models):
+    """
+    Return the models to iterate, all registered models by default, in a
+    stable order.
+    """
+    if models is None:
+        models = permission_map.keys()
+    return sorted(models, key=lambda model: (model._meta.app_label,
+                                             model.__name__))
+
+
+def user_iter_objects_any_perms(user, groups=True, models=None,
+                                size=BULK_BATCH_SIZE, after=None):
+    """
+    Generate the primary keys of all objects the User has any permission on,
+    a page at a time.  Pages are read from the permission tables with keyset
+    pagination, only one page is held in memory.
+
+    @param user - user to check perms for
+    @param groups - include permissions through groups
+    @param models - only these models, default all registered models
+    @param size - number of primary keys per page
+    @param after - resume the first model after this primary key
+    @return generator of (model, list of primary keys) in ascending order
+    """
+    for model in _iter_models(models):
+        if _inherited(model):
+            query = user_get_objects_any_perms(user, model, groups=groups,
+                                               strategy='in')
+            pages = _keyset_pages(query, 'pk', size, after)
+        else:
+            distinct = groups and model not in effective_map
+            pages = _keyset_pages(_user_perms_query(user, model, groups),
+                                  _obj_field(model), size, after, distinct)
+        for page in pages:
+            yield model, page
+        after = None
+
+
+def group_iter_objects_any_perms(group, models=None, size=BULK_BATCH_SIZE,
+                                 after=None):
+    """
+    Generate the primary keys of all objects the Group has any permission on,
+    a page at a time.  See user_iter_objects_any_perms()
+
+    @param group - group to check perms for
+    @param models - only these models, default all registered models
+    @param size - number of primary keys per page
+    @param after - resume the first model after this primary key
+    @return generator of (model, list of primary keys) in ascending order
+    """
+    for model in _iter_models(models):
+        if _inherited(model):
+            query = group_get_objects_any_perms(group, model, strategy='in')
+            pages = _keyset_pages(query, 'pk', size, after)
+        else:
+            query = permission_map[model].objects.filter(group=group)
+            pages = _keyset_pages(query, _obj_field(model), size, after)
+        for page in pages:
+            yield model, page
+        after = None
+
+
 def group_get_all_objects_any_perms(group):
     """
     Get all objects from all registered models that the group has any permission
@@ -1164,6 +3803,287 @@ def filter_on_group_perms(group, model, perms):
     return group_get_objects_any_perms(group, model, perms)
 
 
+# instrumentation
+class Collector(object):
+    """
+    Receives a measurement for every call to the permission API.  Subclass
+    this and install it with set_collector() to feed metrics into a
+    monitoring system.
+
+    Only calls made from outside the API are measured: the time and queries
+    of nested calls, e.g. set_user_perms() calling revoke_all(), are counted
+    for the outer call.  Functions returning a QuerySet are measured without
+    evaluating it.
+    """
+
+    count_queries = True
+    """
+    Count SQL queries on the default database.  This uses the debug cursor of
+    the connection for the duration of each call.
+    """
+
+    def record(self, function, model, elapsed, queries):
+        """
+        Called after each API call, also if it raised an exception.
+
+        @param function - name of the API function
+        @param model - registered Model the call was made for, or None if it
+        could not be determined from the arguments
+        @param elapsed - wall time of the call in seconds
+        @param queries - number of SQL queries, or None if not counted
+        """
+        pass
+
+
+class StatsCollector(Collector):
+    """
+    Collector that keeps totals in memory.  stats maps (function, model) to a
+    dict of calls, time (seconds) and queries.
+    """
+
+    def __init__(self):
+        self.stats = {}
+
+    def record(self, function, model, elapsed, queries):
+        try:
+            stat = self.stats[(function, model)]
+        except KeyError:
+            stat = self.stats[(function, model)] = \
+                {'calls':0, 'time':0.0, 'queries':0}
+        stat['calls'] += 1
+        stat['time'] += elapsed
+        if queries:
+            stat['queries'] += queries
+
+    def by_function(self):
+        """
+        @return stats summed over models, keyed by function name
+        """
+        return self._sum(0)
+
+    def by_model(self):
+        """
+        @return stats summed over functions, keyed by Model
+        """
+        return self._sum(1)
+
+    def _sum(self, index):
+        totals = {}
+        for key, stat in self.stats.items():
+            total = totals.setdefault(key[index],
+                                      {'calls':0, 'time':0.0, 'queries':0})
+            for name in total:
+                total[name] += stat[name]
+        return totals
+
+    def reset(self):
+        self.stats = {}
+
+
+_collector = None
+_instrument_state = local()
+
+
+def set_collector(collector):
+    """
+    Install a Collector for all permission API calls.  Passing None removes
+    it, uninstrumented calls only check whether a collector is set.
+
+    @param collector - Collector instance or None
+    @return the previously installed collector
+    """
+    global _collector
+    previous, _collector = _collector, collector
+    return previous
+
+
+def get_collector():
+    """
+    @return the installed Collector, or None
+    """
+    return _collector
+
+
+_MODEL_ARGS = ('obj', 'klass', 'model', 'objects')
+"""
+Argument names the model of an instrumented call is taken from.
+"""
+
+
+def _call_model(index, args, kwargs, name):
+    """
+    Find the registered Model an API call is made for.
+    """
+    if index < len(args):
+        value = args[index]
+    else:
+        value = kwargs.get(name)
+    if name == 'objects':
+        if hasattr(value, 'model'):
+            return value.model
+        if isinstance(value, (list, tuple)) and value:
+            value = value[0]
+        else:
+            return None
+    if isinstance(value, Model):
+        return value.__class__
+    if isinstance(value, type) and value in permission_map:
+        return value
+    return None
+
+
+def _start_call(collector):
+    """
+    Start measuring a call reported to a Collector.
+
+    @return state passed to _stop_call()
+    """
+    connection = db.connection
+    debug_cursor = query_count = None
+    if collector.count_queries:
+        debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        query_count = len(connection.queries)
+    _instrument_state.active = True
+    return default_timer(), debug_cursor, query_count
+
+
+def _stop_call(state):
+    """
+    Stop measuring a call started with _start_call().
+
+    @return tuple of the elapsed seconds and the number of queries, None if
+    queries are not counted
+    """
+    start, debug_cursor, query_count = state
+    elapsed = default_timer() - start
+    _instrument_state.active = False
+    queries = None
+    if query_count is not None:
+        connection = db.connection
+        queries = len(connection.queries) - query_count
+        connection.use_debug_cursor = debug_cursor
+        if not (settings.DEBUG or debug_cursor):
+            # don't keep the queries logged only for counting
+            del connection.queries[query_count:]
+    return elapsed, queries
+
+
+def _instrument(function, function_name=None):
+    """
+    Wrap a public API function so that calls to it are reported to the
+    installed Collector.  Generator functions run their queries while they
+    are iterated, each step is measured and the call is reported once the
+    generator is exhausted or closed.
+
+    @param function - function or method to wrap
+    @param function_name - name calls are reported under, default the name
+    of the function
+    """
+    arg_names = getargspec(function)[0]
+    for name in _MODEL_ARGS:
+        if name in arg_names:
+            index = arg_names.index(name)
+            break
+    else:
+        name, index = None, None
+    function_name = function_name or function.__name__
+
+    def record(collector, args, kwargs, elapsed, queries):
+        model = None
+        if name is not None:
+            model = _call_model(index, args, kwargs, name)
+        collector.record(function_name, model, elapsed, queries)
+
+    if isgeneratorfunction(function):
+        @wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            collector = _collector
+            generator = function(*args, **kwargs)
+            if collector is None or getattr(_instrument_state, 'active',
+                                            False):
+                for value in generator:
+                    yield value
+                return
+
+            elapsed, queries = 0, None
+            try:
+                while True:
+                    state = _start_call(collector)
+                    try:
+                        value = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        seconds, count = _stop_call(state)
+                        elapsed += seconds
+                        if count is not None:
+                            queries = (queries or 0) + count
+                    yield value
+            finally:
+                generator.close()
+                record(collector, args, kwargs, elapsed, queries)
+        return generator_wrapper
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        collector = _collector
+        if collector is None or getattr(_instrument_state, 'active', False):
+            return function(*args, **kwargs)
+
+        state = _start_call(collector)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed, queries = _stop_call(state)
+            record(collector, args, kwargs, elapsed, queries)
+    return wrapper
+
+
+_INSTRUMENTED = (
+    'grant', 'grant_group', 'set_user_perms', 'set_group_perms',
+    'revoke', 'revoke_group', 'revoke_all', 'revoke_all_group',
+    'bulk_grant', 'bulk_revoke', 'set_perms_matrix',
+    'get_user_perms', 'get_user_perms_many', 'get_user_perms_any',
+    'get_group_perms', 'get_group_perms_any', 'prefetch_perms',
+    'get_object_perms', 'user_has_perm', 'group_has_perm',
+    'user_has_any_perms', 'group_has_any_perms',
+    'user_has_all_perms', 'group_has_all_perms',
+    'get_users_any', 'get_users_all', 'get_users',
+    'get_groups_any', 'get_groups_all', 'get_groups',
+    'count_users_any', 'count_users_all', 'count_users_many',
+    'count_groups_any', 'count_groups_all', 'count_groups_many',
+    'user_count_objects_any_perms', 'group_count_objects_any_perms',
+    'user_count_objects_all_perms', 'group_count_objects_all_perms',
+    'perms_on_any', 'filter_on_perms', 'filter_on_group_perms',
+    'user_get_objects_any_perms', 'group_get_objects_any_perms',
+    'user_get_objects_all_perms', 'group_get_objects_all_perms',
+    'user_get_all_objects_any_perms', 'group_get_all_objects_any_perms',
+    'user_iter_objects_any_perms', 'group_iter_objects_any_perms',
+    'rebuild_effective_perms',
+)
+"""
+Names of the API functions reported to the Collector.
+"""
+
+_INSTRUMENTED_METHODS = (
+    (PermissionLoader, ('has_perm', 'get_perms', 'dispatch')),
+)
+"""
+Classes and names of the API methods reported to the Collector, as
+Class.method
+"""
+
+for _name in _INSTRUMENTED:
+    globals()[_name] = _instrument(globals()[_name])
+for _class, _names in _INSTRUMENTED_METHODS:
+    for _name in _names:
+        setattr(_class, _name, _instrument(
+            getattr(_class, _name).im_func,
+            '%s.%s' % (_class.__name__, _name)))
+del _name, _class, _names
+
+
 # make some methods available as bound methods
 setattr(User, 'grant', grant)
 setattr(User, 'revoke', revoke)
@@ -1173,10 +4093,14 @@ setattr(User, 'has_any_perms', user_has_any_perms)
 setattr(User, 'has_all_perms', user_has_all_perms)
 setattr(User, 'get_perms', get_user_perms)
 setattr(User, 'get_perms_any', get_user_perms_any)
+setattr(User, 'prefetch_perms', prefetch_perms)
 setattr(User, 'set_perms', set_user_perms)
 setattr(User, 'get_objects_any_perms', user_get_objects_any_perms)
 setattr(User, 'get_objects_all_perms', user_get_objects_all_perms)
 setattr(User, 'get_all_objects_any_perms', user_get_all_objects_any_perms)
+setattr(User, 'iter_objects_any_perms', user_iter_objects_any_perms)
+setattr(User, 'count_objects_any_perms', user_count_objects_any_perms)
+setattr(User, 'count_objects_all_perms', user_count_objects_all_perms)
 
 # deprecated
 setattr(User, 'filter_on_perms', filter_on_perms)
@@ -1194,6 +4118,9 @@ setattr(Group, 'set_perms', set_group_perms)
 setattr(Group, 'get_objects_any_perms', group_get_objects_any_perms)
 setattr(Group, 'get_objects_all_perms', group_get_objects_all_perms)
 setattr(Group, 'get_all_objects_any_perms', group_get_all_objects_any_perms)
+setattr(Group, 'iter_objects_any_perms', group_iter_objects_any_perms)
+setattr(Group, 'count_objects_any_perms', group_count_objects_any_perms)
+setattr(Group, 'count_objects_all_perms', group_count_objects_all_perms)
 
 # deprecated
 setattr(Group, 'filter_on_perms', filter_on_group_perms)
@@ -3,6 +3,11 @@ import django.dispatch
 granted = django.dispatch.Signal(providing_args=["perm", "object"])
 revoked = django.dispatch.Signal(providing_args=["perm", "object"])
 
+# sent once for a batch of permission changes, instead of sending granted or
+# revoked for every change.  changes is a list of (grantee, perm, object)
+granted_batch = django.dispatch.Signal(providing_args=["changes"])
+revoked_batch = django.dispatch.Signal(providing_args=["changes"])
+
 
 # signals issues when a user has edited permissions or groups via a view
 # provided by object permissions.  These signals differ from granted and revoked
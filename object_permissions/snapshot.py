@@ -0,0 +1,284 @@
+"""
+Permission snapshots.
+
+Writes the permission tables of registered models to a compact binary file
+and loads them back, e.g. to copy permissions between environments or to
+restore them:
+
+    $ ./manage.py dump_perms perms.snapshot
+    $ ./manage.py load_perms perms.snapshot
+
+A snapshot is a header followed by a section for each model.  Sections store
+the names of the perms of the model and then the permission rows in chunks.
+Each chunk is compressed with zlib and stores its rows column by column:
+flags, user ids, group ids, object keys and a bitmask of the perms set in
+the row.  Bits refer to the perm names of the section, not to columns or bits
+of the permission table, so snapshots can be loaded after perms were added or
+reordered.
+
+Effective permission tables are not written, they are rebuilt when a
+snapshot is loaded.
+"""
+
+import struct
+import zlib
+
+from django import db
+from django.db import transaction
+from django.db.models import AutoField, IntegerField
+
+from object_permissions.registration import BITMASK_FIELD, \
+    BULK_BATCH_SIZE, UnknownPermissionException, effective_map, \
+    get_model_perms, invalidate_cache, params_for_model, permission_map, \
+    rebuild_effective_perms, _bump_versions, _model_version_key
+
+
+MAGIC = 'OPSNAP\x01'
+"""
+Start of every snapshot, the last byte is the version of the format.
+"""
+
+_SECTION, _END = 'M', 'E'
+_USER, _GROUP = 1, 2
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _write_str(out, value):
+    value = value.encode('utf-8')
+    out.write(struct.pack('<H', len(value)))
+    out.write(value)
+
+
+def _read(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise SnapshotError('Snapshot is truncated')
+    return data
+
+
+def _read_str(stream):
+    size, = struct.unpack('<H', _read(stream, 2))
+    return _read(stream, size).decode('utf-8')
+
+
+def _integer_keys(model):
+    return isinstance(model._meta.pk, (AutoField, IntegerField))
+
+
+def _words(perms):
+    """ number of 64 bit words used by the bitmask of a row """
+    return max(1, (len(perms) + 63) / 64)
+
+
+def dump_perms(out, models=None, size=BULK_BATCH_SIZE):
+    """
+    Write the permission tables of registered models to a snapshot.  Rows
+    are read in chunks ordered by primary key, only one chunk is held in
+    memory.
+
+    @param out - file opened for writing in binary mode
+    @param models - models to write, default all registered models
+    @param size - number of rows per chunk
+    @return dict mapping models to the number of rows written
+    """
+    if models is None:
+        models = permission_map.keys()
+    models = sorted(models, key=lambda model: (model._meta.app_label,
+                                               model.__name__))
+    out.write(MAGIC)
+    counts = {}
+    for model in models:
+        counts[model] = _dump_model(out, model, size)
+    out.write(_END)
+    return counts
+
+
+def _dump_model(out, model, size):
+    permissions = permission_map[model]
+    perms = list(get_model_perms(model))
+    params = params_for_model[model]
+    integer_keys = _integer_keys(model)
+    words = _words(perms)
+
+    out.write(_SECTION)
+    _write_str(out, model._meta.app_label)
+    _write_str(out, model.__name__)
+    out.write(struct.pack('<H', len(perms)))
+    for perm in perms:
+        _write_str(out, perm)
+    out.write('i' if integer_keys else 's')
+
+    if params.get('storage') == 'bitmask':
+        fields = [BITMASK_FIELD]
+        bits = [params['bits'][perm] for perm in perms]
+        to_mask = lambda values: sum(1 << i for i, bit in enumerate(bits)
+                                     if values[0] & 1 << bit)
+    else:
+        fields = perms
+        to_mask = lambda values: sum(1 << i for i, value in enumerate(values)
+                                     if value)
+
+    query = permissions.objects.order_by('pk') \
+        .values_list('pk', 'user', 'group', 'obj', *fields)
+    count, last = 0, None
+    while True:
+        rows = query.filter(pk__gt=last) if last is not None else query
+        rows = list(rows[:size])
+        if not rows:
+            break
+        _write_chunk(out, rows, to_mask, integer_keys, words)
+        count += len(rows)
+        last = rows[-1][0]
+    out.write(struct.pack('<I', 0))
+    return count
+
+
+def _write_chunk(out, rows, to_mask, integer_keys, words):
+    n = len(rows)
+    flags = [(_USER if row[1] is not None else 0)
+             | (_GROUP if row[2] is not None else 0) for row in rows]
+    data = [struct.pack('<%dB' % n, *flags),
+            struct.pack('<%dq' % n, *[row[1] or 0 for row in rows]),
+            struct.pack('<%dq' % n, *[row[2] or 0 for row in rows])]
+    if integer_keys:
+        data.append(struct.pack('<%dq' % n, *[row[3] for row in rows]))
+    else:
+        for row in rows:
+            key = unicode(row[3]).encode('utf-8')
+            data.append(struct.pack('<H', len(key)) + key)
+    masks = []
+    for row in rows:
+        mask = to_mask(row[4:])
+        masks.extend((mask >> (64 * word)) & 0xFFFFFFFFFFFFFFFF
+                     for word in xrange(words))
+    data.append(struct.pack('<%dQ' % len(masks), *masks))
+
+    data = zlib.compress(''.join(data))
+    out.write(struct.pack('<II', n, len(data)))
+    out.write(data)
+
+
+def load_perms(stream):
+    """
+    Load a snapshot written by dump_perms().  The rows of every model in the
+    snapshot replace all of its existing permission rows.  Rows are inserted
+    in chunks with executemany() inside a single transaction.  No granted or
+    revoked signals are sent, cached permissions are invalidated and effective
+    permissions are rebuilt.
+
+    @param stream - file opened for reading in binary mode
+    @return dict mapping models to the number of rows loaded
+    """
+    if _read(stream, len(MAGIC)) != MAGIC:
+        raise SnapshotError('Not a permission snapshot')
+
+    counts = {}
+    with transaction.commit_on_success():
+        while True:
+            marker = _read(stream, 1)
+            if marker == _END:
+                break
+            if marker != _SECTION:
+                raise SnapshotError('Snapshot is corrupt')
+            model, count = _load_model(stream)
+            counts[model] = count
+
+    for model in counts:
+        if model in effective_map:
+            rebuild_effective_perms(model)
+    invalidate_cache()
+    _bump_versions([_model_version_key(model) for model in counts])
+    return counts
+
+
+def _get_model(app_label, name):
+    for model in params_for_model:
+        if model._meta.app_label == app_label and model.__name__ == name:
+            return model
+    raise SnapshotError('Model is not registered: %s.%s' % (app_label, name))
+
+
+def _load_model(stream):
+    model = _get_model(_read_str(stream), _read_str(stream))
+    count, = struct.unpack('<H', _read(stream, 2))
+    perms = [_read_str(stream) for i in xrange(count)]
+    integer_keys = _read(stream, 1) == 'i'
+    words = _words(perms)
+
+    model_perms = get_model_perms(model)
+    for perm in perms:
+        if perm not in model_perms:
+            raise UnknownPermissionException(perm)
+
+    permissions = permission_map[model]
+    params = params_for_model[model]
+    qn = db.connection.ops.quote_name
+    column = lambda name: qn(permissions._meta.get_field(name).column)
+    if params.get('storage') == 'bitmask':
+        fields = [BITMASK_FIELD]
+        bits = [params['bits'][perm] for perm in perms]
+        to_values = lambda mask: [sum(1 << bit for i, bit in enumerate(bits)
+                                      if mask & 1 << i)]
+    else:
+        fields = list(model_perms)
+        index = dict((perm, i) for i, perm in enumerate(perms))
+        # perm columns are integers, postgresql rejects booleans for them
+        to_values = lambda mask: [int(perm in index
+                                      and mask & 1 << index[perm] != 0)
+                                  for perm in fields]
+
+    table = qn(permissions._meta.db_table)
+    columns = [column('user'), column('group'), column('obj')] \
+        + [column(field) for field in fields]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (table, ', '.join(columns),
+                                               ', '.join(['%s'] * len(columns)))
+    cursor = db.connection.cursor()
+    cursor.execute('DELETE FROM %s' % table)
+    transaction.set_dirty()
+
+    total = 0
+    while True:
+        n, = struct.unpack('<I', _read(stream, 4))
+        if not n:
+            break
+        size, = struct.unpack('<I', _read(stream, 4))
+        rows = _read_chunk(zlib.decompress(_read(stream, size)), n,
+                           integer_keys, words)
+        cursor.executemany(sql, [
+            [user, group, obj] + to_values(mask)
+            for user, group, obj, mask in rows])
+        total += n
+    return model, total
+
+
+def _read_chunk(data, n, integer_keys, words):
+    offset = 0
+    def unpack(format, size):
+        values = struct.unpack_from(format, data, offset)
+        return values, offset + size
+
+    flags, offset = unpack('<%dB' % n, n)
+    users, offset = unpack('<%dq' % n, 8 * n)
+    groups, offset = unpack('<%dq' % n, 8 * n)
+    if integer_keys:
+        keys, offset = unpack('<%dq' % n, 8 * n)
+    else:
+        keys = []
+        for i in xrange(n):
+            length, = struct.unpack_from('<H', data, offset)
+            keys.append(data[offset + 2:offset + 2 + length].decode('utf-8'))
+            offset += 2 + length
+    masks, offset = unpack('<%dQ' % (n * words), 8 * n * words)
+
+    rows = []
+    for i in xrange(n):
+        mask = 0
+        for word in xrange(words):
+            mask |= masks[i * words + word] << (64 * word)
+        rows.append((users[i] if flags[i] & _USER else None,
+                     groups[i] if flags[i] & _GROUP else None,
+                     keys[i], mask))
+    return rows
@@ -1,4 +1,15 @@
 from backend import *
 from permissions import *
 from groups import *
-from signals import *
\ No newline at end of file
+from signals import *
+from bitmask import *
+from bulk import *
+from effective import *
+from cache import *
+from benchmarks import *
+from instrumentation import *
+from inheritance import *
+from lazy import *
+from loader import *
+from snapshot import *
+from counts import *
\ No newline at end of file
@@ -2,6 +2,7 @@ from django.conf import settings
 from django.contrib.auth.models import User, AnonymousUser, Group
 from django.test import TestCase
 
+from object_permissions import get_perm_cache, get_user_group_ids
 from object_permissions.backend import ObjectPermBackend
 
 global user, anonymous, object_
@@ -11,6 +12,9 @@ class TestBackend(TestCase):
 
     def setUp(self):
         self.tearDown()
+        if get_perm_cache() is not None:
+            # rolled back memberships of earlier tests are still cached
+            get_perm_cache().clear()
         settings.ANONYMOUS_USER_ID = 0
         user = User(id=1, username="tester")
         user.save()
@@ -57,6 +61,17 @@ class TestBackend(TestCase):
         self.assertTrue(user.has_perm("admin", object_))
         self.assertTrue(backend.has_perm(user, "admin", object_))
 
+    def test_has_perm_not_a_model(self):
+        """
+        Verify that has_perm() is False for objects that are not registered
+        Models, e.g. when the perm and object arguments are swapped.
+        """
+        backend = ObjectPermBackend()
+        self.assertFalse(backend.has_perm(user, object_, "admin"))
+        self.assertFalse(user.has_perm(object_, "admin"))
+        self.assertFalse(backend.has_perm(user, "admin", User))
+        self.assertEqual([], backend.get_all_permissions(user, "admin"))
+
     def test_get_all_permissions(self):
         """
         Verify that get_all_permissions() works as desired.
@@ -70,3 +85,52 @@ class TestBackend(TestCase):
         self.assertEqual(permissions, list(user.get_all_permissions(object_)))
         self.assertEqual(permissions, backend.get_all_permissions(user,
             object_))
+
+    def test_has_perm_cached(self):
+        """
+        Verify that permissions are loaded once per object and that the cache
+        is invalidated when permissions change.
+        """
+        backend = ObjectPermBackend()
+        user = User.objects.get(pk=1)
+        get_user_group_ids(user)
+
+        def check():
+            self.assertTrue(backend.has_perm(user, "admin", object_))
+            self.assertFalse(backend.has_perm(user, "DoesNotExist", object_))
+            self.assertEqual(["admin"],
+                             backend.get_all_permissions(user, object_))
+        self.assertNumQueries(1, check)
+        self.assertNumQueries(0, check)
+
+        # revoking permissions must be visible in the same request
+        user.revoke('admin', object_)
+        self.assertFalse(backend.has_perm(user, "admin", object_))
+
+        # group permissions and membership changes also invalidate the cache
+        group = Group.objects.create(name='cached')
+        group.grant('admin', object_)
+        self.assertFalse(backend.has_perm(user, "admin", object_))
+        user.groups.add(group)
+        self.assertTrue(backend.has_perm(user, "admin", object_))
+        group.revoke('admin', object_)
+        self.assertFalse(backend.has_perm(user, "admin", object_))
+
+    def test_get_group_permissions(self):
+        """
+        Verify that get_group_permissions() returns only permissions granted
+        through the user's groups, with a single query.
+        """
+        backend = ObjectPermBackend()
+        self.assertEqual([], backend.get_group_permissions(user, object_))
+
+        group = Group.objects.create(name='admins')
+        group.grant('admin', object_)
+        self.assertEqual([], backend.get_group_permissions(user, object_))
+        user.groups.add(group)
+        get_user_group_ids(user)
+        self.assertNumQueries(1, backend.get_group_permissions, user, object_)
+        self.assertEqual(['admin'], backend.get_group_permissions(user,
+                                                                  object_))
+        self.assertEqual([], backend.get_group_permissions(anonymous, object_))
+        self.assertEqual([], backend.get_group_permissions(user, user))
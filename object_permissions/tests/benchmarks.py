@@ -0,0 +1,35 @@
+from django.contrib.auth.models import User, Group
+from django.test import TestCase
+
+from object_permissions import benchmarks
+from object_permissions.registration import TestModel, TestModelChild
+
+
+class TestBenchmarks(TestCase):
+    """ tests that the benchmark suite runs """
+
+    def tearDown(self):
+        TestModel.objects.all().delete()
+        TestModelChild.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def test_run(self):
+        config = dict(benchmarks.DEFAULTS, users=3, groups=2, objects=4,
+                      user_perms=2, group_perms=2, iterations=2)
+        data = benchmarks.seed(**config)
+        self.assertEqual(3, len(data['users']))
+        self.assertEqual(8, len(data['children']))
+
+        results = benchmarks.run(data, **config)
+        self.assertEqual(set(name for name, f in benchmarks.BENCHMARKS),
+                         set(results))
+        for result in results.values():
+            self.assertEqual(2, result['iterations'])
+            self.assertTrue(result['queries'] >= 1)
+
+        results = benchmarks.run(data, names=['get_user_perms'], **config)
+        self.assertEqual(['get_user_perms'], results.keys())
+        report = benchmarks.report(config, results, 'label')
+        self.assertEqual('label', report['label'])
+        self.assertEqual(results, report['results'])
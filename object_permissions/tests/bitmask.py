@@ -0,0 +1,219 @@
+from django.contrib.auth.models import User, Group
+from django.db import connection
+from django.test import TestCase
+
+from object_permissions import *
+from object_permissions.registration import TestModel, TestModelBitmask, \
+    RegistrationException, UnknownPermissionException, params_for_model, \
+    permission_map, _assign_bits
+
+
+class TestBitmaskStorage(TestCase):
+    """ tests for models registered with bitmask storage """
+
+    def setUp(self):
+        self.tearDown()
+        self.user0 = User.objects.create(id=2, username='tester')
+        self.user1 = User.objects.create(id=3, username='tester2')
+        self.group = Group.objects.create(name='testers')
+        self.group.user_set.add(self.user1)
+        self.parent = TestModel.objects.create(name='parent')
+        self.object0 = TestModelBitmask.objects.create(name='test0',
+                                                       parent=self.parent)
+        self.object1 = TestModelBitmask.objects.create(name='test1')
+
+    def tearDown(self):
+        TestModel.objects.all().delete()
+        TestModelBitmask.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def test_bit_assignment(self):
+        """
+        Verifies:
+            * pinned bits are kept
+            * remaining perms are assigned free bits alphabetically
+            * invalid bits and too many perms are rejected
+        """
+        bits = params_for_model[TestModelBitmask]['bits']
+        self.assertEqual({'Perm3':0, 'Perm1':1, 'Perm2':2, 'Perm4':3}, bits)
+
+        self.assertRaises(RegistrationException, _assign_bits,
+                          {'a':{'bit':1}, 'b':{'bit':1}})
+        self.assertRaises(RegistrationException, _assign_bits,
+                          {'a':{'bit':63}})
+        self.assertRaises(RegistrationException, _assign_bits,
+                          {'bitmask':{}})
+        perms = dict(('perm%s' % i, {}) for i in range(64))
+        self.assertRaises(RegistrationException, _assign_bits, perms)
+
+    def test_grant_revoke(self):
+        """ grant and revoke update the single bitmask column """
+        user0, object0 = self.user0, self.object0
+
+        user0.grant('Perm1', object0)
+        user0.grant('Perm3', object0)
+        row = permission_map[TestModelBitmask].objects.get(user=user0)
+        self.assertEqual(0b11, row.bitmask)
+        self.assertEqual(set(['Perm1', 'Perm3']),
+                         set(user0.get_perms(object0)))
+        self.assertRaises(UnknownPermissionException, user0.grant, 'Foo',
+                          object0)
+
+        user0.revoke('Perm1', object0)
+        self.assertEqual(['Perm3'], user0.get_perms(object0))
+        user0.revoke('Perm3', object0)
+        self.assertFalse(permission_map[TestModelBitmask].objects.exists())
+
+        user0.set_perms(['Perm2', 'Perm4'], object0)
+        self.assertEqual(set(['Perm2', 'Perm4']),
+                         set(user0.get_perms(object0)))
+        self.assertEqual(set(['Perm2', 'Perm4']),
+                         set(user0.get_perms_any(TestModelBitmask)))
+        user0.revoke_all(object0)
+        self.assertEqual([], user0.get_perms(object0))
+
+    def test_checks(self):
+        """ has_perm, has_any_perms and has_all_perms with users and groups """
+        user0, user1, group = self.user0, self.user1, self.group
+        object0, object1 = self.object0, self.object1
+
+        user0.grant('Perm1', object0)
+        user0.grant('Perm2', object0)
+        group.grant('Perm3', object1)
+
+        self.assertTrue(user0.has_object_perm('Perm1', object0))
+        self.assertFalse(user0.has_object_perm('Perm3', object0))
+        self.assertTrue(user1.has_object_perm('Perm3', object1))
+        self.assertFalse(user1.has_object_perm('Perm3', object1, False))
+        self.assertTrue(group.has_perm('Perm3', object1))
+        self.assertEqual(['Perm3'], user1.get_perms(object1))
+        self.assertEqual([], user1.get_perms(object1, False))
+
+        self.assertTrue(user0.has_any_perms(object0, ['Perm3', 'Perm2']))
+        self.assertFalse(user0.has_any_perms(object0, ['Perm3', 'Perm4']))
+        self.assertTrue(user0.has_any_perms(TestModelBitmask, ['Perm1']))
+        self.assertTrue(user1.has_any_perms(object1, ['Perm3']))
+        self.assertTrue(group.has_any_perms(object1, ['Perm3', 'Perm4']))
+        self.assertFalse(group.has_any_perms(object1, ['Perm4']))
+
+        self.assertTrue(user0.has_all_perms(object0, ['Perm1', 'Perm2']))
+        self.assertFalse(user0.has_all_perms(object0, ['Perm1', 'Perm3']))
+        self.assertTrue(user1.has_all_perms(TestModelBitmask, ['Perm3']))
+        self.assertTrue(group.has_all_perms(object1, ['Perm3']))
+        self.assertFalse(group.has_all_perms(object1, ['Perm3', 'Perm1']))
+
+    def test_get_users_and_groups(self):
+        """ relational queries through the bitmask column """
+        user0, user1, group = self.user0, self.user1, self.group
+        object0 = self.object0
+
+        user0.grant('Perm1', object0)
+        user0.grant('Perm2', object0)
+        group.grant('Perm2', object0)
+        group.grant('Perm4', object0)
+
+        self.assertEqual(set([user0, user1]),
+                         set(get_users_any(object0, ['Perm2'])))
+        self.assertEqual([user0], list(get_users_any(object0, ['Perm1'])))
+        self.assertEqual([user1], list(get_users_any(object0, ['Perm4'])))
+        self.assertEqual([user0],
+                         list(get_users_any(object0, ['Perm2'], False)))
+        self.assertEqual([user0], list(get_users_all(object0,
+                                                     ['Perm1', 'Perm2'])))
+        self.assertEqual([user1], list(get_users_all(object0,
+                                                     ['Perm2', 'Perm4'])))
+        self.assertEqual([], list(get_users_all(object0, ['Perm1', 'Perm4'])))
+
+        self.assertEqual([group], list(get_groups_any(object0, ['Perm3',
+                                                                'Perm4'])))
+        self.assertEqual([], list(get_groups_any(object0, ['Perm1'])))
+        self.assertEqual([group], list(get_groups_all(object0, ['Perm2',
+                                                                'Perm4'])))
+        self.assertEqual([], list(get_groups_all(object0, ['Perm1',
+                                                           'Perm4'])))
+
+    def test_get_objects(self):
+        """ filtering objects on bitmask perms, including related models """
+        user0, user1, group = self.user0, self.user1, self.group
+        object0, object1, parent = self.object0, self.object1, self.parent
+
+        user0.grant('Perm1', object0)
+        user0.grant('Perm2', object1)
+        user0.grant('Perm3', object1)
+        group.grant('Perm4', object1)
+
+        query = user0.get_objects_any_perms(TestModelBitmask, ['Perm1'])
+        self.assertEqual([object0], list(query))
+        query = user0.get_objects_any_perms(TestModelBitmask,
+                                            ['Perm1', 'Perm2'])
+        self.assertEqual(set([object0, object1]), set(query))
+        query = user0.get_objects_all_perms(TestModelBitmask,
+                                            ['Perm2', 'Perm3'])
+        self.assertEqual([object1], list(query))
+        query = user1.get_objects_any_perms(TestModelBitmask, ['Perm4'])
+        self.assertEqual([object1], list(query))
+        query = group.get_objects_all_perms(TestModelBitmask, ['Perm4'])
+        self.assertEqual([object1], list(query))
+        query = group.get_objects_any_perms(TestModelBitmask, ['Perm1'])
+        self.assertEqual([], list(query))
+
+        # reverse relation from a column model to a bitmask model
+        query = user0.get_objects_any_perms(TestModel, ['Perm4'],
+                                            testmodelbitmask=['Perm1'])
+        self.assertEqual([parent], list(query))
+        query = user0.get_objects_any_perms(TestModel, ['Perm4'],
+                                            testmodelbitmask=['Perm2'])
+        self.assertEqual([], list(query))
+
+    def test_get_objects_all_related(self):
+        """ filtering objects on all perms of a related bitmask model """
+        user0, user1, group = self.user0, self.user1, self.group
+        object0, parent = self.object0, self.parent
+
+        user0.grant('Perm4', parent)
+        user0.grant('Perm1', object0)
+        user0.grant('Perm3', object0)
+        group.grant('Perm4', parent)
+        group.grant('Perm2', object0)
+        group.grant('Perm3', object0)
+
+        query = user0.get_objects_all_perms(TestModel, ['Perm4'],
+                    testmodelbitmask=['Perm1', 'Perm3'])
+        self.assertEqual([parent], list(query))
+        query = user0.get_objects_all_perms(TestModel, ['Perm4'],
+                    testmodelbitmask=['Perm1', 'Perm2'])
+        self.assertEqual([], list(query))
+        query = user1.get_objects_all_perms(TestModel, ['Perm4'],
+                    testmodelbitmask=['Perm2', 'Perm3'])
+        self.assertEqual([parent], list(query))
+        query = group.get_objects_all_perms(TestModel, ['Perm4'],
+                    testmodelbitmask=['Perm2', 'Perm3'])
+        self.assertEqual([parent], list(query))
+        query = group.get_objects_all_perms(TestModel, ['Perm4'],
+                    testmodelbitmask=['Perm1', 'Perm3'])
+        self.assertEqual([], list(query))
+
+    def test_bitmask_from_columns(self):
+        """ converting between column-per-perm and bitmask layouts """
+        user0, object0 = self.user0, self.object0
+        table = permission_map[TestModelBitmask]._meta.db_table
+        cursor = connection.cursor()
+        for perm in ('Perm1', 'Perm2', 'Perm3', 'Perm4'):
+            cursor.execute('ALTER TABLE %s ADD COLUMN %s integer DEFAULT 0'
+                           % (table, perm))
+
+        cursor.execute('INSERT INTO %s (obj_id, user_id, bitmask, Perm2, Perm3)'
+                       ' VALUES (%%s, %%s, 0, 1, 1)' % table,
+                       [object0.pk, user0.pk])
+        bitmask_from_columns(TestModelBitmask)
+        self.assertEqual(set(['Perm2', 'Perm3']),
+                         set(user0.get_perms(object0)))
+
+        user0.grant('Perm4', object0)
+        columns_from_bitmask(TestModelBitmask)
+        cursor.execute('SELECT Perm1, Perm2, Perm3, Perm4 FROM %s' % table)
+        self.assertEqual((0, 1, 1, 1), tuple(cursor.fetchone()))
+
+        self.assertRaises(RegistrationException, bitmask_from_columns,
+                          TestModel)
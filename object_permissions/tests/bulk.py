@@ -0,0 +1,221 @@
+from django.contrib.auth.models import User, Group
+from django.test import TestCase
+
+from object_permissions import *
+from object_permissions.registration import TestModel, TestModelBitmask, \
+    TestModelChild, UnknownPermissionException, permission_map
+from object_permissions.signals import granted, revoked, granted_batch, \
+    revoked_batch
+
+
+class TestBulkPermissions(TestCase):
+    """ tests for bulk_grant(), bulk_revoke() and set_perms_matrix() """
+
+    def setUp(self):
+        self.tearDown()
+        self.user0 = User.objects.create(id=2, username='tester')
+        self.user1 = User.objects.create(id=3, username='tester2')
+        self.group = Group.objects.create(name='testers')
+        self.objects = [TestModel.objects.create(name='test%s' % i)
+                        for i in range(3)]
+        self.bitmask_objects = [TestModelBitmask.objects.create(name='b%s' % i)
+                                for i in range(2)]
+
+        self.signals = []
+        granted.connect(self.receiver)
+        revoked.connect(self.receiver)
+        granted_batch.connect(self.batch_receiver)
+        revoked_batch.connect(self.batch_receiver)
+
+    def tearDown(self):
+        granted.disconnect(self.receiver)
+        revoked.disconnect(self.receiver)
+        granted_batch.disconnect(self.batch_receiver)
+        revoked_batch.disconnect(self.batch_receiver)
+        TestModel.objects.all().delete()
+        TestModelBitmask.objects.all().delete()
+        TestModelChild.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def receiver(self, sender, perm, object, **kwargs):
+        self.signals.append((sender, perm, object))
+
+    def batch_receiver(self, sender, changes, **kwargs):
+        self.signals.append((sender, changes))
+
+    def test_bulk_grant(self):
+        """
+        Verifies:
+            * perms are granted to users and groups on all objects
+            * existing rows are updated rather than duplicated
+            * one signal is sent per change
+            * unknown perms raise an error
+        """
+        user0, user1, group = self.user0, self.user1, self.group
+        objects = self.objects
+        user0.grant('Perm1', objects[0])
+        self.signals = []
+
+        changes = bulk_grant([user0, user1, group], ['Perm1', 'Perm2'],
+                             objects)
+        self.assertEqual(17, len(changes))
+        self.assertEqual(17, len(self.signals))
+        self.assertFalse((user0, 'Perm1', objects[0]) in self.signals)
+        self.assertTrue((group, 'Perm2', objects[2]) in self.signals)
+
+        for obj in objects:
+            self.assertEqual(set(['Perm1', 'Perm2']),
+                             set(user0.get_perms(obj, False)))
+            self.assertEqual(set(['Perm1', 'Perm2']),
+                             set(user1.get_perms(obj, False)))
+            self.assertEqual(set(['Perm1', 'Perm2']),
+                             set(group.get_perms(obj)))
+        self.assertEqual(9, permission_map[TestModel].objects.count())
+
+        # granting again changes nothing
+        self.assertEqual([], bulk_grant([user0], ['Perm1'], objects))
+
+        self.assertRaises(UnknownPermissionException, bulk_grant, [user0],
+                          ['DoesNotExist'], objects)
+
+    def test_bulk_queries(self):
+        """ number of queries does not depend on the number of rows """
+        principals = [self.user0, self.user1, self.group]
+        # model without effective permissions, which add their own queries
+        objects = [TestModelChild.objects.create() for i in range(3)]
+        bulk_grant(principals, ['Perm3'], objects)
+
+        # read rows, update rows
+        self.assertNumQueries(2, bulk_grant, principals, ['Perm4'], objects)
+        # read rows, update rows, collect and delete empty rows
+        self.assertNumQueries(4, bulk_revoke, principals, ['Perm3', 'Perm4'],
+                              objects)
+
+    def test_bulk_revoke(self):
+        """
+        Verifies:
+            * perms are revoked from users and groups on all objects
+            * rows without perms are deleted
+        """
+        user0, group = self.user0, self.group
+        objects = self.objects
+        bulk_grant([user0, group], ['Perm1', 'Perm2'], objects)
+        user0.grant('Perm3', objects[1])
+        self.signals = []
+
+        changes = bulk_revoke([user0, group], ['Perm1', 'Perm2'], objects)
+        self.assertEqual(12, len(changes))
+        self.assertEqual(12, len(self.signals))
+        self.assertEqual(['Perm3'], user0.get_perms(objects[1]))
+        self.assertEqual([], user0.get_perms(objects[0]))
+        self.assertEqual([], group.get_perms(objects[1]))
+        self.assertEqual(1, permission_map[TestModel].objects.count())
+
+        self.assertEqual([], bulk_revoke([user0], ['Perm1'], objects))
+
+    def test_bitmask(self):
+        """ bulk operations on a model with bitmask storage """
+        user0, group = self.user0, self.group
+        objects = self.bitmask_objects
+        user0.grant('Perm4', objects[0])
+
+        bulk_grant([user0, group], ['Perm1', 'Perm3'], objects)
+        self.assertEqual(set(['Perm1', 'Perm3', 'Perm4']),
+                         set(user0.get_perms(objects[0])))
+        self.assertEqual(set(['Perm1', 'Perm3']),
+                         set(group.get_perms(objects[1])))
+
+        bulk_revoke([user0, group], ['Perm1', 'Perm3'], objects)
+        self.assertEqual(['Perm4'], user0.get_perms(objects[0]))
+        self.assertEqual(1, permission_map[TestModelBitmask].objects.count())
+
+    def test_batch_signal(self):
+        """ batch_signal sends one signal per model carrying all changes """
+        user0 = self.user0
+        objects = self.objects + self.bitmask_objects
+
+        changes = bulk_grant([user0], ['Perm1'], objects, batch_signal=True)
+        self.assertEqual(5, len(changes))
+        self.assertEqual(2, len(self.signals))
+        signals = dict(self.signals)
+        self.assertEqual([(user0, 'Perm1', obj) for obj in self.objects],
+                         signals[TestModel])
+        self.assertEqual(2, len(signals[TestModelBitmask]))
+
+        self.signals = []
+        bulk_revoke([user0], ['Perm1'], objects, batch_signal=True)
+        self.assertEqual(2, len(self.signals))
+
+    def test_set_perms_matrix(self):
+        """
+        Verifies:
+            * perms of every principal and object are set to exactly the
+              given perms
+            * only perms that changed are returned and signaled
+            * empty perms delete rows
+            * unknown perms raise an error
+        """
+        user0, user1, group = self.user0, self.user1, self.group
+        objects, bitmask = self.objects, self.bitmask_objects
+        user0.grant('Perm1', objects[0])
+        user0.grant('Perm2', objects[0])
+        group.grant('Perm3', objects[1])
+        user1.grant('Perm4', bitmask[0])
+        self.signals = []
+
+        granted_, revoked_ = set_perms_matrix({
+            (user0, objects[0]):['Perm2', 'Perm3'],
+            (user0, objects[1]):['Perm1'],
+            (user1, objects[2]):[],
+            (group, objects[1]):[],
+            (group, objects[2]):['Perm4'],
+            (user1, bitmask[0]):['Perm3', 'Perm4'],
+            (user0, bitmask[1]):['Perm1'],
+        })
+        self.assertEqual(set([(user0, 'Perm3', objects[0]),
+                              (user0, 'Perm1', objects[1]),
+                              (group, 'Perm4', objects[2]),
+                              (user1, 'Perm3', bitmask[0]),
+                              (user0, 'Perm1', bitmask[1])]), set(granted_))
+        self.assertEqual(set([(user0, 'Perm1', objects[0]),
+                              (group, 'Perm3', objects[1])]), set(revoked_))
+        self.assertEqual(7, len(self.signals))
+
+        self.assertEqual(set(['Perm2', 'Perm3']),
+                         set(user0.get_perms(objects[0])))
+        self.assertEqual(['Perm1'], user0.get_perms(objects[1], False))
+        self.assertEqual([], group.get_perms(objects[1]))
+        self.assertEqual(['Perm4'], group.get_perms(objects[2]))
+        self.assertEqual(set(['Perm3', 'Perm4']),
+                         set(user1.get_perms(bitmask[0])))
+        self.assertEqual(['Perm1'], user0.get_perms(bitmask[1]))
+        self.assertEqual(3, permission_map[TestModel].objects.count())
+
+        # setting the same perms again changes nothing
+        self.assertEqual(([], []), set_perms_matrix({
+            (user0, objects[0]):['Perm3', 'Perm2'],
+            (user1, objects[0]):[]}))
+
+        self.assertRaises(UnknownPermissionException, set_perms_matrix,
+                          {(user0, objects[0]):['DoesNotExist']})
+
+    def test_set_perms_matrix_queries(self):
+        """ rows are read once and written with a query per kind of change """
+        user0, user1, group = self.user0, self.user1, self.group
+        objects = [TestModelChild.objects.create() for i in range(3)]
+        bulk_grant([user0, group], ['Perm1'], objects)
+        self.signals = []
+
+        matrix = {}
+        for obj in objects:
+            matrix[(user0, obj)] = ['Perm2']
+            matrix[(user1, obj)] = ['Perm1', 'Perm2']
+            matrix[(group, obj)] = []
+        # read rows, collect and delete rows, update rows, insert 3 rows
+        self.assertNumQueries(7, set_perms_matrix, matrix, True)
+        self.assertEqual(2, len(self.signals))
+        for obj in objects:
+            self.assertEqual(['Perm2'], user0.get_perms(obj))
+            self.assertEqual(set(['Perm1', 'Perm2']),
+                             set(user1.get_perms(obj)))
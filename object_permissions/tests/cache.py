@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.contrib.auth.models import User, Group
+from django.test import TestCase
+
+from object_permissions import *
+from object_permissions.registration import TestModel, TestModelChild, \
+    TestModelInheritChild, user_has_perm
+
+
+class TestSharedPermissionCache(TestCase):
+    """ tests for caching permissions with the django cache framework """
+
+    def setUp(self):
+        self.tearDown()
+        settings.OBJECT_PERMISSIONS_CACHE = 'default'
+        get_perm_cache().clear()
+        self.user0 = User.objects.create(id=2, username='tester')
+        self.user1 = User.objects.create(id=3, username='tester2')
+        self.group = Group.objects.create(name='testers')
+        self.object0 = TestModel.objects.create(name='test0')
+        self.child = TestModelChild.objects.create(parent=self.object0)
+
+    def tearDown(self):
+        for name in ('OBJECT_PERMISSIONS_CACHE',
+                     'OBJECT_PERMISSIONS_CACHE_TIMEOUT',
+                     'OBJECT_PERMISSIONS_CACHE_MAX_ENTRIES'):
+            if hasattr(settings, name):
+                delattr(settings, name)
+        TestModel.objects.all().delete()
+        TestModelChild.objects.all().delete()
+        TestModelInheritChild.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def test_config(self):
+        """ the cache is configurable and can be disabled """
+        settings.OBJECT_PERMISSIONS_CACHE_TIMEOUT = 60
+        settings.OBJECT_PERMISSIONS_CACHE_MAX_ENTRIES = 50
+        cache = get_perm_cache()
+        self.assertEqual(60, cache.default_timeout)
+        self.assertEqual(50, cache._max_entries)
+
+        del settings.OBJECT_PERMISSIONS_CACHE
+        self.assertEqual(None, get_perm_cache())
+
+    def test_cached(self):
+        """ perms are loaded once and then answered from the cache """
+        user0, child = self.user0, self.child
+        user0.grant('Perm1', child)
+
+        self.assertEqual(['Perm1'], get_user_perms(user0, child))
+        self.assertNumQueries(0, get_user_perms, user0, child)
+        self.assertNumQueries(0, user_has_perm, user0, 'Perm1', child)
+        self.assertFalse(user_has_perm(user0, 'Perm2', child))
+
+        # users and the groups flag are cached separately
+        self.assertEqual([], get_user_perms(self.user1, child))
+        self.assertEqual(['Perm1'], get_user_perms(user0, child, False))
+
+    def test_versions(self):
+        """ changes to perms and group membership make entries stale """
+        user0, group, child = self.user0, self.group, self.child
+        self.assertEqual([], get_user_perms(user0, child))
+
+        user0.grant('Perm1', child)
+        self.assertEqual(['Perm1'], get_user_perms(user0, child))
+        user0.set_perms(['Perm2'], child)
+        self.assertEqual(['Perm2'], get_user_perms(user0, child))
+
+        group.grant('Perm3', child)
+        self.assertEqual(['Perm2'], get_user_perms(user0, child))
+        user0.groups.add(group)
+        self.assertEqual(set(['Perm2', 'Perm3']),
+                         set(get_user_perms(user0, child)))
+        group.user_set.clear()
+        self.assertEqual(['Perm2'], get_user_perms(user0, child))
+        group.user_set.add(user0)
+        group.delete()
+        self.assertEqual(['Perm2'], get_user_perms(user0, child))
+
+        bulk_grant([user0], ['Perm4'], [child])
+        self.assertEqual(set(['Perm2', 'Perm4']),
+                         set(get_user_perms(user0, child)))
+        user0.revoke_all(child)
+        self.assertEqual([], get_user_perms(user0, child))
+
+    def test_expired_version(self):
+        """ entries are stale when their versions are evicted """
+        user0, child = self.user0, self.child
+        user0.grant('Perm1', child)
+        self.assertEqual(['Perm1'], get_user_perms(user0, child))
+
+        cache = get_perm_cache()
+        cache.delete('object_permissions:user:%s' % user0.pk)
+        self.assertNumQueries(1, get_user_perms, user0, child)
+        self.assertNumQueries(0, get_user_perms, user0, child)
+
+    def test_inherited(self):
+        """ changes to perms on ancestors make entries of children stale """
+        user0 = self.user0
+        child = TestModelInheritChild.objects.create(parent=self.object0)
+        self.assertEqual([], get_user_perms(user0, child))
+
+        user0.grant('Perm1', self.object0)
+        self.assertEqual(['Perm1'], get_user_perms(user0, child))
+        user0.revoke('Perm1', self.object0)
+        self.assertFalse(user_has_perm(user0, 'Perm1', child))
+
+    def test_group_ids(self):
+        """ group ids of users are shared until their memberships change """
+        user0, group = self.user0, self.group
+        group.user_set.add(user0)
+        self.assertEqual(frozenset([group.pk]), get_user_group_ids(user0))
+
+        self.assertNumQueries(0, get_user_group_ids,
+                              User.objects.get(pk=user0.pk))
+        group.user_set.remove(user0)
+        self.assertEqual(frozenset(),
+                         get_user_group_ids(User.objects.get(pk=user0.pk)))
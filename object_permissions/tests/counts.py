@@ -0,0 +1,183 @@
+from django.contrib.auth.models import User, Group
+from django.test import TestCase
+
+from object_permissions import *
+from object_permissions import registration
+from object_permissions.registration import TestModel, TestModelBitmask, \
+    TestModelChild, TestModelEffective, TestModelInheritChild
+
+
+class TestCounts(TestCase):
+    """ tests for the count_* functions """
+
+    def setUp(self):
+        self.tearDown()
+        self.user0 = User.objects.create(id=2, username='tester')
+        self.user1 = User.objects.create(id=3, username='tester2')
+        self.user2 = User.objects.create(id=4, username='tester3')
+        self.group0 = Group.objects.create(name='testers')
+        self.group1 = Group.objects.create(name='testers2')
+        self.group0.user_set.add(self.user0, self.user1)
+        self.group1.user_set.add(self.user2)
+
+    def tearDown(self):
+        TestModel.objects.all().delete()
+        TestModelBitmask.objects.all().delete()
+        TestModelChild.objects.all().delete()
+        TestModelEffective.objects.all().delete()
+        TestModelInheritChild.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def grant(self, model):
+        user0, user1, group0, group1 = self.user0, self.user1, self.group0, \
+            self.group1
+        objects = [model.objects.create() for i in range(3)]
+        object0, object1, object2 = objects
+        user0.grant('Perm1', object0)
+        user0.grant('Perm2', object0)
+        user1.grant('Perm2', object0)
+        group0.grant('Perm1', object0)
+        group0.grant('Perm2', object0)
+        group1.grant('Perm3', object0)
+        user1.grant('Perm1', object1)
+        group1.grant('Perm1', object1)
+        return objects
+
+    def check_users(self, objects):
+        for obj in objects:
+            for perms in (None, ['Perm1'], ['Perm2', 'Perm3']):
+                for groups in (True, False):
+                    self.assertEqual(
+                        get_users_any(obj, perms, groups).count(),
+                        count_users_any(obj, perms, groups))
+            for perms in (['Perm1'], ['Perm1', 'Perm2']):
+                for groups in (True, False):
+                    self.assertEqual(
+                        get_users_all(obj, perms, groups).count(),
+                        count_users_all(obj, perms, groups))
+
+    def check_groups(self, objects):
+        for obj in objects:
+            for perms in (None, ['Perm1'], ['Perm1', 'Perm3']):
+                self.assertEqual(get_groups_any(obj, perms).count(),
+                                 count_groups_any(obj, perms))
+            for perms in (['Perm1'], ['Perm1', 'Perm2']):
+                self.assertEqual(get_groups_all(obj, perms).count(),
+                                 count_groups_all(obj, perms))
+
+    def check_objects(self, model):
+        for user in (self.user0, self.user1, self.user2):
+            for perms in (None, ['Perm1'], ['Perm2', 'Perm3']):
+                for groups in (True, False):
+                    self.assertEqual(
+                        user.get_objects_any_perms(model, perms,
+                                                   groups).count(),
+                        user.count_objects_any_perms(model, perms, groups))
+            for perms in (['Perm1'], ['Perm1', 'Perm2']):
+                for groups in (True, False):
+                    self.assertEqual(
+                        user.get_objects_all_perms(model, perms,
+                                                   groups).count(),
+                        user.count_objects_all_perms(model, perms, groups))
+        for group in (self.group0, self.group1):
+            for perms in (None, ['Perm1'], ['Perm1', 'Perm3']):
+                self.assertEqual(
+                    group.get_objects_any_perms(model, perms).count(),
+                    group.count_objects_any_perms(model, perms))
+            for perms in (['Perm1'], ['Perm1', 'Perm2']):
+                self.assertEqual(
+                    group.get_objects_all_perms(model, perms).count(),
+                    group.count_objects_all_perms(model, perms))
+
+    def test_users(self):
+        """ counts match the querysets of get_users_any/all() """
+        object0, object1, object2 = objects = self.grant(TestModelChild)
+        self.assertEqual(3, count_users_any(object0))
+        self.assertEqual(2, count_users_any(object0, groups=False))
+        self.assertEqual(2, count_users_all(object0, ['Perm1', 'Perm2']))
+        self.assertEqual(2, count_users_any(object1, ['Perm1']))
+        self.assertEqual(0, count_users_any(object2))
+        self.check_users(objects)
+
+    def test_effective(self):
+        """ counts of a model with effective permissions """
+        objects = self.grant(TestModelEffective)
+        self.assertEqual(3, count_users_any(objects[0]))
+        self.check_users(objects)
+        self.check_objects(TestModelEffective)
+
+    def test_bitmask(self):
+        """ counts of a model with bitmask storage """
+        objects = self.grant(TestModelBitmask)
+        self.check_users(objects)
+        self.check_groups(objects)
+        self.check_objects(TestModelBitmask)
+
+    def test_groups(self):
+        """ counts match the querysets of get_groups_any/all() """
+        object0, object1, object2 = objects = self.grant(TestModelChild)
+        self.assertEqual(2, count_groups_any(object0))
+        self.assertEqual(1, count_groups_all(object0, ['Perm1', 'Perm2']))
+        self.assertEqual(0, count_groups_any(object2))
+        self.check_groups(objects)
+
+    def test_objects(self):
+        """ counts match the querysets of *_get_objects_*_perms() """
+        self.grant(TestModelChild)
+        self.assertEqual(2, self.user1.count_objects_any_perms(TestModelChild))
+        self.assertEqual(1, self.user1.count_objects_any_perms(
+            TestModelChild, ['Perm1'], False))
+        self.assertEqual(0, self.user1.count_objects_any_perms(
+            TestModelChild, ['DoesNotExist']))
+        self.check_objects(TestModelChild)
+
+    def test_inherited(self):
+        """ objects inheriting permissions are counted with their querysets """
+        parent = TestModel.objects.create()
+        for i in range(2):
+            TestModelInheritChild.objects.create(parent=parent)
+        self.user0.grant('Perm1', parent)
+        self.assertEqual(2, self.user0.count_objects_any_perms(
+            TestModelInheritChild, ['Perm1']))
+        self.check_objects(TestModelInheritChild)
+
+    def test_many(self):
+        """ counts of many objects use one query per model """
+        objects = self.grant(TestModelChild)
+        bitmask_objects = self.grant(TestModelBitmask)
+        all_objects = objects + bitmask_objects
+
+        self.assertNumQueries(2, count_users_many, all_objects)
+        counts = count_users_many(all_objects)
+        self.assertEqual(dict((obj, count_users_any(obj))
+                              for obj in all_objects), counts)
+        self.assertEqual([3, 2, 0], [counts[obj] for obj in objects])
+
+        counts = count_users_many(all_objects, ['Perm1', 'Perm2'], True,
+                                  False)
+        self.assertEqual([1, 0, 0], [counts[obj] for obj in objects])
+
+        self.assertNumQueries(2, count_groups_many, all_objects, ['Perm1'])
+        counts = count_groups_many(all_objects, ['Perm1'])
+        self.assertEqual([1, 1, 0], [counts[obj] for obj in bitmask_objects])
+        self.assertEqual({}, count_groups_many([]))
+
+    def test_sql_params(self):
+        """
+        perm columns are compared with integers, postgresql does not compare
+        integer columns with booleans
+        """
+        perms = ['Perm1', 'Perm2']
+        for all_perms in (False, True):
+            for principal in ('user', 'users', 'group', 'effective'):
+                model = principal == 'effective' and TestModelEffective \
+                    or TestModelChild
+                sql, params = registration._count_sql(model, perms,
+                                                      all_perms, principal, 1)
+                self.assertEqual([int, int], [type(p) for p in params])
+            for principal in ('user', 'groups', 'group'):
+                sql, params = registration._check_sql(TestModelChild, perms,
+                    principal, False, all_perms, 1, True)
+                self.assertTrue(sql.startswith('SELECT COUNT('), sql)
+                self.assertEqual([int, int], [type(p) for p in params])
@@ -0,0 +1,176 @@
+from django.contrib.auth.models import User, Group
+from django.core.management import call_command
+from django.test import TestCase
+
+from object_permissions import *
+from object_permissions.registration import TestModelChild, \
+    TestModelEffective, TestModelBitmask, effective_map
+
+
+class TestEffectivePermissions(TestCase):
+    """ tests for models registered with effective permissions """
+
+    def setUp(self):
+        self.tearDown()
+        self.user0 = User.objects.create(id=2, username='tester')
+        self.user1 = User.objects.create(id=3, username='tester2')
+        self.group = Group.objects.create(name='testers')
+        self.group.user_set.add(self.user1)
+        self.object0 = TestModelEffective.objects.create(name='test0')
+        self.object1 = TestModelEffective.objects.create(name='test1')
+
+    def tearDown(self):
+        TestModelEffective.objects.all().delete()
+        TestModelChild.objects.all().delete()
+        TestModelBitmask.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def effective(self, user, obj):
+        """ perms stored in the effective table for a user and object """
+        model = obj.__class__
+        try:
+            row = effective_map[model].objects.get(user=user, obj=obj)
+        except effective_map[model].DoesNotExist:
+            return set()
+        return set(perm for perm in get_model_perms(model)
+                   if getattr(row, perm))
+
+    def test_grant_revoke(self):
+        """ user and group grants and revokes update effective perms """
+        user0, user1, group = self.user0, self.user1, self.group
+        object0 = self.object0
+
+        user0.grant('Perm1', object0)
+        user1.grant('Perm1', object0)
+        group.grant('Perm2', object0)
+        self.assertEqual(set(['Perm1']), self.effective(user0, object0))
+        self.assertEqual(set(['Perm1', 'Perm2']),
+                         self.effective(user1, object0))
+
+        group.revoke('Perm2', object0)
+        self.assertEqual(set(['Perm1']), self.effective(user1, object0))
+        user1.set_perms(['Perm3'], object0)
+        self.assertEqual(set(['Perm3']), self.effective(user1, object0))
+        user1.revoke_all(object0)
+        self.assertEqual(set(), self.effective(user1, object0))
+        self.assertFalse(effective_map[TestModelEffective].objects \
+                         .filter(user=user1).exists())
+
+        bulk_grant([user0, group], ['Perm4'], [object0, self.object1])
+        self.assertEqual(set(['Perm4']), self.effective(user1, self.object1))
+        bulk_revoke([group], ['Perm4'], [object0, self.object1])
+        self.assertEqual(set(), self.effective(user1, self.object1))
+        self.assertEqual(set(['Perm1', 'Perm4']),
+                         self.effective(user0, object0))
+
+    def test_membership(self):
+        """ adding, removing and clearing group members """
+        user0, user1, group = self.user0, self.user1, self.group
+        object0 = self.object0
+        group.grant('Perm1', object0)
+
+        user0.groups.add(group)
+        self.assertEqual(set(['Perm1']), self.effective(user0, object0))
+        user0.groups.remove(group)
+        self.assertEqual(set(), self.effective(user0, object0))
+
+        group.user_set.add(user0)
+        self.assertEqual(set(['Perm1']), self.effective(user0, object0))
+        group.user_set.clear()
+        self.assertEqual(set(), self.effective(user0, object0))
+        self.assertEqual(set(), self.effective(user1, object0))
+
+        group.user_set.add(user1)
+        user1.groups.clear()
+        self.assertEqual(set(), self.effective(user1, object0))
+
+    def test_delete_group(self):
+        """ deleting a group removes its perms from its members """
+        user1, group = self.user1, self.group
+        user1.grant('Perm2', self.object0)
+        group.grant('Perm1', self.object0)
+
+        group.delete()
+        self.assertEqual(set(['Perm2']), self.effective(user1, self.object0))
+
+    def test_bitmask(self):
+        """ effective perms combine bitmasks of users and groups """
+        user1, group = self.user1, self.group
+        obj = TestModelBitmask.objects.create(name='test')
+
+        user1.grant('Perm1', obj)
+        group.grant('Perm3', obj)
+        self.assertEqual(set(['Perm1', 'Perm3']), self.effective(user1, obj))
+        self.assertTrue(user1.has_any_perms(obj, ['Perm3']))
+        self.assertFalse(user1.has_all_perms(obj, ['Perm1', 'Perm3']))
+        self.assertEqual([], list(user1.get_objects_all_perms(
+            TestModelBitmask, ['Perm1', 'Perm3'])))
+
+    def test_all_perms(self):
+        """
+        *_all checks are not satisfied by perms granted partly to the user and
+        partly to their groups, the same as without effective permissions
+        """
+        user1, group = self.user1, self.group
+        for model in (TestModelEffective, TestModelChild):
+            obj = model.objects.create()
+            user1.grant('Perm1', obj)
+            group.grant('Perm2', obj)
+            group.grant('Perm3', obj)
+            group.grant('Perm4', obj)
+
+            self.assertFalse(user1.has_all_perms(obj, ['Perm1', 'Perm2']))
+            self.assertFalse(user1.has_all_perms(model, ['Perm1', 'Perm2']))
+            self.assertEqual([], list(get_users_all(obj, ['Perm1', 'Perm2'])))
+            self.assertEqual(0, count_users_all(obj, ['Perm1', 'Perm2']))
+            self.assertEqual([], list(user1.get_objects_all_perms(
+                model, ['Perm1', 'Perm2'])))
+            self.assertEqual(0, user1.count_objects_all_perms(
+                model, ['Perm1', 'Perm2']))
+
+            self.assertTrue(user1.has_all_perms(obj, ['Perm2', 'Perm3']))
+            self.assertEqual([user1], list(get_users_all(obj,
+                                                         ['Perm2', 'Perm3'])))
+            self.assertEqual(1, count_users_all(obj, ['Perm2', 'Perm3']))
+            self.assertEqual([obj], list(user1.get_objects_all_perms(
+                model, ['Perm2', 'Perm3'])))
+            self.assertEqual(1, user1.count_objects_all_perms(
+                model, ['Perm2', 'Perm3']))
+
+    def test_reads_use_effective_table(self):
+        """ group aware lookups do not join through group membership """
+        user1, group = self.user1, self.group
+        object0 = self.object0
+        group.grant('Perm1', object0)
+
+        queries = [
+            get_users_any(object0, ['Perm1']),
+            user1.get_objects_any_perms(TestModelEffective, ['Perm1']),
+        ]
+        for query in queries:
+            self.assertFalse('auth_user_groups' in str(query.query))
+            self.assertEqual(1, len(query))
+
+        self.assertTrue(user1.has_perm('Perm1', object0))
+        self.assertEqual(['Perm1'], user1.get_perms(object0))
+        self.assertEqual(['Perm1'], user1.get_perms_any(TestModelEffective))
+
+    def test_rebuild(self):
+        """ rebuild_effective_perms restores a stale or empty table """
+        user0, user1, group = self.user0, self.user1, self.group
+        object0 = self.object0
+        user0.grant('Perm1', object0)
+        group.grant('Perm2', object0)
+
+        effective_map[TestModelEffective].objects.all().delete()
+        self.assertFalse(user1.has_perm('Perm2', object0))
+
+        call_command('rebuild_effective_perms', 'TestModelEffective', verbosity=0)
+        self.assertEqual(set(['Perm1']), self.effective(user0, object0))
+        self.assertEqual(set(['Perm2']), self.effective(user1, object0))
+        self.assertTrue(user1.has_perm('Perm2', object0))
+
+        effective_map[TestModelEffective].objects.all().delete()
+        call_command('rebuild_effective_perms', verbosity=0)
+        self.assertEqual(set(['Perm2']), self.effective(user1, object0))
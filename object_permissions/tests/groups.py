@@ -1,12 +1,19 @@
+import re
+
 from django.conf import settings
 from django.contrib.auth.models import User, Group
+from django.template import Context, Template
 from django.test import TestCase
-from django.test.client import Client
+from django.test.client import Client, RequestFactory
 
 from object_permissions import *
 from object_permissions.registration import TestModel, TestModelChild, \
-    TestModelChildChild, UnknownPermissionException
+    TestModelChildChild, UnknownPermissionException, permission_map, \
+    _user_clause
 from object_permissions.signals import view_edit_user
+from object_permissions.templatetags.object_permission_tags import \
+    number_group_admins
+from object_permissions.views import groups as views
 
 
 __all__ = ('TestGroups','TestGroupViews')
@@ -776,12 +783,17 @@ class TestGroups(TestCase):
         query = user0.get_objects_all_perms(TestModelChild, perms=['Perm1'], parent=['Perm4'])
         self.assertEqual(0, len(query))
         
-        # related field with multiple perms
+        # related field with multiple perms - the parent of child1 only has
+        # one of them
         query = user0.get_objects_all_perms(TestModelChild, perms=['Perm1'], parent=['Perm1','Perm2'])
-        self.assertEqual(1, len(query))
-        self.assertFalse(child0 in query)
+        self.assertEqual(0, len(query))
+        group0.grant('Perm2', object0)
+        query = user0.get_objects_all_perms(TestModelChild, perms=['Perm1'], parent=['Perm1','Perm2'])
+        self.assertEqual(2, len(query))
+        self.assertTrue(child0 in query)
         self.assertTrue(child1 in query)
         self.assertFalse(child2 in query)
+        group0.revoke('Perm2', object0)
         
         # multiple relations
         query = user0.get_objects_all_perms(TestModelChildChild, perms=['Perm1'], parent=['Perm1'], parent__parent=['Perm1'])
@@ -1084,12 +1096,17 @@ class TestGroups(TestCase):
         query = group0.get_objects_all_perms(TestModelChild, perms=['Perm1'], parent=['Perm4'])
         self.assertEqual(0, len(query))
         
-        # related field with multiple perms
+        # related field with multiple perms - the parent of child1 only has
+        # one of them
         query = group0.get_objects_all_perms(TestModelChild, perms=['Perm1'], parent=['Perm1','Perm2'])
-        self.assertEqual(1, len(query))
-        self.assertFalse(child0 in query)
+        self.assertEqual(0, len(query))
+        group0.grant('Perm2', object0)
+        query = group0.get_objects_all_perms(TestModelChild, perms=['Perm1'], parent=['Perm1','Perm2'])
+        self.assertEqual(2, len(query))
+        self.assertTrue(child0 in query)
         self.assertTrue(child1 in query)
         self.assertFalse(child2 in query)
+        group0.revoke('Perm2', object0)
         
         # multiple relations
         query = group0.get_objects_all_perms(TestModelChildChild, perms=['Perm1'], parent=['Perm1'], parent__parent=['Perm1'])
@@ -1126,6 +1143,125 @@ class TestGroups(TestCase):
         self.assertTrue(TestModel in perm_dict, perm_dict.keys())
         self.assertEqual(0, perm_dict[TestModel].count())
 
+    def test_user_group_ids(self):
+        """
+        Tests that group ids of users are cached until memberships change
+        """
+        if get_perm_cache() is not None:
+            # ids are also loaded from the shared cache
+            return
+        group0 = self.test_save('TestGroup0', user0)
+        group1 = self.test_save('TestGroup1')
+
+        self.assertEqual(frozenset([group0.pk]), get_user_group_ids(user0))
+        self.assertNumQueries(0, get_user_group_ids, user0)
+        self.assertEqual(frozenset(), get_user_group_ids(user1))
+        self.assertEqual(frozenset(), get_user_group_ids(User()))
+
+        user0.groups.add(group1)
+        self.assertEqual(frozenset([group0.pk, group1.pk]),
+                         get_user_group_ids(user0))
+        group1.user_set.remove(user0)
+        self.assertEqual(frozenset([group0.pk]), get_user_group_ids(user0))
+        group1.user_set.add(user0)
+        group1.delete()
+        self.assertEqual(frozenset([group0.pk]), get_user_group_ids(user0))
+        user0.groups.clear()
+        self.assertEqual(frozenset(), get_user_group_ids(user0))
+
+    def test_group_ids_checks(self):
+        """
+        Tests that group aware checks use the group ids instead of joining
+        group memberships
+        """
+        group0 = self.test_save('TestGroup0', user0)
+        group0.grant('Perm1', object0)
+        get_user_group_ids(user0)
+
+        self.assertNumQueries(1, user_has_any_perms, user0, object0, ['Perm1'])
+        self.assertTrue(user_has_any_perms(user0, object0, ['Perm1']))
+        self.assertTrue(user_has_all_perms(user0, TestModel, ['Perm1']))
+        self.assertFalse(user_has_any_perms(user0, object0, ['Perm1'], False))
+        self.assertFalse(user_has_any_perms(user1, object0, ['Perm1']))
+        self.assertEqual({object0:['Perm1']},
+                         get_user_perms_many(user0, [object0], 'only'))
+
+        query = str(permission_map[TestModel].objects \
+                    .filter(_user_clause(user0)).query)
+        self.assertFalse('auth_user_groups' in query, query)
+
+        group0.user_set.remove(user0)
+        self.assertFalse(user_has_any_perms(user0, object0, ['Perm1']))
+        self.assertEqual({object0:[]},
+                         get_user_perms_many(user0, [object0], 'only'))
+
+    def test_group_iter_objects_any_perms(self):
+        group0 = self.test_save('TestGroup0', user0)
+        group1 = self.test_save('TestGroup1', user1)
+        object2 = TestModel.objects.create(name='test2')
+        child = TestModelChild.objects.create(parent=object0)
+
+        group0.grant('Perm1', object0)
+        group0.grant('Perm2', object2)
+        group0.grant('Perm1', child)
+
+        pages = list(group0.iter_objects_any_perms(models=[TestModel], size=1))
+        self.assertEqual([(TestModel, [object0.pk]), (TestModel, [object2.pk])],
+                         pages)
+        pages = list(group0.iter_objects_any_perms(size=1, after=object0.pk,
+                                                   models=[TestModel,
+                                                           TestModelChild]))
+        self.assertEqual([(TestModel, [object2.pk]),
+                          (TestModelChild, [child.pk])], pages)
+        self.assertEqual([], list(group1.iter_objects_any_perms()))
+
+    def test_group_admin_counts(self):
+        """ admin counts of a list of groups are loaded with one query """
+        group0 = self.test_save('TestGroup0', user0)
+        group1 = self.test_save('TestGroup1')
+        self.test_save('TestGroup2')
+        user0.grant('admin', group0)
+        user1.grant('admin', group0)
+        user1.grant('admin', group1)
+
+        groups = Group.objects.order_by('name')
+        template = Template('{% load object_permission_tags %}'
+                            '{% load_group_admin_counts groups %}'
+                            '{% for group in groups %}'
+                            '{% number_group_admins group %},{% endfor %}')
+        self.assertNumQueries(2, template.render, Context({'groups':groups}))
+        self.assertEqual('2,1,0,', template.render(Context({
+            'groups':Group.objects.order_by('name')})))
+        self.assertEqual([2, 1, 0], [group.admin_count for group in groups])
+
+        # without loading the counts each group is counted on its own
+        self.assertEqual(1, number_group_admins(Group.objects.get(pk=group1.pk)))
+
+    def test_group_list_admin_counts(self):
+        """
+        the group list headers load the admin counts its rows display, a page
+        of groups takes one query for the groups and one for the counts
+        """
+        group0 = self.test_save('TestGroup0', user0)
+        group1 = self.test_save('TestGroup1')
+        self.test_save('TestGroup2')
+        user0.grant('admin', group0)
+        user1.grant('admin', group1)
+
+        template = Template(
+            '{% include "object_permissions/muddle/group/group_headers.html" %}'
+            '{% for group in groups %}'
+            '{% include "object_permissions/muddle/group/group_row.html" %}'
+            '{% endfor %}')
+        render = lambda: template.render(Context({
+            'groups':Group.objects.order_by('name')}))
+        self.assertNumQueries(2, render)
+        self.assertEqual(['1', '1', '0'],
+                         re.findall(r'<td>(\d+)</td>', render()))
+
+        # the headers render without a list of groups
+        self.assertTrue('<th>' in template.render(Context()))
+
 
 class TestGroupViews(TestCase):
 
@@ -1322,3 +1458,54 @@ class TestGroupViews(TestCase):
         response = c.get(url % group1.pk)
         self.assertEqual(200, response.status_code)
         self.assertTemplateUsed(response, 'object_permissions/permissions/objects.html')
+
+    def test_paged_permissions(self):
+        """ tests groups.paged_permissions() """
+        group = self.test_save()
+        group.user_set.add(user0)
+        group1 = self.test_save('other_group')
+        objects = [TestModel.objects.create(name='test%s' % i)
+                   for i in range(3)]
+        for object_ in objects:
+            group.grant('Perm1', object_)
+        
+        url = '/group/%s/permissions/all/paged'
+        c = Client()
+        
+        # unauthorized user - wrong group
+        self.assertTrue(c.login(username=user0.username, password='secret'))
+        response = c.get(url % group1.pk)
+        self.assertEqual(403, response.status_code)
+        
+        # authorized user - group member
+        response = c.get(url % group.pk)
+        self.assertEqual(200, response.status_code)
+        self.assertTemplateUsed(response, 'object_permissions/permissions/objects.html')
+        
+        # invalid page
+        response = c.get(url % group.pk,
+                         {'class_name':'TestModel', 'after':'abc'})
+        self.assertEqual(404, response.status_code)
+        
+        # rest returns the after parameter of the next page of each class
+        request = RequestFactory().get('/')
+        request.user = user0
+        data = views.paged_permissions(request, group.pk, rest=True,
+                                       per_page=2)
+        self.assertEqual(objects[:2], list(data['perm_dict']['TestModel']))
+        self.assertEqual(objects[1].pk, data['after']['TestModel'])
+        self.assertEqual(None, data['after']['TestModelChild'])
+        
+        request = RequestFactory().get('/', {'class_name':'TestModel',
+                                             'after':data['after']['TestModel']})
+        request.user = user0
+        data = views.paged_permissions(request, group.pk, rest=True,
+                                       per_page=2)
+        self.assertEqual(objects[2:], list(data['perm_dict']['TestModel']))
+        self.assertEqual({'TestModel':None}, data['after'])
+        
+        # rest on all_permissions still returns every object
+        request = RequestFactory().get('/')
+        request.user = user0
+        data = views.all_permissions(request, group.pk, rest=True)
+        self.assertEqual(set(objects), set(data['perm_dict']['TestModel']))
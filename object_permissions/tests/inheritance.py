@@ -0,0 +1,163 @@
+from django.contrib.auth.models import User, Group
+from django.test import TestCase
+
+from object_permissions import *
+from object_permissions.registration import TestModel, \
+    TestModelInheritChild, TestModelInheritChildChild, TestModelChild, \
+    QUERY_STRATEGIES, RegistrationException, _inherited, inherit_map, params_for_model, \
+    user_has_perm, group_has_perm, get_user_perms_any, \
+    user_get_objects_any_perms, user_get_objects_all_perms, \
+    group_get_objects_any_perms, group_get_objects_all_perms
+
+
+class TestInheritance(TestCase):
+    """ tests for models registered with params['inherit_from'] """
+
+    def setUp(self):
+        self.tearDown()
+        self.user = User.objects.create(id=2, username='tester')
+        self.member = User.objects.create(id=3, username='tester2')
+        self.group = Group.objects.create(name='testers')
+        self.group.user_set.add(self.member)
+        self.object = TestModel.objects.create(name='test0')
+        self.other = TestModel.objects.create(name='test1')
+        self.child = TestModelInheritChild.objects.create(parent=self.object)
+        self.orphan = TestModelInheritChild.objects.create()
+        self.childchild = TestModelInheritChildChild.objects.create(
+            parent=self.child)
+
+    def tearDown(self):
+        TestModel.objects.all().delete()
+        TestModelInheritChild.objects.all().delete()
+        TestModelInheritChildChild.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def test_chain(self):
+        """ ancestors are resolved from inherit_from """
+        self.assertEqual([], _inherited(TestModel))
+        self.assertEqual([('parent', TestModel)],
+                         _inherited(TestModelInheritChild))
+        self.assertEqual([('parent', TestModelInheritChild),
+                          ('parent__parent', TestModel)],
+                         _inherited(TestModelInheritChildChild))
+
+    def test_invalid_chain(self):
+        """ inherit_from must name a ForeignKey to a registered model """
+        params = params_for_model[TestModelChild]
+        inherit_map.clear()
+        try:
+            params['inherit_from'] = 'name'
+            self.assertRaises(RegistrationException, _inherited,
+                              TestModelChild)
+            params['inherit_from'] = 'id'
+            self.assertRaises(RegistrationException, _inherited,
+                              TestModelChild)
+            params['inherit_from'] = 'parent'
+            self.assertEqual([('parent', TestModel)], _inherited(TestModelChild))
+        finally:
+            del params['inherit_from']
+            inherit_map.clear()
+
+    def test_user_perms(self):
+        """ users have the perms granted on ancestors """
+        user, child, childchild = self.user, self.child, self.childchild
+        user.grant('Perm1', self.object)
+        user.grant('Perm4', self.object)
+        user.grant('Perm2', child)
+        childchild.save()
+
+        self.assertTrue(user_has_perm(user, 'Perm1', child))
+        self.assertTrue(user_has_perm(user, 'Perm1', childchild))
+        self.assertTrue(user_has_perm(user, 'Perm2', childchild))
+        self.assertFalse(user_has_perm(user, 'Perm3', childchild))
+        self.assertFalse(user_has_perm(user, 'Perm1', self.orphan))
+        self.assertFalse(user_has_perm(user, 'Perm2', self.object))
+
+        # Perm4 is not registered for the children
+        self.assertEqual(set(['Perm1', 'Perm2']),
+                         set(get_user_perms(user, childchild)))
+        self.assertEqual(set(['Perm1', 'Perm2']),
+                         set(get_user_perms(user, child)))
+        self.assertTrue(user.has_any_perms(childchild, ['Perm1', 'Perm3']))
+        self.assertTrue(user.has_all_perms(childchild, ['Perm1', 'Perm2']))
+        self.assertFalse(user.has_all_perms(child, ['Perm1', 'Perm3']))
+
+        perms = get_user_perms_many(user, [child, self.orphan, childchild])
+        self.assertEqual(set(['Perm1', 'Perm2']), set(perms[child]))
+        self.assertEqual([], perms[self.orphan])
+        self.assertEqual(set(['Perm1', 'Perm2']), set(perms[childchild]))
+
+        prefetch_perms(user, [childchild])
+        self.assertNumQueries(0, get_user_perms, user, childchild)
+        self.assertEqual(set(['Perm1', 'Perm2']),
+                         set(get_user_perms(user, childchild)))
+
+    def test_group_perms(self):
+        """ perms granted to groups are inherited for groups and members """
+        group, member, childchild = self.group, self.member, self.childchild
+        group.grant('Perm1', self.object)
+        group.grant('Perm3', self.child)
+
+        self.assertTrue(group_has_perm(group, 'Perm1', childchild))
+        self.assertEqual(set(['Perm1', 'Perm3']),
+                         set(get_group_perms(group, childchild)))
+        self.assertTrue(user_has_perm(member, 'Perm1', childchild))
+        self.assertFalse(user_has_perm(member, 'Perm1', childchild, False))
+        self.assertEqual(set(['Perm1', 'Perm3']),
+                         set(get_user_perms(member, childchild)))
+        self.assertTrue(group.has_all_perms(childchild, ['Perm1', 'Perm3']))
+
+    def test_get_objects(self):
+        """ object filtering includes inherited perms """
+        user, group, child = self.user, self.group, self.child
+        childchild = self.childchild
+        user.grant('Perm1', self.object)
+        user.grant('Perm2', child)
+        group.grant('Perm3', self.object)
+
+        for strategy in QUERY_STRATEGIES:
+            query = user_get_objects_any_perms(user, TestModelInheritChild,
+                                               ['Perm1'], strategy=strategy)
+            self.assertEqual([child], list(query))
+            query = user_get_objects_any_perms(user,
+                TestModelInheritChildChild, ['Perm1'], strategy=strategy)
+            self.assertEqual([childchild], list(query))
+            query = user_get_objects_all_perms(user,
+                TestModelInheritChildChild, ['Perm1', 'Perm2'],
+                strategy=strategy)
+            self.assertEqual([childchild], list(query))
+            query = user_get_objects_all_perms(user, TestModelInheritChild,
+                ['Perm1', 'Perm3'], strategy=strategy)
+            self.assertEqual([], list(query))
+            query = group_get_objects_any_perms(group,
+                TestModelInheritChildChild, strategy=strategy)
+            self.assertEqual([childchild], list(query))
+            query = group_get_objects_all_perms(group,
+                TestModelInheritChildChild, ['Perm3'], strategy=strategy)
+            self.assertEqual([childchild], list(query))
+
+        self.assertEqual([childchild], list(user_get_objects_any_perms(
+            self.member, TestModelInheritChildChild, ['Perm3'])))
+        self.assertEqual([], list(user_get_objects_any_perms(
+            user, TestModelInheritChildChild, ['Perm3'])))
+        group.user_set.add(user)
+        self.assertEqual([childchild], list(user_get_objects_any_perms(
+            user, TestModelInheritChildChild, ['Perm3'])))
+        self.assertEqual([], list(user_get_objects_any_perms(
+            user, TestModelInheritChildChild, ['Perm3'], False)))
+
+    def test_fixed_queries(self):
+        """ checks need a fixed number of queries """
+        if get_perm_cache() is not None:
+            # perms are loaded into the shared cache instead
+            return
+        user, childchild = self.user, self.childchild
+        user.grant('Perm1', self.object)
+        get_user_group_ids(user)
+        self.assertNumQueries(1, user_has_perm, user, 'Perm1', childchild)
+        self.assertNumQueries(1, user_has_perm, user, 'Perm2', childchild)
+        # own perms, ancestors, and one query per ancestor model
+        self.assertNumQueries(4, get_user_perms, user, childchild)
+        self.assertNumQueries(4, get_user_perms_many, user,
+            [childchild, TestModelInheritChildChild.objects.create()])
@@ -0,0 +1,140 @@
+from django.contrib.auth.models import User, Group
+from django.db import connection
+from django.test import TestCase
+
+from object_permissions import *
+from object_permissions.registration import TestModel, TestModelChild, \
+    UnknownPermissionException, user_has_perm, user_get_objects_any_perms
+
+
+class TestInstrumentation(TestCase):
+    """ tests for reporting API calls to a Collector """
+
+    def setUp(self):
+        self.tearDown()
+        self.collector = StatsCollector()
+        set_collector(self.collector)
+        self.user = User.objects.create(id=2, username='tester')
+        self.group = Group.objects.create(name='testers')
+        self.object = TestModel.objects.create(name='test0')
+        self.child = TestModelChild.objects.create(parent=self.object)
+
+    def tearDown(self):
+        set_collector(None)
+        TestModel.objects.all().delete()
+        TestModelChild.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def test_disabled(self):
+        """ nothing is recorded without a collector """
+        set_collector(None)
+        self.user.grant('Perm1', self.child)
+        self.assertEqual({}, self.collector.stats)
+        self.assertEqual(None, get_collector())
+
+    def test_record(self):
+        """ calls, time and queries are recorded per function and model """
+        user, child = self.user, self.child
+        user.grant('Perm1', child)
+        user_has_perm(user, 'Perm1', child)
+        self.assertTrue(user.has_object_perm('Perm1', child))
+        self.group.grant('Perm2', self.object)
+        get_users_any(self.object, ['Perm2'])
+        user_get_objects_any_perms(user, TestModel, ['Perm1'])
+        get_object_perms(child)
+
+        stats = self.collector.stats
+        self.assertEqual(2, stats[('user_has_perm', TestModelChild)]['calls'])
+        self.assertTrue(stats[('user_has_perm', TestModelChild)]['queries']
+                        >= 1)
+        self.assertTrue(stats[('user_has_perm', TestModelChild)]['time'] > 0)
+        self.assertEqual(1, stats[('grant', TestModelChild)]['calls'])
+        self.assertEqual(1, stats[('grant_group', TestModel)]['calls'])
+        self.assertEqual(1, stats[('get_users_any', TestModel)]['calls'])
+        self.assertEqual(1, stats[('user_get_objects_any_perms', TestModel)]
+                            ['calls'])
+        self.assertEqual(1, stats[('get_object_perms', TestModelChild)]
+                            ['calls'])
+        self.assertEqual(1, stats[('get_object_perms', TestModelChild)]
+                            ['queries'])
+
+        self.assertEqual(2, self.collector.by_function()['user_has_perm']
+                            ['calls'])
+        self.assertEqual(3, self.collector.by_model()[TestModel]['calls'])
+        self.collector.reset()
+        self.assertEqual({}, self.collector.stats)
+
+    def test_nested(self):
+        """ only the outermost call is recorded """
+        user, child = self.user, self.child
+        user.grant('Perm1', child)
+        set_user_perms(user, ['Perm2'], child)
+        bulk_grant([user], ['Perm3'], TestModelChild.objects.all())
+        self.assertEqual(['set_user_perms'], [function for function, model
+            in self.collector.stats if function.startswith('set')])
+        self.assertFalse(('revoke_all', TestModelChild) in
+                         self.collector.stats)
+        self.assertEqual(1, self.collector.stats[('bulk_grant',
+                                                  TestModelChild)]['calls'])
+
+    def test_exception(self):
+        """ failing calls are recorded and queries are not kept """
+        query_count = len(connection.queries)
+        self.assertRaises(UnknownPermissionException, self.user.grant,
+                          'DoesNotExist', self.child)
+        self.assertEqual(1, self.collector.stats[('grant', TestModelChild)]
+                            ['calls'])
+        self.assertEqual(query_count, len(connection.queries))
+
+    def test_generator(self):
+        """
+        generators are recorded once, with the queries run while they are
+        iterated
+        """
+        user, group = self.user, self.group
+        user.grant('Perm1', self.object)
+        group.grant('Perm1', self.child)
+        pages = user.iter_objects_any_perms(models=[TestModel])
+        self.assertFalse(('user_iter_objects_any_perms', None) in
+                         self.collector.stats)
+        self.assertEqual([(TestModel, [self.object.pk])], list(pages))
+        stats = self.collector.stats[('user_iter_objects_any_perms', None)]
+        self.assertEqual(1, stats['calls'])
+        self.assertTrue(stats['queries'] >= 1)
+        self.assertFalse(('user_get_objects_any_perms', TestModel) in
+                         self.collector.stats)
+
+        # calls between steps are recorded, closing the generator records it
+        pages = group.iter_objects_any_perms(models=[TestModelChild],
+                                             size=1)
+        pages.next()
+        group.grant('Perm2', self.child)
+        pages.close()
+        self.assertEqual(2, self.collector.stats[('grant_group',
+                                                  TestModelChild)]['calls'])
+        self.assertEqual(1, self.collector.stats[
+            ('group_iter_objects_any_perms', None)]['calls'])
+
+    def test_loader(self):
+        """ PermissionLoader methods are recorded, dispatching once """
+        user, child = self.user, self.child
+        user.grant('Perm1', child)
+        loader = PermissionLoader()
+        checks = [loader.has_perm(user, 'Perm1', child),
+                  loader.get_perms(user, self.object)]
+        self.assertEqual([True, []], [bool(checks[0]), checks[1].get()])
+
+        stats = self.collector.stats
+        self.assertEqual(1, stats[('PermissionLoader.has_perm',
+                                   TestModelChild)]['calls'])
+        self.assertEqual(0, stats[('PermissionLoader.has_perm',
+                                   TestModelChild)]['queries'])
+        self.assertEqual(1, stats[('PermissionLoader.get_perms', TestModel)]
+                            ['calls'])
+        self.assertEqual(1, stats[('PermissionLoader.dispatch', None)]
+                            ['calls'])
+        self.assertTrue(stats[('PermissionLoader.dispatch', None)]['queries']
+                        >= 1)
+        self.assertFalse('get_user_perms_many' in
+                         self.collector.by_function())
@@ -0,0 +1,164 @@
+from StringIO import StringIO
+from threading import Thread
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User, Group
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import CharField, Model
+from django.db.models.loading import cache
+from django.test import TestCase
+
+from object_permissions import *
+from object_permissions import registration
+from object_permissions.registration import class_names, effective_map, \
+    params_for_model, permission_map, \
+    permissions_for_model, registration_times, _built_while_deleting, \
+    _pending
+
+
+class TestLazyModels(TestCase):
+    """ tests for building permission models on first access """
+
+    def setUp(self):
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        settings.OBJECT_PERMISSIONS_LAZY_MODELS = True
+        self.model = type('LazyModel', (Model,), {
+            '__module__':'object_permissions.models',
+            'name':CharField(max_length=32),
+        })
+        register(['Perm1', 'Perm2'], self.model, 'object_permissions')
+        self.user = User.objects.create(id=2, username='tester')
+        self.group = Group.objects.create(name='testers')
+
+    def tearDown(self):
+        del settings.OBJECT_PERMISSIONS_LAZY_MODELS
+        self.unbuild()
+        for mapping in (_pending, params_for_model, permissions_for_model,
+                        registration_times):
+            mapping.pop(self.model, None)
+        _built_while_deleting.clear()
+        del class_names[self.model.__name__]
+        cache.app_models['object_permissions'].pop('lazymodel')
+        cache._get_models_cache.clear()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def unbuild(self):
+        """ remove the permission model, as if registered by a new process """
+        dict.pop(permission_map, self.model, None)
+        _pending[self.model] = 'object_permissions'
+        cache.app_models['object_permissions'].pop('lazymodel_perms', None)
+        cache._get_models_cache.clear()
+        for opts in (self.model._meta, User._meta, Group._meta):
+            for name in ('_related_objects_cache', '_name_map'):
+                opts.__dict__.pop(name, None)
+
+    def create_tables(self):
+        """ create tables of the lazy model and its permission model """
+        cursor = connection.cursor()
+        tables = connection.introspection.table_names()
+        for model in (self.model, permission_map[self.model]):
+            if model._meta.db_table in tables:
+                # sqlite commits tables created by earlier tests
+                continue
+            for sql in connection.creation.sql_create_model(model,
+                                                            no_style())[0]:
+                cursor.execute(sql)
+
+    def test_lazy(self):
+        """ permission models are built on first access """
+        model = self.model
+        self.assertTrue(model in _pending)
+        self.assertEqual(['Perm1', 'Perm2'], sorted(get_model_perms(model)))
+        self.assertFalse(dict.__contains__(permission_map, model))
+        self.assertFalse(model in effective_map)
+        self.assertTrue(model in _pending)
+
+        # the relations to the permission table work once it is built
+        perm_model = permission_map[model]
+        self.assertFalse(model in _pending)
+        self.assertEqual('LazyModel_Perms', perm_model.__name__)
+        str(model.objects.filter(operms__user=self.user).query)
+        str(User.objects.filter(LazyModel_uperms__Perm1=True).query)
+
+        report = get_registration_report()
+        self.assertEqual(report['registered'],
+                         report['built'] + report['pending'])
+        times = report['models']['object_permissions.LazyModel']
+        self.assertTrue(times['register'] > 0 and times['build'] > 0)
+        out = StringIO()
+        call_command('registration_report', verbosity=2, stdout=out)
+        self.assertTrue('object_permissions.LazyModel' in out.getvalue())
+
+    def test_build_all(self):
+        """ build_perm_models() and iterating build all pending models """
+        self.assertEqual([self.model], build_perm_models())
+        self.assertEqual([], build_perm_models())
+
+        self.unbuild()
+        self.assertTrue(self.model in permission_map.keys())
+        self.assertFalse(_pending)
+
+    def test_threads(self):
+        """ threads looking up a pending model at once build it once """
+        built, found = [], []
+        build_perm_models = registration._build_perm_models
+        def slow_build(*args):
+            built.append(args[0])
+            time.sleep(0.05)
+            return build_perm_models(*args)
+        def lookup():
+            try:
+                found.append(permission_map[self.model])
+            except Exception as e:
+                found.append(e)
+
+        registration._build_perm_models = slow_build
+        try:
+            threads = [Thread(target=lookup) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            registration._build_perm_models = build_perm_models
+        self.assertEqual([self.model], built)
+        self.assertEqual([dict.__getitem__(permission_map, self.model)] * 4,
+                         found)
+        self.assertFalse(self.model in _pending)
+
+    def test_permissions(self):
+        """ the permission functions build the model """
+        user, group = self.user, self.group
+        self.create_tables()
+        obj = self.model.objects.create(name='test')
+        self.unbuild()
+        self.assertEqual([], list(user.get_objects_any_perms(self.model)))
+
+        self.unbuild()
+        user.grant('Perm1', obj)
+        group.grant('Perm2', obj)
+        self.assertTrue(user.has_object_perm('Perm1', obj))
+        self.assertEqual([obj], list(user.get_objects_any_perms(self.model)))
+        self.assertEqual([group], list(get_groups(obj)))
+
+    def test_delete(self):
+        """ rows are deleted with objects when the model is built late """
+        self.create_tables()
+        obj = self.model.objects.create(name='test')
+        self.user.grant('Perm1', obj)
+        self.group.grant('Perm2', obj)
+
+        self.unbuild()
+        self.user.delete()
+        self.assertFalse(self.model in _pending)
+        perm_model = permission_map[self.model]
+        self.assertEqual(1, perm_model.objects.count())
+        self.unbuild()
+        self.model.objects.all().delete()
+        perm_model = permission_map[self.model]
+        self.assertFalse(perm_model.objects.exists())
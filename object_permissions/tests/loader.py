@@ -0,0 +1,88 @@
+from django.contrib.auth.models import User, Group
+from django.test import TestCase
+
+from object_permissions import *
+from object_permissions.registration import TestModel, TestModelChild, \
+    TestModelInheritChild
+
+
+class TestPermissionLoader(TestCase):
+    """ tests for batching permission checks with PermissionLoader """
+
+    def setUp(self):
+        self.tearDown()
+        self.user0 = User.objects.create(id=2, username='tester')
+        self.user1 = User.objects.create(id=3, username='tester2')
+        self.group = Group.objects.create(name='testers')
+        self.group.user_set.add(self.user1)
+        self.objects = [TestModel.objects.create(name='test%s' % i)
+                        for i in range(5)]
+        self.child = TestModelChild.objects.create(parent=self.objects[0])
+
+    def tearDown(self):
+        TestModel.objects.all().delete()
+        TestModelChild.objects.all().delete()
+        TestModelInheritChild.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def test_batched(self):
+        """ queued checks are answered with one query per model """
+        user0, objects, child = self.user0, self.objects, self.child
+        user0.grant('Perm1', objects[1])
+        user0.grant('Perm2', objects[3])
+        user0.grant('Perm1', child)
+
+        loader = PermissionLoader()
+        checks = [loader.has_perm(user0, 'Perm1', obj) for obj in objects]
+        perms = loader.get_perms(user0, child)
+        get_user_group_ids(user0)
+        self.assertNumQueries(2, bool, checks[0])
+        self.assertNumQueries(0, lambda: [bool(check) for check in checks])
+        self.assertEqual([False, True, False, False, False],
+                         [bool(check) for check in checks])
+        self.assertEqual(['Perm1'], perms.get())
+
+        # answered checks are not loaded again, other instances of an object
+        # share its answer
+        obj = TestModel.objects.get(pk=objects[3].pk)
+        self.assertNumQueries(0, lambda: loader.get_perms(user0, obj).get())
+        self.assertEqual(['Perm2'], loader.get_perms(user0, obj).get())
+        self.assertFalse(loader.has_perm(user0, 'Foo', obj))
+
+    def test_groups(self):
+        """ users and the groups flag are answered separately """
+        user0, user1, group = self.user0, self.user1, self.group
+        obj = self.objects[0]
+        group.grant('Perm3', obj)
+        user0.grant('Perm1', obj)
+
+        loader = PermissionLoader()
+        checks = [loader.has_perm(user1, 'Perm3', obj),
+                  loader.has_perm(user1, 'Perm3', obj, groups=False),
+                  loader.has_perm(user0, 'Perm3', obj),
+                  loader.has_perm(user0, 'Perm1', obj)]
+        self.assertEqual([True, False, False, True],
+                         [bool(check) for check in checks])
+
+    def test_inherited(self):
+        """ perms inherited from ancestors are included """
+        user0 = self.user0
+        child = TestModelInheritChild.objects.create(parent=self.objects[0])
+        user0.grant('Perm2', self.objects[0])
+        self.assertTrue(PermissionLoader().has_perm(user0, 'Perm2', child))
+
+    def test_stale(self):
+        """ answers are reloaded after permissions change """
+        user0, objects = self.user0, self.objects
+        loader = PermissionLoader()
+        checks = [loader.has_perm(user0, 'Perm1', obj) for obj in objects]
+        self.assertFalse(checks[0])
+
+        user0.grant('Perm1', objects[0])
+        user0.grant('Perm1', objects[4])
+        self.assertNumQueries(1, bool, checks[0])
+        self.assertNumQueries(0, bool, checks[4])
+        self.assertTrue(checks[0])
+        self.assertTrue(checks[4])
+        self.assertFalse(checks[1])
@@ -1,11 +1,19 @@
 
 from django.contrib.auth.models import User, Group
+from django.core.exceptions import FieldError
+from django.db import IntegrityError, connection
 from django.test import TestCase
-from django.test.client import Client
+from django.test.client import Client, RequestFactory
 
 from object_permissions import *
+from object_permissions import registration
 from object_permissions.registration import TestModel, TestModelChild, \
-    TestModelChildChild, UnknownPermissionException
+    TestModelChildChild, UnknownPermissionException, user_has_perm, \
+    group_has_perm, permission_map, perm_index_sql
+from object_permissions.signals import granted
+from object_permissions.templatetags.object_permission_tags import \
+    permissions
+from object_permissions.views import permissions as views
 from object_permissions.views.permissions import ObjectPermissionForm, \
     ObjectPermissionFormNewUsers
 
@@ -78,6 +86,24 @@ class TestModelPermissions(TestCase):
         self.assertTrue('Perm3' in perms2)
         self.assertTrue('Perm4' in perms2)
 
+    def test_perm_table_constraints(self):
+        """
+        Test unique constraints and extra indexes of permission tables
+        """
+        statements = perm_index_sql(TestModel)
+        self.assertEqual(1, len(statements))
+        self.assertTrue('obj_id' in statements[0])
+        self.assertTrue('Perm1' in statements[0])
+        self.assertEqual([], perm_index_sql(TestModelChild))
+
+        permissions = permission_map[TestModel]
+        permissions.objects.create(user=user0, obj=object0)
+        permissions.objects.create(group=group, obj=object0)
+        self.assertRaises(IntegrityError, permissions.objects.create,
+                          user=user0, obj=object0)
+        self.assertRaises(IntegrityError, permissions.objects.create,
+                          group=group, obj=object0)
+
     def test_grant_user_permissions(self):
         """
         Grant a user permissions
@@ -140,6 +166,99 @@ class TestModelPermissions(TestCase):
             grant(user1, 'UnknownPerm', object0)
         self.assertRaises(UnknownPermissionException, grant_unknown)
     
+    def test_grant_upsert(self):
+        """
+        Tests writing permission rows with and without upsert support
+
+        Verifies:
+            * grant is a single query when upserts are supported
+            * a perm that was already granted is not reported as changed
+            * set_perms replaces existing perms
+            * no duplicate rows are created
+        """
+        child = TestModelChild.objects.create()
+        upsert_supported = registration._upsert_supported
+        supported = upsert_supported(TestModelChild, 'user') \
+            and upsert_supported(TestModelChild, 'group')
+        try:
+            for upsert in (True, False):
+                if upsert and not supported:
+                    continue
+                registration._upsert_supported = lambda model, field: upsert
+                signals = []
+                def receiver(sender, perm, object, **kwargs):
+                    signals.append((sender, perm))
+                granted.connect(receiver)
+
+                if upsert:
+                    self.assertNumQueries(1, grant, user0, 'Perm1', child)
+                else:
+                    grant(user0, 'Perm1', child)
+                grant(user0, 'Perm1', child)
+                grant(user0, 'Perm2', child)
+                group.grant('Perm1', child)
+                granted.disconnect(receiver)
+                self.assertEqual([(user0, 'Perm1'), (user0, 'Perm2'),
+                                  (group, 'Perm1')], signals)
+                self.assertEqual(set(['Perm1', 'Perm2']),
+                                 set(user0.get_perms(child)))
+
+                user0.set_perms(['Perm3'], child)
+                self.assertEqual(['Perm3'], user0.get_perms(child, False))
+                group.set_perms(['Perm2', 'Perm4'], child)
+                self.assertEqual(set(['Perm2', 'Perm4']),
+                                 set(group.get_perms(child)))
+                self.assertEqual(2, permission_map[TestModelChild].objects \
+                                 .filter(obj=child).count())
+                user0.revoke_all(child)
+                group.revoke_all(child)
+        finally:
+            registration._upsert_supported = upsert_supported
+
+    def test_upsert_supported(self):
+        """
+        Tests that upserts are only used on tables with unique constraints
+
+        Verifies:
+            * the unique constraints of permission tables are found
+            * tables without the constraints are not upserted
+            * the result is cached per table and field
+        """
+        table = permission_map[TestModelChild]
+        if connection.vendor in ('sqlite', 'postgresql'):
+            self.assertTrue(registration._has_unique_constraint(table,
+                                                        ['user', 'obj']))
+            self.assertTrue(registration._has_unique_constraint(table,
+                                                        ['group', 'obj']))
+        self.assertFalse(registration._has_unique_constraint(table,
+                                                             ['user', 'Perm1']))
+        self.assertFalse(registration._has_unique_constraint(table, ['obj']))
+
+        has_unique_constraint = registration._has_unique_constraint
+        upsert_tables = registration._upsert_tables.copy()
+        checked = []
+        def no_constraint(table, fields):
+            checked.append(fields)
+            return False
+        registration._has_unique_constraint = no_constraint
+        registration._upsert_tables.clear()
+        try:
+            self.assertFalse(registration._upsert_supported(TestModelChild,
+                                                            'user'))
+            self.assertFalse(registration._upsert_supported(TestModelChild,
+                                                            'user'))
+            self.assertTrue(len(checked) <= 1)
+
+            # grants fall back to updates and inserts
+            child = TestModelChild.objects.create()
+            grant(user0, 'Perm1', child)
+            user0.set_perms(['Perm2'], child)
+            self.assertEqual(['Perm2'], user0.get_perms(child, False))
+        finally:
+            registration._has_unique_constraint = has_unique_constraint
+            registration._upsert_tables.clear()
+            registration._upsert_tables.update(upsert_tables)
+
     def test_revoke_user_permissions(self):
         """
         Test revoking permissions from users
@@ -340,7 +459,70 @@ class TestModelPermissions(TestCase):
         perms = user0.get_perms_any(TestModel)
         self.assertEqual(3, len(perms))
         self.assertEqual(set(['Perm1', 'Perm3', 'Perm4']), set(perms))
-    
+
+    def test_prefetch_perms(self):
+        """
+        tests loading perms for many objects at once
+
+        Verifies:
+            * perms for all objects are loaded with one query
+            * prefetched perms are used for user and user+group lookups
+            * prefetched perms are not used for other users
+            * prefetched perms are discarded when perms change
+        """
+        grant(user0, 'Perm1', object0)
+        grant(user0, 'Perm2', object1)
+        group.grant('Perm3', object1)
+
+        # one query for the objects and one for the perms
+        get_user_group_ids(user0)
+        objects = TestModel.objects.all()
+        self.assertNumQueries(2, prefetch_perms, user0, objects)
+
+        def check():
+            object0, object1 = objects
+            self.assertEqual(['Perm1'], get_user_perms(user0, object0))
+            self.assertEqual(set(['Perm2', 'Perm3']),
+                             set(get_user_perms(user0, object1)))
+            self.assertEqual(['Perm2'], permissions(user0, object1))
+            self.assertTrue(user_has_perm(user0, 'Perm3', object1))
+            self.assertFalse(user_has_perm(user0, 'Perm3', object1, False))
+        self.assertNumQueries(0, check)
+
+        # other users are not answered from the prefetched perms
+        self.assertEqual([], get_user_perms(user1, objects[0]))
+
+        # changes are visible
+        revoke(user0, 'Perm1', objects[0])
+        self.assertEqual([], get_user_perms(user0, objects[0]))
+
+    def test_get_user_perms_many(self):
+        """
+        tests loading perms for many objects with one query per model
+        """
+        child = TestModelChild.objects.create(parent=object0)
+        grant(user0, 'Perm1', object0)
+        group.grant('Perm2', object0)
+        group.grant('Perm3', object1)
+        grant(user0, 'Perm4', child)
+        objects = [object0, object1, child, user1]
+
+        get_user_group_ids(user0)
+        self.assertNumQueries(2, get_user_perms_many, user0, objects)
+        perms = get_user_perms_many(user0, objects)
+        self.assertEqual(set(['Perm1', 'Perm2']), set(perms[object0]))
+        self.assertEqual(['Perm3'], perms[object1])
+        self.assertEqual(['Perm4'], perms[child])
+        self.assertEqual([], perms[user1])
+
+        perms = get_user_perms_many(user0, objects, False)
+        self.assertEqual(['Perm1'], perms[object0])
+        self.assertEqual([], perms[object1])
+
+        perms = get_user_perms_many(user0, objects, 'only')
+        self.assertEqual(['Perm2'], perms[object0])
+        self.assertEqual([], perms[child])
+
     def test_get_users(self):
         """
         Tests retrieving list of users with perms on an object
@@ -774,18 +956,84 @@ class TestModelPermissions(TestCase):
         query = user0.get_objects_all_perms(TestModelChild, perms=['Perm1'], parent=['Perm4'])
         self.assertEqual(0, len(query))
         
-        # related field with multiple perms
+        # related field with multiple perms - the parent of child1 only has
+        # one of them
         query = user0.get_objects_all_perms(TestModelChild, perms=['Perm1'], parent=['Perm1','Perm2'])
-        self.assertEqual(1, len(query))
-        self.assertFalse(child0 in query)
+        self.assertEqual(0, len(query))
+        user0.grant('Perm2', object0)
+        query = user0.get_objects_all_perms(TestModelChild, perms=['Perm1'], parent=['Perm1','Perm2'])
+        self.assertEqual(2, len(query))
+        self.assertTrue(child0 in query)
         self.assertTrue(child1 in query)
         self.assertFalse(child2 in query)
+        user0.revoke('Perm2', object0)
         
         # multiple relations
         query = user0.get_objects_all_perms(TestModelChildChild, perms=['Perm1'], parent=['Perm1'], parent__parent=['Perm1'])
         self.assertEqual(1, len(query))
         self.assertTrue(childchild in query)
     
+    def test_get_objects_strategies(self):
+        """
+        Test that all query strategies return the same objects, without
+        duplicates, and can be ordered and chained
+        """
+        object2 = TestModel.objects.create(name='test2')
+        child0 = TestModelChild.objects.create(parent=object0)
+        child1 = TestModelChild.objects.create(parent=object1)
+        child2 = TestModelChild.objects.create(parent=object1)
+
+        user0.grant('Perm1', object0)
+        user0.grant('Perm2', object0)
+        user0.grant('Perm1', object2)
+        group.grant('Perm1', object0)
+        group.grant('Perm2', object1)
+        user0.grant('Perm3', child0)
+        user0.grant('Perm3', child2)
+        group.grant('Perm4', child2)
+        group.grant('admin', group)
+
+        queries = [
+            (user0.get_objects_any_perms, (TestModel,), {}),
+            (user0.get_objects_any_perms, (TestModel, ['Perm1']), {}),
+            (user0.get_objects_any_perms, (TestModel, ['Perm2']), {'groups':False}),
+            (user0.get_objects_any_perms, (TestModelChild, ['Perm4']), {'parent':['Perm2']}),
+            (user0.get_objects_all_perms, (TestModel, ['Perm1', 'Perm2']), {}),
+            (user0.get_objects_all_perms, (TestModelChild, ['Perm3']), {'parent':['Perm2']}),
+            (user0.get_objects_any_perms, (Group, ['admin']), {}),
+            (user0.get_objects_all_perms, (Group, ['admin']), {}),
+            (group.get_objects_any_perms, (TestModel, ['Perm2']), {}),
+            (group.get_objects_any_perms, (TestModelChild,), {'parent':None}),
+            (group.get_objects_all_perms, (TestModel, ['Perm1']), {}),
+        ]
+        for function, args, kwargs in queries:
+            expected = list(function(*args, **kwargs).order_by('pk'))
+            self.assertTrue(expected)
+            for strategy in ('in', 'exists'):
+                query = function(strategy=strategy, *args, **kwargs)
+                self.assertEqual(expected, list(query.order_by('pk')))
+                self.assertFalse(query.query.distinct)
+
+        # a group with perms on another group, subqueries must stay
+        # correlated with the outer Group
+        member = User.objects.create(username='member')
+        group1 = Group.objects.create(name='group1')
+        group2 = Group.objects.create(name='group2')
+        group1.user_set.add(member)
+        group1.grant('admin', group2)
+        for function in (member.get_objects_any_perms,
+                         member.get_objects_all_perms):
+            for strategy in registration.QUERY_STRATEGIES:
+                query = function(Group, ['admin'], strategy=strategy)
+                self.assertEqual([group2], list(query))
+
+        query = user0.get_objects_any_perms(TestModel, strategy='exists')
+        self.assertEqual([object2, object1, object0], list(query.order_by('-name')))
+        self.assertEqual([object1], list(query.filter(name='test1')))
+        self.assertEqual(3, query.count())
+        self.assertRaises(ValueError, user0.get_objects_any_perms, TestModel,
+                          strategy='foo')
+
     def test_get_all_objects_any_perms(self):
         """
         Test retrieving all objects from all models
@@ -844,6 +1092,39 @@ class TestModelPermissions(TestCase):
         self.assertFalse(object2 in perm_dict[TestModel])
         self.assertFalse(object3 in perm_dict[TestModel])
         self.assertFalse(object4 in perm_dict[TestModel])
+
+    def test_iter_objects_any_perms(self):
+        """
+        Test iterating the objects of all models a page at a time
+        """
+        objects = [object0, object1] + [TestModel.objects.create(name='test%s' % i)
+                                        for i in range(2, 7)]
+        child = TestModelChild.objects.create(parent=object0)
+        for obj in objects[:5]:
+            user0.grant('Perm1', obj)
+        user0.grant('Perm2', objects[0])
+        user0.grant('Perm1', child)
+        group.set_perms(['Perm1'], objects[4])
+        group.set_perms(['Perm3'], objects[5])
+        pks = [obj.pk for obj in objects]
+
+        # pages of each model, objects with several perms are listed once
+        pages = list(user0.iter_objects_any_perms(models=[TestModel], size=2))
+        self.assertEqual([(TestModel, pks[0:2]), (TestModel, pks[2:4]),
+                          (TestModel, pks[4:6])], pages)
+        pages = list(user0.iter_objects_any_perms(groups=False, size=5))
+        self.assertTrue((TestModel, pks[:5]) in pages, pages)
+        self.assertTrue((TestModelChild, [child.pk]) in pages, pages)
+        self.assertFalse(TestModelChildChild in [model for model, page in pages])
+
+        # resuming after a key
+        pages = list(user0.iter_objects_any_perms(models=[TestModel, TestModelChild],
+                                                  size=10, after=pks[3]))
+        self.assertEqual([(TestModel, pks[4:6]), (TestModelChild, [child.pk])],
+                         pages)
+        self.assertEqual([(TestModel, [pks[5]])], list(group.iter_objects_any_perms(
+            models=[TestModel], after=pks[4])))
+        self.assertEqual([], list(user1.iter_objects_any_perms()))
     
     def test_has_any_on_model(self):
         """
@@ -1050,6 +1331,92 @@ class TestModelPermissions(TestCase):
         # perm on group, checking groups
         self.assertTrue(user_has_all_perms(user0, object0, ['Perm3']))
 
+    def test_check_sql(self):
+        """
+        Test that permission checks build their SQL once per shape of check
+        """
+        registration._check_cache.clear()
+        user0.grant('Perm1', object0)
+        group.grant('Perm2', object1)
+
+        # group ids of the user are loaded once and cached
+        get_user_group_ids(user0)
+        for obj in (object0, object1):
+            self.assertNumQueries(1, user_has_any_perms, user0, obj,
+                                  ['Perm1', 'Perm2'])
+        self.assertEqual(1, len(registration._check_cache))
+        sql = registration._check_cache.values()[0][0]
+        self.assertTrue(sql.startswith('SELECT 1 FROM'), sql)
+
+        self.assertTrue(user_has_any_perms(user0, object1, ['Perm1', 'Perm2']))
+        self.assertFalse(user_has_any_perms(user0, object1, ['Perm1', 'Perm2'],
+                                            False))
+        self.assertFalse(user_has_any_perms(user1, TestModel, ['Perm1']))
+        self.assertTrue(group_has_any_perms(group, TestModel))
+        self.assertEqual(4, len(registration._check_cache))
+        self.assertRaises(FieldError, user_has_any_perms, user0, object0,
+                          ['DoesNotExist'])
+
+    def test_check_orm(self):
+        """
+        Test that checks on databases without LIMIT are run through the ORM
+        """
+        user0.grant('Perm1', object0)
+        group.grant('Perm2', object1)
+        limit_vendors = registration._LIMIT_VENDORS
+        registration._LIMIT_VENDORS = ()
+        registration._check_cache.clear()
+        try:
+            self.assertTrue(user_has_perm(user0, 'Perm1', object0))
+            self.assertTrue(user_has_any_perms(user0, object1, ['Perm2']))
+            self.assertFalse(user_has_any_perms(user0, object1, ['Perm2'],
+                                                False))
+            self.assertFalse(user_has_all_perms(user0, object0,
+                                                ['Perm1', 'Perm2']))
+            self.assertTrue(group_has_any_perms(group, TestModel))
+            self.assertFalse(group_has_perm(group, 'Perm2', object0))
+            self.assertEqual({}, registration._check_cache)
+            self.assertRaises(FieldError, user_has_any_perms, user0, object0,
+                              ['DoesNotExist'])
+        finally:
+            registration._LIMIT_VENDORS = limit_vendors
+
+    def test_check_cache_size(self):
+        """
+        Test that clauses and SQL are only cached for registered perms, and
+        up to CACHE_SIZE entries
+        """
+        registration._clause_cache.clear()
+        registration._check_cache.clear()
+        self.assertRaises(FieldError, user_has_any_perms, user0, object0,
+                          ['DoesNotExist'])
+        registration._perm_clause(TestModel, ['DoesNotExist'])
+        self.assertEqual({}, registration._clause_cache)
+        self.assertEqual({}, registration._check_cache)
+
+        cache_size = registration.CACHE_SIZE
+        registration.CACHE_SIZE = 1
+        try:
+            user_has_any_perms(user0, object0, ['Perm1'])
+            user_has_any_perms(user0, object0, ['Perm2'])
+            self.assertEqual(1, len(registration._check_cache))
+            registration._perm_clause(TestModel, ['Perm1'])
+            registration._perm_clause(TestModel, ['Perm2'])
+            self.assertEqual(1, len(registration._clause_cache))
+        finally:
+            registration.CACHE_SIZE = cache_size
+
+    def test_check_sql_params(self):
+        """
+        Test that perm columns are compared with integers, postgresql does not
+        compare integer columns with booleans
+        """
+        for all_perms in (False, True):
+            sql, params = registration._check_sql(TestModelChild,
+                ['Perm1', 'Perm2'], 'user', True, all_perms)
+            self.assertEqual([int, int], [type(param) for param in params])
+            self.assertEqual([1, 1], params)
+
 
 class TestPermissionViews(TestCase):
     """ tests for user specific test views """
@@ -1100,7 +1467,90 @@ class TestPermissionViews(TestCase):
         response = c.get(url % user1.pk)
         self.assertEqual(200, response.status_code)
         self.assertTemplateUsed(response, 'object_permissions/permissions/objects.html')
+
+    def test_permissions_all_unpaged(self):
+        """ tests that permissions_all shows every object of each class """
+        url = '/user/%s/permissions/all'
+        objects = [obj] + [TestModel.objects.create(name='test%s' % i)
+                           for i in range(3)]
+        for object_ in objects:
+            user1.grant('Perm1', object_)
+        self.assertTrue(c.login(username=superuser.username, password='secret'))
+
+        original = views.OBJECTS_PER_PAGE
+        views.OBJECTS_PER_PAGE = 3
+        try:
+            response = c.get(url % user1.pk)
+            self.assertEqual(200, response.status_code)
+            objs = response.context['perm_dict']['TestModel']
+            self.assertEqual(set(objects), set(objs))
+            self.assertFalse('Group' in response.context['perm_dict'])
+        finally:
+            views.OBJECTS_PER_PAGE = original
+
+    def test_paged_permissions(self):
+        """ tests that paged_permissions shows objects a page at a time """
+        url = '/user/%s/permissions/all/paged'
+        objects = [obj] + [TestModel.objects.create(name='test%s' % i)
+                           for i in range(3)]
+        for object_ in objects:
+            user1.grant('Perm1', object_)
+        self.assertTrue(c.login(username=superuser.username, password='secret'))
+
+        original = views.OBJECTS_PER_PAGE
+        views.OBJECTS_PER_PAGE = 3
+        try:
+            response = c.get(url % user1.pk)
+            self.assertEqual(200, response.status_code)
+            page = response.context['perm_dict']['TestModel']
+            self.assertEqual(objects[:3], list(page))
+            self.assertEqual(objects[2].pk, page.after)
+            self.assertEqual([], list(response.context['perm_dict']['TestModelChild']))
+            self.assertFalse('Group' in response.context['perm_dict'])
+
+            response = c.get(url % user1.pk,
+                             {'class_name':'TestModel', 'after':page.after})
+            self.assertEqual(['TestModel'], response.context['perm_dict'].keys())
+            page = response.context['perm_dict']['TestModel']
+            self.assertEqual(objects[3:], list(page))
+            self.assertEqual(None, page.after)
+
+            for class_name in ('Foo', 'Group'):
+                response = c.get(url % user1.pk, {'class_name':class_name})
+                self.assertEqual(404, response.status_code)
+
+            response = c.get(url % user1.pk,
+                             {'class_name':'TestModel', 'after':'abc'})
+            self.assertEqual(404, response.status_code)
+        finally:
+            views.OBJECTS_PER_PAGE = original
     
+    def test_view_users(self):
+        """ tests that view_users renders with a fixed number of queries """
+        group = Group.objects.create(name='viewers')
+        user0.grant('Perm1', obj)
+        user0.grant('Perm2', obj)
+        group.grant('Perm3', obj)
+        request = RequestFactory().get('/')
+        request.user = superuser
+
+        data = views.view_users(request, obj, '/url', rest=True)
+        self.assertEqual([user0], data['users'])
+        self.assertEqual([group], data['groups'])
+        self.assertEqual(set(['Perm1', 'Perm2']),
+                         set(data['object_perms'][user0]))
+        self.assertEqual(['Perm3'], data['object_perms'][group])
+
+        def render():
+            response = views.view_users(request, obj, '/url')
+            self.assertTrue('Perm3' in response.content)
+        get_user_group_ids(superuser)
+        self.assertNumQueries(1, render)
+        for i in range(3):
+            User.objects.create(username='user%s' % i).grant('Perm4', obj)
+            Group.objects.create(name='viewers%s' % i).grant('Perm4', obj)
+        self.assertNumQueries(1, render)
+
     def test_permissions_generic_add(self):
         """
         Tests adding permissions to a new object using the generic perm view
@@ -2,9 +2,10 @@ from django.contrib.auth.models import User, Group
 from django.test import TestCase
 
 
-from object_permissions import register
-from object_permissions.registration import TestModel
-from object_permissions.signals import granted, revoked
+from object_permissions import register, bulk_grant, deferred_signals
+from object_permissions.registration import TestModel, TestModelChild
+from object_permissions.signals import granted, revoked, granted_batch, \
+    revoked_batch
 
 
 class TestSignals(TestCase):
@@ -146,3 +147,107 @@ class TestSignals(TestCase):
         self.assertRevoked(group, 'Perm1', object_)
         self.assertGranted(group, 'Perm2', object_)
         self.assertGranted(group, 'Perm3', object_)
+
+
+class TestDeferredSignals(TestCase):
+    """ tests for deferred_signals() """
+
+    def setUp(self):
+        self.tearDown()
+        self.user = User.objects.create(username='tester')
+        self.group = Group.objects.create(name='testers')
+        self.object0 = TestModel.objects.create(name='test0')
+        self.object1 = TestModel.objects.create(name='test1')
+        self.child = TestModelChild.objects.create(parent=self.object0)
+
+        self.signals = []
+        for signal in (granted, revoked, granted_batch, revoked_batch):
+            signal.connect(self.receiver)
+
+    def tearDown(self):
+        for signal in (granted, revoked, granted_batch, revoked_batch):
+            signal.disconnect(self.receiver)
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        TestModel.objects.all().delete()
+        TestModelChild.objects.all().delete()
+
+    def receiver(self, signal, sender, **kwargs):
+        if 'changes' in kwargs:
+            self.signals.append((signal, sender, kwargs['changes']))
+        else:
+            self.signals.append((signal, sender, kwargs['perm'],
+                                 kwargs['object']))
+
+    def test_batch(self):
+        """ signals are sent as batches per model when the block exits """
+        user, group = self.user, self.group
+        object0, object1, child = self.object0, self.object1, self.child
+        user.grant('Perm1', object0)
+        self.signals = []
+
+        with deferred_signals():
+            user.grant('Perm2', object0)
+            group.grant('Perm1', child)
+            user.revoke('Perm1', object0)
+            user.set_perms(['Perm3'], object1)
+            bulk_grant([group], ['Perm2'], [child], batch_signal=True)
+            self.assertEqual([], self.signals)
+
+        self.assertEqual([
+            (granted_batch, TestModel, [(user, 'Perm2', object0),
+                                        (user, 'Perm3', object1)]),
+            (granted_batch, TestModelChild, [(group, 'Perm1', child),
+                                             (group, 'Perm2', child)]),
+            (revoked_batch, TestModel, [(user, 'Perm1', object0)]),
+        ], self.signals)
+
+    def test_unbatched(self):
+        """ with batch=False the buffered signals are sent unchanged """
+        user, object0 = self.user, self.object0
+        with deferred_signals(batch=False):
+            user.grant('Perm1', object0)
+            user.revoke_all(object0)
+            self.assertEqual([], self.signals)
+        self.assertEqual([(granted, user, 'Perm1', object0),
+                          (revoked, user, 'Perm1', object0)], self.signals)
+
+    def test_nested(self):
+        """ signals are discarded on errors and sent by the outermost block """
+        user, object0 = self.user, self.object0
+        with deferred_signals(batch=False):
+            user.grant('Perm1', object0)
+            try:
+                with deferred_signals():
+                    user.grant('Perm2', object0)
+                    raise ValueError
+            except ValueError:
+                pass
+            with deferred_signals():
+                user.grant('Perm3', object0)
+            self.assertEqual([], self.signals)
+        self.assertEqual([(granted, user, 'Perm1', object0),
+                          (granted, user, 'Perm3', object0)], self.signals)
+
+        self.signals = []
+        user.grant('Perm4', object0)
+        self.assertEqual([(granted, user, 'Perm4', object0)], self.signals)
+
+    def test_executor(self):
+        """ signals are handed to the executor """
+        class Executor(object):
+            calls = []
+            def submit(self, function, *args):
+                self.calls.append((function, args))
+
+        executor = Executor()
+        with deferred_signals(executor=executor):
+            self.user.grant('Perm1', self.object0)
+        self.assertEqual([], self.signals)
+        self.assertEqual(1, len(executor.calls))
+
+        function, args = executor.calls[0]
+        function(*args)
+        self.assertEqual([(granted_batch, TestModel,
+                           [(self.user, 'Perm1', self.object0)])],
+                         self.signals)
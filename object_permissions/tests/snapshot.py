@@ -0,0 +1,130 @@
+import os
+import tempfile
+from StringIO import StringIO
+
+from django.contrib.auth.models import User, Group
+from django.core.management import call_command
+from django.test import TestCase
+
+from object_permissions import *
+from object_permissions import snapshot
+from object_permissions.registration import TestModel, TestModelBitmask, \
+    TestModelChild, UnknownPermissionException, permission_map
+from object_permissions.snapshot import SnapshotError, dump_perms, load_perms
+
+
+class TestSnapshot(TestCase):
+    """ tests for writing and loading permission snapshots """
+
+    def setUp(self):
+        self.tearDown()
+        self.user0 = User.objects.create(id=2, username='tester')
+        self.user1 = User.objects.create(id=3, username='tester2')
+        self.group = Group.objects.create(name='testers')
+        self.group.user_set.add(self.user1)
+        self.object0 = TestModel.objects.create(name='test0')
+        self.object1 = TestModel.objects.create(name='test1')
+        self.child = TestModelChild.objects.create(parent=self.object0)
+        self.bitmask = TestModelBitmask.objects.create(name='test')
+
+    def tearDown(self):
+        TestModel.objects.all().delete()
+        TestModelChild.objects.all().delete()
+        TestModelBitmask.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def grant(self):
+        user0, user1, group = self.user0, self.user1, self.group
+        user0.grant('Perm1', self.object0)
+        user0.grant('Perm4', self.object0)
+        group.grant('Perm2', self.object1)
+        user1.grant('Perm3', self.child)
+        user0.grant('Perm3', self.bitmask)
+        group.grant('Perm4', self.bitmask)
+
+    def check(self):
+        user0, user1, group = self.user0, self.user1, self.group
+        self.assertEqual(set(['Perm1', 'Perm4']),
+                         set(get_user_perms(user0, self.object0)))
+        self.assertEqual(['Perm2'], get_group_perms(group, self.object1))
+        self.assertEqual(['Perm2'], get_user_perms(user1, self.object1))
+        self.assertEqual(['Perm3'], get_user_perms(user1, self.child))
+        self.assertEqual(['Perm3'], get_user_perms(user0, self.bitmask))
+        self.assertEqual(['Perm4'], get_group_perms(group, self.bitmask))
+        self.assertEqual([], get_user_perms(user0, self.object1))
+
+    def test_round_trip(self):
+        """ loading a snapshot restores the permissions it was written from """
+        self.grant()
+        out = StringIO()
+        counts = dump_perms(out, size=1)
+        self.assertEqual(2, counts[TestModel])
+        self.assertEqual(1, counts[TestModelChild])
+        self.assertEqual(2, counts[TestModelBitmask])
+
+        self.user0.revoke_all(self.object0)
+        self.user0.grant('Perm2', self.object1)
+        self.group.revoke_all(self.bitmask)
+
+        counts = load_perms(StringIO(out.getvalue()))
+        self.assertEqual(2, counts[TestModel])
+        self.check()
+
+    def test_models(self):
+        """ only the given models are written and replaced """
+        self.grant()
+        out = StringIO()
+        self.assertEqual([TestModelChild],
+                         dump_perms(out, [TestModelChild]).keys())
+        self.user0.revoke_all(self.object0)
+        self.user1.revoke_all(self.child)
+
+        load_perms(StringIO(out.getvalue()))
+        self.assertEqual(['Perm3'], get_user_perms(self.user1, self.child))
+        self.assertEqual([], get_user_perms(self.user0, self.object0))
+
+    def test_perm_order(self):
+        """ perms are matched by name, not by their position """
+        self.grant()
+        out = StringIO()
+        get_model_perms = snapshot.get_model_perms
+        snapshot.get_model_perms = lambda model: \
+            list(get_model_perms(model))[::-1]
+        try:
+            dump_perms(out)
+        finally:
+            snapshot.get_model_perms = get_model_perms
+
+        permission_map[TestModel].objects.all().delete()
+        permission_map[TestModelBitmask].objects.all().delete()
+        load_perms(StringIO(out.getvalue()))
+        self.check()
+
+    def test_errors(self):
+        """ invalid snapshots are rejected """
+        self.grant()
+        out = StringIO()
+        dump_perms(out, [TestModel])
+        data = out.getvalue()
+
+        self.assertRaises(SnapshotError, load_perms, StringIO('foo'))
+        self.assertRaises(UnknownPermissionException, load_perms,
+                          StringIO(data.replace('Perm4', 'Perm9')))
+        self.assertEqual(2, permission_map[TestModel].objects.count())
+        self.assertRaises(SnapshotError, load_perms, StringIO(data[:-10]))
+
+    def test_commands(self):
+        """ dump_perms and load_perms commands """
+        self.grant()
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            call_command('dump_perms', path, 'TestModel', 'TestModelBitmask',
+                         verbosity=0)
+            self.user0.revoke_all(self.object0)
+            self.group.revoke_all(self.bitmask)
+            call_command('load_perms', path, verbosity=0)
+            self.check()
+        finally:
+            os.remove(path)
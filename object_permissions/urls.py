@@ -6,11 +6,13 @@ urlpatterns = patterns('object_permissions.views.groups',
     url(r'^group/(?P<id>\d+)/permissions/?$','user_permissions', name="group-permissions"),
     url(r'^group/(?P<id>\d+)/permissions/user/(?P<user_id>\d+)/?$','user_permissions', name="group-user-permissions"),
     url(r'^group/(?P<id>\d+)/permissions/all/?$','all_permissions', name="group-all-permissions"),
+    url(r'^group/(?P<id>\d+)/permissions/all/paged/?$','paged_permissions', name="group-paged-permissions"),
 )
 
 urlpatterns += patterns('object_permissions.views.permissions',
     # List all perms for a given user
     url(r'^user/(?P<id>\d+)/permissions/all/?$','all_permissions', name="user-all-permissions"),
+    url(r'^user/(?P<id>\d+)/permissions/all/paged/?$','paged_permissions', name="user-paged-permissions"),
     
     # add permissions on an object
     url(r'^user/(?P<user_id>\d+)/permissions/(?P<class_name>\w+)/?$','view_obj_permissions', name="user-add-permissions"),
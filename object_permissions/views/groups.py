@@ -9,7 +9,8 @@ from django.template import RequestContext
 
 from object_permissions import get_user_perms
 from object_permissions.signals import view_edit_user
-from object_permissions.views.permissions import ObjectPermissionForm
+from object_permissions.views.permissions import ObjectPermissionForm, \
+    paginate_objects
 
 
 @login_required
@@ -97,3 +98,42 @@ def all_permissions(request, id, \
     )
     else:
         return {'persona':group, 'perm_dict':repacked}
+
+
+@login_required
+def paged_permissions(request, id, \
+                      template='object_permissions/permissions/objects.html', rest=False,
+                      per_page=None):
+    """
+    Paged version of all_permissions().  Objects are shown a page at a time,
+    see paginate_objects()
+    
+    @param id: id of group
+    @param template: template to render the results with, default is
+    permissions/objects.html
+    @param per_page: objects of each class per page, default OBJECTS_PER_PAGE
+    @return for rest, a dictionary that also maps class names to the after
+    parameter of their next page, or None for the last page
+    """
+    user = request.user
+    group = get_object_or_404(Group, pk=id)
+    
+    if not (user.is_superuser or group.user_set.filter(pk=user.pk).exists()):
+        if not rest:
+            return HttpResponseForbidden('You do not have sufficient privileges')
+        else:
+            return {'error':'You do not have sufficient privileges'}
+    
+    pages = lambda models, size, after: group.iter_objects_any_perms(
+        models=models, size=size, after=after)
+    repacked = paginate_objects(request, pages, per_page)
+
+    if not rest:
+        return render_to_response(template, \
+            {'persona':group, 'perm_dict':repacked}, \
+        context_instance=RequestContext(request),
+    )
+    else:
+        after = dict((class_name, objs.after) \
+                     for class_name, objs in repacked.items())
+        return {'persona':group, 'perm_dict':repacked, 'after':after}
@@ -3,18 +3,81 @@ import json
 from django import forms
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, HttpResponseNotFound, HttpResponseForbidden
+from django.http import HttpResponse, HttpResponseNotFound, \
+    HttpResponseForbidden, Http404
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
 
 from object_permissions import get_user_perms, get_group_perms, \
-    get_model_perms, get_users, get_groups, get_class
+    get_model_perms, get_object_perms, get_class
+from object_permissions.registration import permission_map
 from object_permissions.models import Group
 from object_permissions.signals import view_add_user, view_remove_user, \
     view_edit_user
 
 
+OBJECTS_PER_PAGE = 100
+"""
+Number of objects of each class shown by the paged_permissions views.  Further
+objects are reached with a link to the next page of that class.
+"""
+
+
+class ObjectPage(list):
+    """
+    A page of objects.  after is the primary key to continue the next page
+    from, or None when this is the last page.
+    """
+    after = None
+
+
+def paginate_objects(request, pages, per_page=None):
+    """
+    Load the first page of objects of each class for the paged_permissions
+    views.  Pages are selected with the class_name and after GET parameters,
+    class_name limits the page to one class and after continues the class
+    after the given primary key.
+
+    @param pages - function(models, size, after) returning a generator of
+    (model, primary keys), e.g. user.iter_objects_any_perms
+    @param per_page - objects per page, default OBJECTS_PER_PAGE
+    @return dictionary mapping class names to ObjectPages
+    """
+    size = per_page or OBJECTS_PER_PAGE
+    class_name = request.GET.get('class_name')
+    after = request.GET.get('after') or None
+    if class_name:
+        try:
+            models = [get_class(class_name)]
+        except KeyError:
+            raise Http404
+        if models[0] is Group:
+            raise Http404
+        if after is not None:
+            try:
+                after = models[0]._meta.pk.to_python(after)
+            except ValidationError:
+                raise Http404
+    else:
+        # exclude group permissions from this view, they are treated special
+        models = [model for model in permission_map if model is not Group]
+        after = None
+
+    # XXX repack so that class names are used as keys instead of the classes.
+    # Django templates will automatically execute anything callable if you
+    # try to use it, even classes!  #5619
+    repacked = {}
+    for model in models:
+        pks = next(pages([model], size, after), (model, []))[1]
+        objs = ObjectPage(model.objects.filter(pk__in=pks).order_by('pk'))
+        if len(pks) == size:
+            objs.after = pks[-1]
+        repacked[model.__name__] = objs
+    return repacked
+
+
 class ObjectPermissionForm(forms.Form):
     """
     Form used for editing permissions
@@ -153,14 +216,20 @@ def view_users(request, object_, url, \
     @param url: base url for editing permissions
     @param template: template for rendering User/Group list.
     """
-    users = get_users(object_, groups=False)
-    groups = get_groups(object_)
+    # perms of all users and groups are loaded with one query, and attached
+    # to the object for the permissions filter of the rows
+    perms = get_object_perms(object_)
+    users = [p for p in perms if isinstance(p, User)]
+    groups = [p for p in perms if isinstance(p, Group)]
+    users.sort(key=lambda user: user.pk)
+    groups.sort(key=lambda group: group.pk)
 
     if not rest:
         return render_to_response(template, \
             {'object': object_,
              'users':users,
              'groups':groups,
+             'object_perms':perms,
              'url':url},
         context_instance=RequestContext(request),
     )
@@ -168,6 +237,7 @@ def view_users(request, object_, url, \
         return {'object': object_,
              'users':users,
              'groups':groups,
+             'object_perms':perms,
              'url':url}
 
 
@@ -372,4 +442,33 @@ def all_permissions(request, id,
     return render_to_response(template,
             {'persona':user_detail, 'perm_dict':repacked},
         context_instance=RequestContext(request),
-    )
\ No newline at end of file
+    )
+
+
+@login_required
+def paged_permissions(request, id,
+                      template="object_permissions/permissions/objects.html",
+                      per_page=None):
+    """
+    Paged version of all_permissions().  Objects are shown a page at a time,
+    see paginate_objects()
+    
+    @param id: id of user
+    @param template: template to render the results with, default is
+    permissions/objects.html
+    @param per_page: objects of each class per page, default OBJECTS_PER_PAGE
+    """
+    user = request.user
+    
+    if not user.is_superuser:
+        return HttpResponseForbidden('You do not have sufficient privileges')
+    
+    user_detail = get_object_or_404(User, pk=id)
+    pages = lambda models, size, after: user_detail.iter_objects_any_perms(
+        groups=False, models=models, size=size, after=after)
+    repacked = paginate_objects(request, pages, per_page)
+
+    return render_to_response(template,
+            {'persona':user_detail, 'perm_dict':repacked},
+        context_instance=RequestContext(request),
+    )